@@ -1,46 +1,193 @@
+import hashlib
+import json
+import logging
 import os
-import requests
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
 from dotenv import load_dotenv
+import telemetry
+from ratelimit import RateLimited
+from startup import Lazy, lazy_import
+
+requests = lazy_import('requests')
+
+log = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Checked when a request is made, so the app can start (and serve
+# everything but analysis) without it
 TOGETHER_API_KEY = os.getenv('TOGETHER_API_KEY')
-if not TOGETHER_API_KEY:
-    raise ValueError("TOGETHER_API_KEY not found in environment variables")
+
+TOGETHER_API_URL = os.getenv('TOGETHER_API_URL', "https://api.together.ai/v1/completions")
+ANALYSIS_MAX_WORKERS = int(os.getenv('ANALYSIS_MAX_WORKERS', 8))
+
+def _make_session():
+    session = requests.Session()
+    adapter = telemetry.timed_adapter('together', pool_connections=1, pool_maxsize=ANALYSIS_MAX_WORKERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# One keep-alive session shared by every analysis call in this worker
+_session = Lazy(_make_session)
+_executor = ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS, thread_name_prefix='analysis')
+
+# Called before every Together.ai request; the app installs its upstream rate limit here
+quota_check = None
+
+# Prompt templates; editing one changes its prompt_version() and invalidates stored results
+ANALYSIS_PROMPT = """<s>[INST] Eres un asistente experto en análisis de texto. Por favor analiza este texto y proporciona:
+1. Un resumen conciso
+2. Ideas y conceptos principales discutidos
+3. Puntos importantes que necesitan atención
+4. Patrones o temas notables
+
+Texto a analizar:
+{text} [/INST]"""
+
+ACTION_ITEMS_PROMPT = """<s>[INST] Eres un asistente experto en planificación. Revisa este texto y crea una lista priorizada de acciones. Enfócate en:
+1. Acciones inmediatas (Alta prioridad)
+2. Próximos pasos
+3. Consideraciones futuras
+
+Formatea tu respuesta como una lista clara y accionable.
+
+Texto a analizar:
+{text} [/INST]"""
+
+SUGGESTIONS_PROMPT = """<s>[INST] Eres un asistente experto en mejora continua. Revisa este texto y sugiere mejoras. Enfócate en:
+1. Áreas de oportunidad
+2. Posibles mejoras
+3. Enfoques alternativos
+4. Consideraciones adicionales
+
+Formatea tu respuesta con sugerencias claras y accionables.
+
+Texto a analizar:
+{text} [/INST]"""
+
+SUMMARY_PROMPT = """<s>[INST] Eres un asistente experto en síntesis de información. Crea un resumen conciso del siguiente texto, enfocándote en:
+1. Puntos principales discutidos
+2. Conclusiones clave
+3. Contexto importante
+4. Detalles notables
+
+Incluye todos los puntos críticos.
+
+Texto a resumir:
+{text} [/INST]"""
+
+MERGED_PROMPT = """<s>[INST] Eres un asistente experto en análisis de texto, planificación y mejora continua. Revisa este texto y responde con exactamente cuatro secciones, cada una precedida por su etiqueta en una línea propia:
+
+[ANALISIS]
+Un resumen conciso, ideas y conceptos principales, puntos que necesitan atención y patrones o temas notables.
+
+[ACCIONES]
+Una lista priorizada de acciones: acciones inmediatas (alta prioridad), próximos pasos y consideraciones futuras.
+
+[SUGERENCIAS]
+Áreas de oportunidad, posibles mejoras, enfoques alternativos y consideraciones adicionales.
+
+[RESUMEN]
+Un resumen conciso con los puntos principales, conclusiones clave, contexto importante y detalles notables.
+
+Texto a analizar:
+{text} [/INST]"""
+
+CHUNK_PROMPT = """<s>[INST] Eres un asistente experto en análisis de texto. El siguiente texto es un fragmento de una transcripción más larga. Toma notas breves del fragmento en exactamente cuatro secciones, cada una precedida por su etiqueta en una línea propia:
+
+[ANALISIS]
+Ideas y conceptos principales, puntos que necesitan atención y patrones o temas notables.
+
+[ACCIONES]
+Acciones mencionadas o necesarias, indicando su prioridad.
+
+[SUGERENCIAS]
+Áreas de oportunidad y posibles mejoras.
+
+[RESUMEN]
+Los puntos principales y conclusiones del fragmento.
+
+Fragmento:
+{text} [/INST]"""
+
+REDUCE_PROMPT = """<s>[INST] Eres un asistente experto en síntesis de información. Estas son notas parciales tomadas sobre fragmentos consecutivos de una misma transcripción. Combínalas en una sola respuesta sin repetir puntos. {instructions}
+
+Notas parciales:
+{text} [/INST]"""
+
+# What the reduce step should produce for each section
+REDUCE_INSTRUCTIONS = {
+    'analysis': "Proporciona un resumen conciso, ideas y conceptos principales, puntos que necesitan atención y patrones o temas notables.",
+    'action_items': "Crea una lista priorizada de acciones: acciones inmediatas (alta prioridad), próximos pasos y consideraciones futuras.",
+    'suggestions': "Sugiere mejoras claras y accionables: áreas de oportunidad, posibles mejoras, enfoques alternativos y consideraciones adicionales.",
+    'summary': "Crea un resumen conciso con los puntos principales, conclusiones clave, contexto importante y detalles notables.",
+}
+
+PROMPT_TEMPLATES = {
+    'analysis': ANALYSIS_PROMPT,
+    'action_items': ACTION_ITEMS_PROMPT,
+    'suggestions': SUGGESTIONS_PROMPT,
+    'summary': SUMMARY_PROMPT,
+    'merged': MERGED_PROMPT,
+    'chunk': CHUNK_PROMPT,
+    'reduce': REDUCE_PROMPT + json.dumps(REDUCE_INSTRUCTIONS, sort_keys=True),
+}
+
+MODEL = "mistralai/Mixtral-8x7B-Instruct-v0.1"
+SAMPLING_PARAMS = {
+    "temperature": 0.7,
+    "top_p": 0.7,
+    "top_k": 50,
+    "repetition_penalty": 1.1,
+}
+
+def prompt_version(name: str) -> str:
+    """Short hash of a prompt template, used to version stored results"""
+    return hashlib.sha256(PROMPT_TEMPLATES[name].encode('utf-8')).hexdigest()[:12]
+
+def _headers() -> Dict[str, str]:
+    if not TOGETHER_API_KEY:
+        raise ValueError("TOGETHER_API_KEY not found in environment variables")
+    return {
+        "Authorization": f"Bearer {TOGETHER_API_KEY}",
+        "Content-Type": "application/json"
+    }
 
 def _get_completion(prompt: str, max_tokens: int = 1000) -> str:
     """Helper function to get completion from Together.ai API"""
+    # RateLimited is left unwrapped so callers can answer 429 with its retry_after
+    if quota_check:
+        quota_check()
     try:
-        headers = {
-            "Authorization": f"Bearer {TOGETHER_API_KEY}",
-            "Content-Type": "application/json"
-        }
+        headers = _headers()
         
         data = {
-            "model": "mistralai/Mixtral-8x7B-Instruct-v0.1",
+            "model": MODEL,
             "prompt": prompt,
-            "temperature": 0.7,
-            "top_p": 0.7,
-            "top_k": 50,
-            "repetition_penalty": 1.1,
+            **SAMPLING_PARAMS,
             "max_tokens": max_tokens
         }
         
-        print(f"Making API request with data: {data}")  # Debug log
-        
-        response = requests.post(
-            "https://api.together.ai/v1/completions",
+        # Sizes only: prompts carry whole transcripts
+        log.debug("Together.ai request", extra={'prompt_chars': len(prompt), 'max_tokens': max_tokens})
+
+        response = _session.get().post(
+            TOGETHER_API_URL,
             headers=headers,
             json=data,
             timeout=30
         )
         
-        print(f"API response status: {response.status_code}")  # Debug log
-        print(f"API response text: {response.text}")  # Debug log
-        
+        log.debug("Together.ai response", extra={'status': response.status_code, 'bytes': len(response.content)})
+
         if response.status_code != 200:
-            raise Exception(f"API returned status code {response.status_code}: {response.text}")
+            raise Exception(f"API returned status code {response.status_code}: {response.text[:500]}")
             
         result = response.json()
         if not result.get('choices') or not result['choices'][0].get('text'):
@@ -49,23 +196,48 @@ def _get_completion(prompt: str, max_tokens: int = 1000) -> str:
         return result['choices'][0]['text'].strip()
             
     except Exception as e:
-        print(f"API error: {str(e)}")  # Debug log
+        log.error(f"API error: {str(e)}")
         raise Exception(f"Together.ai API error: {str(e)}")
 
+def stream_completion(prompt: str, max_tokens: int = 1000, responses=None):
+    """
+    Yield completion text from Together.ai as it is generated.
+    The open response is appended to `responses` so another thread can close it to cancel.
+    """
+    if quota_check:
+        quota_check()
+    response = _session.get().post(
+        TOGETHER_API_URL,
+        headers=_headers(),
+        json={"model": MODEL, "prompt": prompt, **SAMPLING_PARAMS, "max_tokens": max_tokens, "stream": True},
+        timeout=30,
+        stream=True
+    )
+    if responses is not None:
+        responses.append(response)
+    try:
+        if response.status_code != 200:
+            raise Exception(f"API returned status code {response.status_code}: {response.text[:500]}")
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            payload = line[len('data:'):].strip()
+            if payload == '[DONE]':
+                return
+            choices = json.loads(payload).get('choices') or [{}]
+            token = choices[0].get('text')
+            if token:
+                yield token
+    finally:
+        response.close()
+
 def analyze_brainstorming(text: str) -> Dict[str, Any]:
     """
     Analyze transcribed text using Mixtral-8x7B.
     Returns insights in a conversational format.
     """
     try:
-        prompt = f"""<s>[INST] Eres un asistente experto en análisis de texto. Por favor analiza este texto y proporciona:
-1. Un resumen conciso
-2. Ideas y conceptos principales discutidos
-3. Puntos importantes que necesitan atención
-4. Patrones o temas notables
-
-Texto a analizar:
-{text} [/INST]"""
+        prompt = ANALYSIS_PROMPT.format(text=text)
 
         analysis = _get_completion(prompt)
         return {
@@ -73,8 +245,11 @@ Texto a analizar:
             'analysis': analysis
         }
 
+    except RateLimited:
+        raise
+
     except Exception as e:
-        print(f"Analysis error: {str(e)}")  # Debug log
+        log.error(f"Analysis error: {str(e)}")
         return {
             'success': False,
             'error': str(e)
@@ -86,15 +261,7 @@ def generate_action_items(text: str) -> Dict[str, Any]:
     Returns a prioritized list of actions.
     """
     try:
-        prompt = f"""<s>[INST] Eres un asistente experto en planificación. Revisa este texto y crea una lista priorizada de acciones. Enfócate en:
-1. Acciones inmediatas (Alta prioridad)
-2. Próximos pasos
-3. Consideraciones futuras
-
-Formatea tu respuesta como una lista clara y accionable.
-
-Texto a analizar:
-{text} [/INST]"""
+        prompt = ACTION_ITEMS_PROMPT.format(text=text)
 
         action_items = _get_completion(prompt)
         return {
@@ -102,8 +269,11 @@ Texto a analizar:
             'action_items': action_items
         }
 
+    except RateLimited:
+        raise
+
     except Exception as e:
-        print(f"Action items error: {str(e)}")  # Debug log
+        log.error(f"Action items error: {str(e)}")
         return {
             'success': False,
             'error': str(e)
@@ -115,16 +285,7 @@ def suggest_improvements(text: str) -> Dict[str, Any]:
     Returns detailed suggestions for the discussed topics.
     """
     try:
-        prompt = f"""<s>[INST] Eres un asistente experto en mejora continua. Revisa este texto y sugiere mejoras. Enfócate en:
-1. Áreas de oportunidad
-2. Posibles mejoras
-3. Enfoques alternativos
-4. Consideraciones adicionales
-
-Formatea tu respuesta con sugerencias claras y accionables.
-
-Texto a analizar:
-{text} [/INST]"""
+        prompt = SUGGESTIONS_PROMPT.format(text=text)
 
         suggestions = _get_completion(prompt)
         return {
@@ -132,8 +293,11 @@ Texto a analizar:
             'suggestions': suggestions
         }
 
+    except RateLimited:
+        raise
+
     except Exception as e:
-        print(f"Suggestions error: {str(e)}")  # Debug log
+        log.error(f"Suggestions error: {str(e)}")
         return {
             'success': False,
             'error': str(e)
@@ -145,16 +309,7 @@ def summarize_text(text: str) -> Dict[str, Any]:
     Perfect for getting a quick overview of spoken content.
     """
     try:
-        prompt = f"""<s>[INST] Eres un asistente experto en síntesis de información. Crea un resumen conciso del siguiente texto, enfocándote en:
-1. Puntos principales discutidos
-2. Conclusiones clave
-3. Contexto importante
-4. Detalles notables
-
-Incluye todos los puntos críticos.
-
-Texto a resumir:
-{text} [/INST]"""
+        prompt = SUMMARY_PROMPT.format(text=text)
 
         summary = _get_completion(prompt)
         return {
@@ -162,9 +317,162 @@ Texto a resumir:
             'summary': summary
         }
 
+    except RateLimited:
+        raise
+
     except Exception as e:
-        print(f"Summary error: {str(e)}")  # Debug log
+        log.error(f"Summary error: {str(e)}")
         return {
             'success': False,
             'error': str(e)
         }
+
+# Result key each analysis puts its text under, in the order the UI shows them
+SECTIONS = {
+    'analysis': analyze_brainstorming,
+    'action_items': generate_action_items,
+    'suggestions': suggest_improvements,
+    'summary': summarize_text,
+}
+
+MERGED_MAX_TOKENS = 2500
+
+MERGED_MARKERS = {
+    'analysis': 'ANALISIS',
+    'action_items': 'ACCIONES',
+    'suggestions': 'SUGERENCIAS',
+    'summary': 'RESUMEN',
+}
+
+def result_key(section: str, content_hash: str, merged: bool = False, max_tokens: int = 1000, chunked=None) -> str:
+    """
+    Cache key for one analysis section: everything that can change its output
+    (content, prompt template, model and sampling parameters) is hashed in.
+    `chunked` is the chunking configuration when the result came from map-reduce.
+    """
+    template = 'merged' if merged else section
+    if merged:
+        max_tokens = MERGED_MAX_TOKENS
+    version = prompt_version(template)
+    if chunked is not None:
+        version = [prompt_version('chunk'), prompt_version('reduce'), chunked]
+    material = json.dumps([section, content_hash, version, MODEL, SAMPLING_PARAMS, max_tokens], sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def _timed(func, text: str):
+    start = time.perf_counter()
+    result = func(text)
+    return result, round(time.perf_counter() - start, 3)
+
+def run_all_analyses(text: str, merged: bool = False, sections=None) -> Dict[str, Any]:
+    """
+    Run the four analyses (or just `sections`) concurrently on the shared session.
+    With merged=True a single completion produces all four sections instead.
+    Returns every section that succeeded, plus per-section errors and timings.
+    Sections turned away by the Together.ai quota are errors too, and the
+    RateLimited is returned under 'rate_limited' for the caller to raise.
+    """
+    if merged:
+        return merged_analysis(text)
+
+    sections = sections or list(SECTIONS)
+    futures = {key: _executor.submit(_timed, SECTIONS[key], text) for key in sections}
+    results = {'errors': {}, 'timings': {}}
+    for key, future in futures.items():
+        try:
+            result, elapsed = future.result()
+        except RateLimited as e:
+            results['errors'][key] = str(e)
+            results['rate_limited'] = e
+            continue
+        results['timings'][key] = elapsed
+        if result.get('success'):
+            results[key] = result.get(key, '')
+        else:
+            results['errors'][key] = result.get('error', 'Analysis failed')
+    return results
+
+def merged_analysis(text: str) -> Dict[str, Any]:
+    """
+    Produce all four sections from one Mixtral-8x7B completion.
+    Sections missing from the output are reported as errors.
+    """
+    start = time.perf_counter()
+    results = {'errors': {}, 'timings': {}}
+    try:
+        prompt = MERGED_PROMPT.format(text=text)
+
+        completion = _get_completion(prompt, max_tokens=MERGED_MAX_TOKENS)
+        sections = _split_sections(completion)
+        for key, marker in MERGED_MARKERS.items():
+            if sections.get(marker):
+                results[key] = sections[marker]
+            else:
+                results['errors'][key] = f"Section {marker} missing from merged completion"
+
+    except RateLimited as e:
+        results['errors'] = {key: str(e) for key in SECTIONS}
+        results['rate_limited'] = e
+
+    except Exception as e:
+        log.error(f"Merged analysis error: {str(e)}")
+        results['errors'] = {key: str(e) for key in SECTIONS}
+
+    results['timings']['merged'] = round(time.perf_counter() - start, 3)
+    return results
+
+def _split_sections(completion: str) -> Dict[str, str]:
+    """Split a merged completion on its [MARKER] lines."""
+    pattern = r'^\s*\[(%s)\]\s*$' % '|'.join(MERGED_MARKERS.values())
+    parts = re.split(pattern, completion, flags=re.MULTILINE)
+    # re.split yields [preamble, marker, body, marker, body, ...]
+    return {parts[i]: parts[i + 1].strip() for i in range(1, len(parts) - 1, 2)}
+
+def stream_analyses(text: str, sections=None, max_queue: int = 64):
+    """
+    Stream the given analysis sections concurrently.
+    Yields (section, kind, payload) where kind is 'token', 'done' (payload is
+    elapsed seconds) or 'error'. The queue is bounded so a slow client pauses
+    the upstream reads; closing the generator cancels every upstream request.
+    """
+    sections = sections or list(SECTIONS)
+    events = queue.Queue(maxsize=max_queue)
+    cancelled = threading.Event()
+    responses = []
+
+    def put(event) -> bool:
+        while not cancelled.is_set():
+            try:
+                events.put(event, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(section: str):
+        start = time.perf_counter()
+        try:
+            prompt = PROMPT_TEMPLATES[section].format(text=text)
+            for token in stream_completion(prompt, responses=responses):
+                if not put((section, 'token', token)):
+                    return
+            put((section, 'done', round(time.perf_counter() - start, 3)))
+        except Exception as e:
+            if not cancelled.is_set():
+                put((section, 'error', f"Together.ai API error: {str(e)}"))
+
+    # Dedicated threads: a stalled client must not tie up the shared analysis pool
+    for section in sections:
+        threading.Thread(target=produce, args=(section,), daemon=True, name=f'stream-{section}').start()
+
+    remaining = len(sections)
+    try:
+        while remaining:
+            section, kind, payload = events.get()
+            if kind != 'token':
+                remaining -= 1
+            yield section, kind, payload
+    finally:
+        cancelled.set()
+        for response in list(responses):
+            response.close()
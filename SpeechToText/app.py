@@ -1,15 +1,43 @@
+import hashlib
+import json
+import math
 import os
+import click
+import fcntl
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, func, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import deferred
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from ai_analysis import analyze_brainstorming, generate_action_items, suggest_improvements, summarize_text
+import ai_analysis
+import assets
+from ai_analysis import SECTIONS, result_key, run_all_analyses, stream_analyses
+from audio_pipeline import AudioError, transcribe_file
+from chunking import chunk_config, map_reduce_analysis, needs_chunking
+from compression import BackgroundMigration, codec, compress_existing, install as install_compression
+from database import GROUP_COMMIT, CommitGroup, MaintenanceJob, engine_options, install_pragmas, maintain
+from incremental_analysis import SessionStore
+from jobqueue import JobFailed, JobQueue, Worker
+from migrations import PREVIEW_CHARS, upgrade
+from pagination import decode_cursor, encode_cursor
+from ratelimit import RateLimited, RateLimiter, client_address
+from search import TranscriptSearch, install as install_search
+from startup import load, on_warmup
+import telemetry
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///transcripts.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///transcripts.db')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+os.makedirs(app.instance_path, exist_ok=True)
+# Request latency, query counts and Together.ai timings on /metrics, added up
+# over all workers through this file; set up first so every other hook is timed too
+telemetry.init_app(app, os.getenv('METRICS_DB_PATH', os.path.join(app.instance_path, 'metrics.db')))
 
 db = SQLAlchemy(app)
 login_manager = LoginManager()
@@ -25,22 +53,252 @@ class User(UserMixin, db.Model):
 class Transcript(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    # Plain text of rows saved before compression; '' once content_z is set.
+    # Both are only loaded when accessed; listings use preview and length instead
+    _content = deferred(db.Column('content', db.Text, nullable=False, default=''))
+    content_z = deferred(db.Column(db.LargeBinary))
+    preview = db.Column(db.String(PREVIEW_CHARS), nullable=False, default='', server_default='')
+    length = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    analyses = db.relationship('AnalysisResult', backref='transcript', lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_transcript_user_created', 'user_id', 'created_at', 'id'),
+    )
+
+    @hybrid_property
+    def content(self):
+        if self.content_z is not None:
+            return codec.decompress(self.content_z)
+        return self._content
+
+    @content.inplace.setter
+    def _content_setter(self, content):
+        self.content_z = codec.compress(content)
+        self._content = ''
+        self.preview = content[:PREVIEW_CHARS]
+        self.length = len(content)
+
+    @content.inplace.expression
+    @classmethod
+    def _content_expression(cls):
+        return case((cls.content_z.is_(None), cls._content), else_=func.transcript_text(cls.content_z))
+
+class CompressionDictionary(db.Model):
+    """Preset deflate dictionary for transcript blobs; see compression.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class AnalysisResult(db.Model):
+    """One stored AI analysis section, keyed by ai_analysis.result_key()."""
+    id = db.Column(db.Integer, primary_key=True)
+    transcript_id = db.Column(db.Integer, db.ForeignKey('transcript.id'), nullable=False, index=True)
+    section = db.Column(db.String(32), nullable=False)
+    cache_key = db.Column(db.String(64), nullable=False, unique=True)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
 with app.app_context():
-    db.create_all()
+    install_pragmas(db.engine)
+    install_compression(db.engine)
+    telemetry.count_queries(db.engine)
+    # Importing the app never touches the database; the schema is created by
+    # migrate(), in the gunicorn master or else on each worker's first request
+    codec.bind(db.engine)
+    transcript_search = TranscriptSearch(db.engine)
+    # DB_GROUP_COMMIT=1 batches concurrent saves into shared transactions
+    commit_group = CommitGroup(db.engine) if GROUP_COMMIT else None
+    maintenance_job = MaintenanceJob(db.engine)
+    # Compresses rows saved before content_z existed; TRANSCRIPT_COMPRESSION_BACKGROUND=0 disables
+    compression_migration = BackgroundMigration(db.engine)
+
+# Analyses and audio transcription can run in the background (?async=1);
+# jobs.db sits next to the app database and is shared by all workers
+jobs = JobQueue(os.getenv('JOB_DB_PATH', os.path.join(app.instance_path, 'jobs.db')))
+
+@app.before_request
+def start_maintenance():
+    ensure_migrated()
+    # Started on the first request so each forked worker runs its own timer
+    maintenance_job.start()
+    compression_migration.start()
+    jobs.start_embedded(context=app.app_context)
+
+# Set once this process, or the master it was forked from, has migrated
+_migrated = False
+
+def migrate():
+    """Create or upgrade the schema and the search index."""
+    global _migrated
+    with app.app_context():
+        db.create_all()
+        upgrade(db.engine)
+        install_search(db.engine)
+        codec.reload()
+        # Run in the gunicorn master too: don't let its pooled connections
+        # leak into the forked workers
+        db.engine.dispose()
+    _migrated = True
+
+def ensure_migrated():
+    """migrate() unless already done; without preload, workers take turns under a file lock."""
+    if _migrated:
+        return
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'migrate.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if not _migrated:
+                migrate()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    """Create or upgrade the database schema."""
+    migrate()
+    print("Database is up to date")
+
+@on_warmup
+def load_analysis():
+    # NLTK corpora and the tokenizer are the bulk of a worker's memory;
+    # loaded once in the master, they are shared by every worker
+    import text_analysis
+    text_analysis.get_analyzer()
+    text_analysis._word_tokenizer()
+    load(ai_analysis.requests)
+    ai_analysis._session.get()
+
+@app.cli.command('compress-transcripts')
+@click.option('--retrain', is_flag=True, help='Train a new dictionary from the current transcripts first.')
+@click.option('--batch-size', default=200, show_default=True)
+def compress_transcripts(retrain, batch_size):
+    """Compress transcripts still stored as plain text."""
+    print(f"Compressed {compress_existing(db.engine, batch_size=batch_size, retrain=retrain)} transcripts")
+
+@app.cli.command('db-maintenance')
+@click.option('--vacuum/--no-vacuum', default=None, help='Force or skip VACUUM (default: only when fragmented).')
+@click.option('--analyze', is_flag=True, help='Run a full ANALYZE instead of PRAGMA optimize.')
+def db_maintenance(vacuum, analyze):
+    """Checkpoint the WAL, refresh statistics and reclaim free space."""
+    print(json.dumps(maintain(db.engine, vacuum=vacuum, analyze=analyze)))
+
+# AI analyses and transcriptions are rate limited per user, and every
+# Together.ai call also against TOGETHER_QUOTA; buckets are shared by all workers
+rate_limiter = RateLimiter(os.getenv('RATE_LIMIT_DB_PATH', os.path.join(app.instance_path, 'ratelimit.db')))
+rate_limiter.configure('analysis', os.getenv('RATE_LIMIT_ANALYSIS', '30/hour'))
+rate_limiter.configure('transcription', os.getenv('RATE_LIMIT_TRANSCRIPTION', '20/hour'))
+rate_limiter.configure('together', os.getenv('TOGETHER_QUOTA', ''), upstream=True)
+ai_analysis.quota_check = lambda: rate_limiter.check('together')
+# Endpoint -> (per-user scope, upstream it spends)
+RATE_LIMITED = {
+    'analyze_transcript': ('analysis', 'together'),
+    'stream_analysis': ('analysis', 'together'),
+    'transcribe_audio': ('transcription', None),
+}
+
+@app.before_request
+def rate_limit():
+    limited = RATE_LIMITED.get(request.endpoint)
+    if limited is None:
+        return None
+    # Runs before anything reads the body, so a rejected upload is never buffered
+    scope, upstream = limited
+    client = str(current_user.id) if current_user.is_authenticated else client_address(request)
+    retry_after = rate_limiter.hit(scope, client)
+    if not retry_after and upstream:
+        retry_after = rate_limiter.peek(upstream)
+    if retry_after:
+        return _too_many_requests(retry_after)
+
+def _too_many_requests(retry_after):
+    response = jsonify({'error': 'Too many requests. Please try again shortly.', 'retry_after': math.ceil(retry_after)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+@app.route('/quota')
+@login_required
+def quota():
+    """The current user's rate limit usage, and overall Together.ai usage."""
+    days = request.args.get('days', 1, type=int)
+    return jsonify(rate_limiter.usage(days=days, client=str(current_user.id)))
+
+@app.cli.command('jobs-worker')
+@click.option('--threads', default=2, show_default=True)
+def jobs_worker(threads):
+    """Run queued analysis and transcription jobs until interrupted."""
+    telemetry.metrics.start()
+    Worker(jobs, threads=threads, context=app.app_context).run_forever()
+
+def _job_accepted(job_id):
+    response = jsonify(_job_json(jobs.get(job_id)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id=job_id)
+    return response
+
+def _job_json(job):
+    data = {key: job[key] for key in ('id', 'type', 'status', 'attempts', 'progress', 'result', 'error')}
+    data['status_url'] = url_for('job_status', job_id=job['id'])
+    return data
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+LIST_PAGE_SIZE = 50
+
+def _transcript_page(user_id, limit=LIST_PAGE_SIZE, cursor=None):
+    """Newest-first page of a user's transcripts without their content.
+
+    Keyset pagination over (created_at, id), which ix_transcript_user_created
+    serves directly. Returns (rows, next cursor or None).
+    """
+    query = db.session.query(
+        Transcript.id, Transcript.title, Transcript.created_at, Transcript.preview, Transcript.length
+    ).filter(Transcript.user_id == user_id)
+    if cursor:
+        created_at, id = decode_cursor(cursor, datetime.fromisoformat, int)
+        query = query.filter(tuple_(Transcript.created_at, Transcript.id) < (created_at, id))
+    rows = query.order_by(Transcript.created_at.desc(), Transcript.id.desc()).limit(limit + 1).all()
+
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1].created_at.isoformat(), page[-1].id) if len(rows) > limit else None
+    return page, next_cursor
+
+index_shell = assets.CachedPage('index.html', cache_control='private, no-cache')
+
 @app.route('/')
 @login_required
 def index():
-    transcripts = Transcript.query.filter_by(user_id=current_user.id).order_by(Transcript.created_at.desc()).all()
-    return render_template('index.html', transcripts=transcripts)
+    # The same shell for every user; the list is loaded from /transcripts
+    return index_shell.response()
+
+@app.route('/transcripts')
+@login_required
+def list_transcripts():
+    try:
+        limit = max(1, min(request.args.get('limit', LIST_PAGE_SIZE, type=int), 200))
+        try:
+            transcripts, next_cursor = _transcript_page(current_user.id, limit, request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return jsonify({
+            'transcripts': [{
+                'id': transcript.id,
+                'title': transcript.title,
+                'preview': transcript.preview,
+                'length': transcript.length,
+                'created_at': transcript.created_at.strftime('%Y-%m-%d %H:%M:%S')
+            } for transcript in transcripts],
+            'next_cursor': next_cursor
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -80,6 +338,7 @@ def register():
 @app.route('/logout')
 @login_required
 def logout():
+    live_sessions.discard(current_user.id)
     logout_user()
     return redirect(url_for('login'))
 
@@ -100,8 +359,11 @@ def save_transcript():
             user_id=current_user.id
         )
         
-        db.session.add(transcript)
-        db.session.commit()
+        if commit_group:
+            transcript = commit_group.add(transcript)
+        else:
+            db.session.add(transcript)
+            db.session.commit()
         
         return jsonify({
             'id': transcript.id,
@@ -138,37 +400,21 @@ def analyze_transcript(id):
         if transcript.user_id != current_user.id:
             return jsonify({'error': 'Unauthorized'}), 403
             
-        # Debug log
-        app.logger.info(f"Analyzing transcript {id} with content: {transcript.content}")
-            
-        # Get analysis results with better error handling
+        # The four analyses run concurrently; ?merged=1 asks for one combined completion
+        merged = request.args.get('merged', os.getenv('ANALYSIS_MERGED', '0')) == '1'
+        if request.args.get('async') == '1':
+            return _job_accepted(jobs.enqueue('analyze', {'transcript_id': id, 'merged': merged}, owner=current_user.id))
         try:
-            analysis = analyze_brainstorming(transcript.content)
-            app.logger.info(f"Analysis result: {analysis}")
-            if not analysis.get('success'):
-                return jsonify({'error': analysis.get('error', 'Analysis failed')}), 500
-                
-            action_items = generate_action_items(transcript.content)
-            app.logger.info(f"Action items result: {action_items}")
-            if not action_items.get('success'):
-                return jsonify({'error': action_items.get('error', 'Action items generation failed')}), 500
-                
-            suggestions = suggest_improvements(transcript.content)
-            app.logger.info(f"Suggestions result: {suggestions}")
-            if not suggestions.get('success'):
-                return jsonify({'error': suggestions.get('error', 'Suggestions generation failed')}), 500
-                
-            summary = summarize_text(transcript.content)
-            app.logger.info(f"Summary result: {summary}")
-            if not summary.get('success'):
-                return jsonify({'error': summary.get('error', 'Summary generation failed')}), 500
-            
-            return jsonify({
-                'analysis': analysis.get('analysis', ''),
-                'action_items': action_items.get('action_items', ''),
-                'suggestions': suggestions.get('suggestions', ''),
-                'summary': summary.get('summary', '')
-            })
+            results = _analyze_with_store(transcript, merged)
+            app.logger.info("Analyzed transcript", extra={'transcript_id': id, 'merged': merged, 'cached': results['cached'], 'timings': results['timings']})
+
+            if not any(results.get(section) for section in SECTIONS):
+                return jsonify({'error': next(iter(results['errors'].values())), 'timings': results['timings']}), 500
+
+            return jsonify(_analysis_json(results))
+
+        except RateLimited as e:
+            return _too_many_requests(e.retry_after)
             
         except Exception as e:
             app.logger.error(f"Analysis error: {str(e)}")
@@ -178,6 +424,280 @@ def analyze_transcript(id):
         app.logger.error(f"Route error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def _analysis_json(results):
+    # Partial results are still returned; failed sections are listed under 'errors'
+    return {
+        'analysis': results.get('analysis', ''),
+        'action_items': results.get('action_items', ''),
+        'suggestions': results.get('suggestions', ''),
+        'summary': results.get('summary', ''),
+        'errors': results['errors'],
+        'timings': results['timings'],
+        'cached': results['cached']
+    }
+
+@jobs.register('analyze', concurrency=int(os.getenv('ANALYSIS_JOBS', '2')), max_attempts=3, backoff=10.0)
+def analyze_job(job):
+    transcript = db.session.get(Transcript, job.payload['transcript_id'])
+    if transcript is None:
+        raise JobFailed('Transcript not found')
+    results = _analyze_with_store(transcript, job.payload['merged'])
+    # Sections that did succeed are stored, so a retry only asks for the rest;
+    # RateLimited propagates, and the queue retries after its retry_after
+    if len(results['errors']) == len(SECTIONS):
+        raise RuntimeError(next(iter(results['errors'].values())))
+    return _analysis_json(results)
+
+def _stored_analyses(transcript, merged=False):
+    """
+    Look up stored sections for the transcript's current content, prompt templates,
+    model and sampling parameters. Returns (keys by section, stored content by section).
+    """
+    content_hash = hashlib.sha256(transcript.content.encode('utf-8')).hexdigest()
+    # Long transcripts are always map-reduced, so their keys record the chunking instead
+    chunked = chunk_config() if needs_chunking(transcript.content) else None
+    keys = {
+        section: result_key(section, content_hash, merged=merged and chunked is None, chunked=chunked)
+        for section in SECTIONS
+    }
+    stored = AnalysisResult.query.filter(AnalysisResult.cache_key.in_(keys.values())).all()
+    by_key = {row.cache_key: row.content for row in stored}
+    return keys, {section: by_key[key] for section, key in keys.items() if key in by_key}
+
+def _store_analyses(transcript_id, keys, fresh):
+    for section, content in fresh.items():
+        # Rows from older content or prompt versions can never match again
+        AnalysisResult.query.filter_by(transcript_id=transcript_id, section=section).delete()
+        db.session.add(AnalysisResult(
+            transcript_id=transcript_id,
+            section=section,
+            cache_key=keys[section],
+            content=content
+        ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request stored the same result first
+        db.session.rollback()
+
+class _ChunkStore:
+    """Per-chunk map-reduce notes, kept as 'chunk' rows so appended text only re-maps new chunks."""
+
+    def __init__(self, transcript_id):
+        self.transcript_id = transcript_id
+
+    def get_many(self, keys):
+        rows = AnalysisResult.query.filter(AnalysisResult.cache_key.in_(keys)).all()
+        return {row.cache_key: json.loads(row.content) for row in rows}
+
+    def set_many(self, notes):
+        for key, value in notes.items():
+            db.session.add(AnalysisResult(
+                transcript_id=self.transcript_id,
+                section='chunk',
+                cache_key=key,
+                content=json.dumps(value)
+            ))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+
+def _analyze_with_store(transcript, merged):
+    """
+    Serve analysis sections from AnalysisResult when nothing that affects them
+    has changed; only missing sections hit the API. Raises RateLimited, after
+    storing the sections that did complete, when the Together.ai quota ran out.
+    """
+    keys, stored = _stored_analyses(transcript, merged)
+    results = {'errors': {}, 'timings': {}, 'cached': list(stored), **stored}
+    missing = [section for section in SECTIONS if section not in stored]
+    telemetry.CACHE_LOOKUPS.inc(len(stored), cache='analysis', result='hit')
+    telemetry.CACHE_LOOKUPS.inc(len(missing), cache='analysis', result='miss')
+    if not missing:
+        return results
+
+    if needs_chunking(transcript.content):
+        fresh = map_reduce_analysis(transcript.content, cache=_ChunkStore(transcript.id))
+        results['chunks'] = fresh['chunks']
+    else:
+        fresh = run_all_analyses(transcript.content, merged=merged, sections=missing)
+    limited = fresh.get('rate_limited')
+    results['errors'].update({section: error for section, error in fresh['errors'].items() if section in missing})
+    results['timings'].update(fresh['timings'])
+    fresh = {section: fresh[section] for section in missing if section in fresh}
+    results.update(fresh)
+    # Sections with an error are incomplete, so only the rest are kept
+    _store_analyses(transcript.id, keys, {section: content for section, content in fresh.items() if section not in results['errors']})
+    if limited is not None:
+        raise limited
+    return results
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/analyze_transcript/<int:id>/stream')
+@login_required
+def stream_analysis(id):
+    """Server-sent events version of /analyze_transcript, tagged by section."""
+    transcript = Transcript.query.get_or_404(id)
+    if transcript.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    keys, stored = _stored_analyses(transcript)
+    missing = [section for section in SECTIONS if section not in stored]
+    text = transcript.content
+
+    def generate():
+        for section, content in stored.items():
+            yield _sse('token', {'section': section, 'text': content})
+            yield _sse('done', {'section': section, 'cached': True})
+
+        if not missing:
+            yield _sse('end', {})
+            return
+
+        if needs_chunking(text):
+            # Too long to stream in one prompt: map-reduce, then send each section whole
+            try:
+                results = _analyze_with_store(db.session.get(Transcript, id), merged=False)
+            except RateLimited as e:
+                # Headers are already sent, so the 429 travels in the events
+                for section in missing:
+                    yield _sse('error', {'section': section, 'error': str(e), 'retry_after': math.ceil(e.retry_after)})
+                yield _sse('end', {})
+                return
+            for section in missing:
+                # A section built from only some chunks is sent, then flagged
+                if section in results:
+                    yield _sse('token', {'section': section, 'text': results[section]})
+                if section in results and section not in results['errors']:
+                    yield _sse('done', {'section': section})
+                else:
+                    yield _sse('error', {'section': section, 'error': results['errors'].get(section, 'Analysis failed')})
+            yield _sse('end', {})
+            return
+
+        collected = {section: [] for section in missing}
+        events = stream_analyses(text, missing)
+        try:
+            for section, kind, payload in events:
+                if kind == 'token':
+                    collected[section].append(payload)
+                    yield _sse('token', {'section': section, 'text': payload})
+                elif kind == 'done':
+                    _store_analyses(id, keys, {section: ''.join(collected[section]).strip()})
+                    yield _sse('done', {'section': section, 'elapsed': payload})
+                else:
+                    app.logger.error(f"Streaming analysis error in {section}: {payload}")
+                    yield _sse('error', {'section': section, 'error': payload})
+            yield _sse('end', {})
+        finally:
+            # Runs on client disconnect too, cancelling the upstream requests
+            events.close()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/search')
+@login_required
+def search():
+    try:
+        query = request.args.get('q', '')
+        limit = request.args.get('limit', 20, type=int)
+        try:
+            return jsonify(transcript_search.search(current_user.id, query, limit, request.args.get('cursor')))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    except Exception as e:
+        app.logger.error(f"Search error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+AUDIO_EXTENSIONS = {'.opus', '.ogg', '.oga', '.mp3', '.m4a', '.aac', '.wav', '.webm', '.flac', '.amr'}
+AUDIO_MAX_BYTES = int(os.getenv('TRANSCRIBE_MAX_MB', '50')) * 1024 * 1024
+
+# Each transcription fans its chunks out to the recognizer process pool in
+# audio_pipeline, so only a couple run at once
+@jobs.register('transcribe', priority=-1, concurrency=int(os.getenv('TRANSCRIBE_JOBS', '2')), max_attempts=2)
+def transcribe_job(job):
+    try:
+        text = transcribe_file(job.input_path, on_progress=job.progress)
+    except AudioError as e:
+        raise JobFailed(str(e))
+    if not text:
+        raise JobFailed('No speech found in the audio')
+
+    transcript = Transcript(title=job.payload['title'], content=text, user_id=job.payload['user_id'])
+    db.session.add(transcript)
+    db.session.commit()
+    return {'transcript_id': transcript.id}
+
+@app.route('/transcribe_audio', methods=['POST'])
+@login_required
+def transcribe_audio():
+    try:
+        upload = request.files.get('audio')
+        if not upload or not upload.filename:
+            return jsonify({'error': 'No audio file provided'}), 400
+
+        extension = os.path.splitext(upload.filename)[1].lower()
+        if extension not in AUDIO_EXTENSIONS:
+            return jsonify({'error': f'Unsupported audio format {extension or upload.filename}'}), 400
+        if request.content_length and request.content_length > AUDIO_MAX_BYTES:
+            return jsonify({'error': 'Audio file too large'}), 413
+
+        title = request.form.get('title') or os.path.splitext(upload.filename)[0][:200]
+        job_id = jobs.enqueue('transcribe', {'title': title, 'user_id': current_user.id},
+                              data=upload.stream, owner=current_user.id)
+        return _job_accepted(job_id)
+
+    except Exception as e:
+        app.logger.error(f"Upload error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+@login_required
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['owner'] != str(current_user.id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    if request.method == 'DELETE':
+        jobs.cancel(job_id)
+        job = jobs.get(job_id)
+    return jsonify(_job_json(job))
+
+# One incremental analyzer per user while they dictate; reset whenever the
+# submitted text no longer extends the previous one
+live_sessions = SessionStore(
+    max_sessions=int(os.getenv('LIVE_SESSIONS_MAX', 1000)),
+    ttl=int(os.getenv('LIVE_SESSION_TTL', 1800)),
+)
+
+@app.route('/live_analysis', methods=['POST'])
+@login_required
+def live_analysis():
+    try:
+        data = request.get_json()
+        text = data.get('text', '') if data else ''
+
+        session = live_sessions.get(current_user.id)
+        # Concurrent requests from one user take turns on their session
+        with session.lock:
+            if not session.extended_by(text):
+                session.reset()
+            session.append(text[session.length:])
+            result = session.result(final=bool(data and data.get('final')))
+        if 'error' in result:
+            return jsonify(result), 400
+        return jsonify(result)
+
+    except Exception as e:
+        app.logger.error(f"Live analysis error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/delete_transcript/<int:id>', methods=['POST'])
 @login_required
 def delete_transcript(id):
@@ -194,4 +714,5 @@ def delete_transcript(id):
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    migrate()
     app.run(debug=True, port=3000)
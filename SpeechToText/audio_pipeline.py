@@ -0,0 +1,362 @@
+"""Server-side transcription of uploaded audio such as WhatsApp voice notes.
+
+The file is stream-decoded by ffmpeg to 16 kHz mono 16-bit PCM and split
+on silence as it decodes, so recognition of the first chunks starts before
+the last ones are decoded. Chunks are transcribed in parallel in a process
+pool by an offline recognizer running on the CPU, then stitched in order.
+
+Recognizers are pluggable via TRANSCRIBE_ENGINE: 'vosk' (needs the vosk
+package and a model directory in VOSK_MODEL_PATH), 'faster-whisper'
+(needs faster-whisper; WHISPER_MODEL picks the size), or 'module:Class'
+for any Recognizer subclass. webrtcvad is used for voice activity
+detection when installed, otherwise a simple energy detector.
+"""
+import importlib
+import importlib.util
+import json
+import math
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from array import array
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+SAMPLE_RATE = 16000
+BYTES_PER_SECOND = SAMPLE_RATE * 2
+FRAME_MS = 30
+FRAME_BYTES = BYTES_PER_SECOND * FRAME_MS // 1000
+
+FFMPEG = os.getenv('FFMPEG_PATH', 'ffmpeg')
+ENGINE = os.getenv('TRANSCRIBE_ENGINE', 'vosk')
+LANGUAGE = os.getenv('TRANSCRIBE_LANGUAGE', 'es')
+VOSK_MODEL_PATH = os.getenv('VOSK_MODEL_PATH', 'models/vosk-model-small-es-0.42')
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'small')
+POOL_WORKERS = int(os.getenv('TRANSCRIBE_WORKERS', os.cpu_count() or 1))
+
+# Silence this long ends a chunk; chunks are cut regardless once they reach
+# MAX_CHUNK_SECONDS so no single recognizer call runs too long
+MIN_SILENCE_MS = int(os.getenv('VAD_MIN_SILENCE_MS', '600'))
+MAX_CHUNK_SECONDS = float(os.getenv('VAD_MAX_CHUNK_SECONDS', '30'))
+PADDING_MS = 210
+MIN_SPEECH_MS = 240
+VAD_AGGRESSIVENESS = int(os.getenv('VAD_AGGRESSIVENESS', '2'))
+PROGRESS_INTERVAL = 0.5
+
+
+class AudioError(Exception):
+    """The upload could not be decoded or transcribed."""
+
+
+def decode(path, block_bytes=BYTES_PER_SECOND):
+    """Yield 16 kHz mono s16le PCM from any format ffmpeg reads, a block at a time."""
+    command = [
+        FFMPEG, '-nostdin', '-loglevel', 'error', '-i', path,
+        '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-'
+    ]
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise AudioError('ffmpeg is not installed')
+    try:
+        while True:
+            block = process.stdout.read(block_bytes)
+            if not block:
+                break
+            yield block
+        stderr = process.stderr.read().decode('utf-8', 'replace').strip()
+        if process.wait() != 0:
+            raise AudioError(f'Could not decode audio: {stderr or process.returncode}')
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def frames(blocks):
+    """Re-slice PCM blocks into FRAME_MS frames; a short final frame is dropped."""
+    buffer = bytearray()
+    for block in blocks:
+        buffer += block
+        usable = len(buffer) - len(buffer) % FRAME_BYTES
+        for offset in range(0, usable, FRAME_BYTES):
+            yield bytes(buffer[offset:offset + FRAME_BYTES])
+        del buffer[:usable]
+
+
+class EnergyVad:
+    """Speech wherever frame loudness clearly exceeds the background level.
+
+    The background is the quietest frame of the last NOISE_WINDOW_MS: speech
+    dips between syllables, so the minimum tracks the noise underneath it.
+    """
+    NOISE_WINDOW_MS = 3000
+
+    def __init__(self, ratio=3.0, min_rms=200):
+        self.ratio = ratio
+        self.min_rms = min_rms
+        # (frame index, rms) with increasing rms, so the window minimum is at the front
+        self.window = deque()
+        self.index = 0
+
+    def is_speech(self, frame):
+        samples = array('h', frame)
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        rms = math.sqrt(sum(sample * sample for sample in samples) / len(samples))
+
+        while self.window and self.window[-1][1] >= rms:
+            self.window.pop()
+        self.window.append((self.index, rms))
+        if self.window[0][0] <= self.index - self.NOISE_WINDOW_MS // FRAME_MS:
+            self.window.popleft()
+        self.index += 1
+        return rms > max(self.window[0][1] * self.ratio, self.min_rms)
+
+
+class WebRtcVad:
+    def __init__(self, aggressiveness=VAD_AGGRESSIVENESS):
+        import webrtcvad
+        self.vad = webrtcvad.Vad(aggressiveness)
+
+    def is_speech(self, frame):
+        return self.vad.is_speech(frame, SAMPLE_RATE)
+
+
+def make_vad():
+    try:
+        return WebRtcVad()
+    except ImportError:
+        return EnergyVad()
+
+
+def split_on_silence(frames, vad, min_silence_ms=MIN_SILENCE_MS, max_chunk_seconds=MAX_CHUNK_SECONDS):
+    """Yield (start_seconds, pcm) for each stretch of speech as soon as it ends.
+
+    Chunks keep PADDING_MS of audio either side so words are not clipped,
+    and chunks with less than MIN_SPEECH_MS of speech (clicks, breaths) are
+    dropped.
+    """
+    padding = PADDING_MS // FRAME_MS
+    silence_limit = max(min_silence_ms // FRAME_MS, padding)
+    max_frames = int(max_chunk_seconds * 1000 // FRAME_MS)
+    min_speech = MIN_SPEECH_MS // FRAME_MS
+
+    before = deque(maxlen=padding)
+    chunk = []
+    start = 0
+    speech_frames = 0
+    silence_run = 0
+
+    for index, frame in enumerate(frames):
+        speech = vad.is_speech(frame)
+        if not chunk:
+            if speech:
+                chunk = list(before) + [frame]
+                start = index - len(before)
+                speech_frames, silence_run = 1, 0
+                before.clear()
+            else:
+                before.append(frame)
+            continue
+
+        chunk.append(frame)
+        if speech:
+            speech_frames += 1
+            silence_run = 0
+        else:
+            silence_run += 1
+
+        if silence_run >= silence_limit or len(chunk) >= max_frames:
+            if silence_run:
+                # Keep `padding` frames of the trailing silence
+                kept = len(chunk) - silence_run + min(silence_run, padding)
+                before.extend(chunk[kept:])
+                chunk = chunk[:kept]
+            if speech_frames >= min_speech:
+                yield start * FRAME_MS / 1000, b''.join(chunk)
+            chunk = []
+
+    if chunk and speech_frames >= min_speech:
+        kept = len(chunk) - silence_run + min(silence_run, padding)
+        yield start * FRAME_MS / 1000, b''.join(chunk[:kept])
+
+
+class Recognizer:
+    """Offline speech-to-text for one chunk of 16 kHz mono s16le PCM."""
+
+    @classmethod
+    def check(cls):
+        """Raise AudioError if the recognizer can't load here, without loading a model."""
+
+    def transcribe(self, pcm):
+        raise NotImplementedError
+
+
+def _require(package):
+    if importlib.util.find_spec(package) is None:
+        raise AudioError(f'{package} is not installed')
+
+
+class VoskRecognizer(Recognizer):
+    @classmethod
+    def check(cls, model_path=VOSK_MODEL_PATH):
+        _require('vosk')
+        if not os.path.isdir(model_path):
+            raise AudioError(f'Vosk model not found at {model_path}')
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        from vosk import Model, SetLogLevel
+        SetLogLevel(-1)
+        if not os.path.isdir(model_path):
+            raise AudioError(f'Vosk model not found at {model_path}')
+        self.model = Model(model_path)
+
+    def transcribe(self, pcm):
+        from vosk import KaldiRecognizer
+        recognizer = KaldiRecognizer(self.model, SAMPLE_RATE)
+        recognizer.AcceptWaveform(pcm)
+        return json.loads(recognizer.FinalResult()).get('text', '')
+
+
+class FasterWhisperRecognizer(Recognizer):
+    @classmethod
+    def check(cls):
+        _require('faster_whisper')
+
+    def __init__(self, model=WHISPER_MODEL, language=LANGUAGE):
+        from faster_whisper import WhisperModel
+        # Parallelism comes from the process pool, so each model gets one thread
+        self.model = WhisperModel(model, device='cpu', compute_type='int8', cpu_threads=1)
+        self.language = language
+
+    def transcribe(self, pcm):
+        import numpy
+        audio = numpy.frombuffer(pcm, numpy.int16).astype(numpy.float32) / 32768
+        segments, _ = self.model.transcribe(audio, language=self.language, beam_size=1)
+        return ' '.join(segment.text.strip() for segment in segments)
+
+
+RECOGNIZERS = {
+    'vosk': VoskRecognizer,
+    'faster-whisper': FasterWhisperRecognizer,
+}
+
+
+def recognizer_class(name=ENGINE):
+    """Look up a recognizer by registry name or 'module:Class' path."""
+    if name in RECOGNIZERS:
+        return RECOGNIZERS[name]
+    module, _, attribute = name.partition(':')
+    if not attribute:
+        raise AudioError(f'Unknown transcription engine {name}')
+    try:
+        return getattr(importlib.import_module(module), attribute)
+    except (ImportError, AttributeError) as e:
+        raise AudioError(f'Cannot load transcription engine {name}: {e}')
+
+
+def load_recognizer(name=ENGINE):
+    """Instantiate a recognizer by registry name or 'module:Class' path."""
+    return recognizer_class(name)()
+
+
+# Each pool process loads its model once, in the initializer
+_recognizer = None
+
+
+def _init_worker(name):
+    global _recognizer
+    _recognizer = load_recognizer(name)
+
+
+def _transcribe_chunk(pcm):
+    return _recognizer.transcribe(pcm).strip()
+
+
+# Created on first use so plain page loads never fork a pool
+_executor = None
+
+
+def get_executor():
+    """The shared pool; raises AudioError if the configured engine can't load."""
+    global _executor
+    if _executor is None:
+        # A recognizer failing in the initializer would only show up as a
+        # BrokenProcessPool, so it is checked here first
+        recognizer_class(ENGINE).check()
+        # Not forked from the threaded gunicorn worker, whose other threads may hold locks
+        _executor = ProcessPoolExecutor(
+            max_workers=POOL_WORKERS, initializer=_init_worker, initargs=(ENGINE,),
+            mp_context=multiprocessing.get_context('forkserver'),
+        )
+    return _executor
+
+
+def _discard(executor):
+    """Drop a pool whose process died, so the next transcription starts a fresh one."""
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False)
+
+
+def stitch(texts):
+    return ' '.join(text for text in texts if text)
+
+
+def transcribe_pcm(blocks, on_progress=None, executor=None, window=None):
+    """Split PCM `blocks` on silence, transcribe the chunks in parallel and stitch the text.
+
+    At most `window` chunks are in flight, so memory stays bounded however
+    long the audio is. on_progress(chunks_done=, chunks_total=, audio_seconds=)
+    is called at most every PROGRESS_INTERVAL seconds, and once at the end.
+    """
+    executor = executor or get_executor()
+    try:
+        return _transcribe_chunks(blocks, on_progress, executor, window or POOL_WORKERS * 2)
+    except BrokenProcessPool as e:
+        _discard(executor)
+        raise AudioError(f'Transcription worker crashed: {e}')
+
+
+def _transcribe_chunks(blocks, on_progress, executor, window):
+    futures = []
+    pending = set()
+    progress = {'chunks_done': 0, 'chunks_total': 0, 'audio_seconds': 0.0}
+    last_report = 0.0
+
+    def report(force=False):
+        nonlocal last_report
+        progress['chunks_done'] = len(futures) - len(pending)
+        progress['chunks_total'] = len(futures)
+        if on_progress and (force or time.monotonic() - last_report >= PROGRESS_INTERVAL):
+            last_report = time.monotonic()
+            on_progress(**progress)
+
+    def decoded(block):
+        progress['audio_seconds'] += len(block) / BYTES_PER_SECOND
+        return block
+
+    for _, pcm in split_on_silence(frames(decoded(block) for block in blocks), make_vad()):
+        future = executor.submit(_transcribe_chunk, pcm)
+        futures.append(future)
+        pending.add(future)
+        while len(pending) >= window:
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        pending = {future for future in pending if not future.done()}
+        report()
+
+    while pending:
+        _, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+        report()
+    report(force=True)
+    return stitch(future.result() for future in futures)
+
+
+def transcribe_file(path, on_progress=None, executor=None):
+    """Transcribe an audio file; raises AudioError if it cannot be decoded."""
+    return transcribe_pcm(decode(path), on_progress=on_progress, executor=executor)
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List
+
+from ai_analysis import (
+    CHUNK_PROMPT,
+    MERGED_MARKERS,
+    MERGED_MAX_TOKENS,
+    MODEL,
+    REDUCE_INSTRUCTIONS,
+    REDUCE_PROMPT,
+    SAMPLING_PARAMS,
+    SECTIONS,
+    _executor,
+    _get_completion,
+    _split_sections,
+    prompt_version,
+)
+from ratelimit import RateLimited
+
+log = logging.getLogger(__name__)
+
+CHUNK_CHARS = int(os.getenv('ANALYSIS_CHUNK_CHARS', 8000))
+CHUNK_OVERLAP = int(os.getenv('ANALYSIS_CHUNK_OVERLAP', 400))
+
+# Sentence ends followed by whitespace; good enough for dictated Spanish/English
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def chunk_config() -> Dict[str, int]:
+    return {'chars': CHUNK_CHARS, 'overlap': CHUNK_OVERLAP}
+
+
+def needs_chunking(text: str) -> bool:
+    return len(text) > CHUNK_CHARS
+
+
+def _units(text: str) -> List[str]:
+    """Paragraphs, with any paragraph longer than a chunk split into sentences."""
+    units = []
+    for paragraph in re.split(r'\n\s*\n|\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= CHUNK_CHARS:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            # A single run-on "sentence" longer than a chunk is cut hard
+            while len(sentence) > CHUNK_CHARS:
+                units.append(sentence[:CHUNK_CHARS])
+                sentence = sentence[CHUNK_CHARS:]
+            if sentence:
+                units.append(sentence)
+    return units
+
+
+def split_chunks(text: str, max_chars: int = None, overlap: int = None) -> List[str]:
+    """
+    Greedily pack paragraphs/sentences into chunks of at most `max_chars`,
+    starting each chunk with up to `overlap` characters of trailing context.
+    Packing runs from the start of the text, so appending to a transcript
+    leaves every chunk but the last unchanged.
+    """
+    max_chars = max_chars or CHUNK_CHARS
+    overlap = CHUNK_OVERLAP if overlap is None else overlap
+    chunks = []
+    current = []
+    size = 0
+    for unit in _units(text):
+        if current and size + len(unit) + 1 > max_chars:
+            chunks.append('\n'.join(current))
+            # Carry the tail of the previous chunk over as context
+            carried = []
+            carried_size = 0
+            for previous in reversed(current):
+                if carried_size + len(previous) > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_size += len(previous) + 1
+            current = carried
+            size = carried_size
+        current.append(unit)
+        size += len(unit) + 1
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def chunk_key(chunk: str) -> str:
+    material = json.dumps([chunk, prompt_version('chunk'), MODEL, SAMPLING_PARAMS], sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def _map_chunk(chunk: str) -> Dict[str, str]:
+    completion = _get_completion(CHUNK_PROMPT.format(text=chunk), max_tokens=MERGED_MAX_TOKENS)
+    sections = _split_sections(completion)
+    notes = {key: sections.get(marker, '') for key, marker in MERGED_MARKERS.items()}
+    if not any(notes.values()):
+        raise Exception("Chunk completion had no tagged sections")
+    return notes
+
+
+def _group_notes(notes: List[str]) -> List[List[str]]:
+    """Group notes so each reduce prompt stays around one chunk; every group takes at least two."""
+    groups = [[]]
+    size = 0
+    for note in notes:
+        if len(groups[-1]) >= 2 and size + len(note) > CHUNK_CHARS:
+            groups.append([])
+            size = 0
+        groups[-1].append(note)
+        size += len(note)
+    return groups
+
+
+def _reduce_prompt(section: str, group: List[str]) -> str:
+    return REDUCE_PROMPT.format(instructions=REDUCE_INSTRUCTIONS[section], text='\n\n---\n\n'.join(group))
+
+
+def map_reduce_analysis(text: str, cache=None) -> Dict[str, Any]:
+    """
+    Analyze a long transcript chunk by chunk, then reduce the notes per section.
+    `cache` is any object with get_many(keys) -> dict and set_many(dict) and
+    holds per-chunk notes, so appended text only costs its new chunks.
+    Returns the same shape as ai_analysis.run_all_analyses; when some chunks
+    fail, the sections built from the rest are returned with an error each,
+    and quota rejections are also returned under 'rate_limited'.
+    """
+    start = time.perf_counter()
+    results = {'errors': {}, 'timings': {}}
+    chunks = split_chunks(text)
+    keys = [chunk_key(chunk) for chunk in chunks]
+    cached = cache.get_many(keys) if cache is not None else {}
+
+    futures = {key: _executor.submit(_map_chunk, chunk) for key, chunk in zip(keys, chunks) if key not in cached}
+    fresh = {}
+    failed = 0
+    for key, future in futures.items():
+        try:
+            fresh[key] = future.result()
+        except RateLimited as e:
+            results['rate_limited'] = e
+            failed += 1
+        except Exception as e:
+            log.error(f"Chunk analysis error: {str(e)}")
+            failed += 1
+    if cache is not None and fresh:
+        cache.set_many(fresh)
+    notes = {**cached, **fresh}
+    results['timings']['map'] = round(time.perf_counter() - start, 3)
+    results['chunks'] = {'total': len(chunks), 'cached': len(cached), 'failed': failed}
+
+    if not notes:
+        results['errors'] = {section: "Every chunk failed to analyze" for section in SECTIONS}
+        return results
+
+    reduce_start = time.perf_counter()
+    pending = {}
+    for section in SECTIONS:
+        partial = [notes[key][section] for key in keys if key in notes and notes[key].get(section)]
+        if len(partial) == 1:
+            results[section] = partial[0]
+        elif partial:
+            pending[section] = partial
+        else:
+            results['errors'][section] = "No chunk produced notes for this section"
+
+    # Reduce level by level across all sections, so the pool never waits on itself
+    while pending:
+        futures = {
+            section: [_executor.submit(_get_completion, _reduce_prompt(section, group)) for group in _group_notes(partial)]
+            for section, partial in pending.items()
+        }
+        pending = {}
+        for section, section_futures in futures.items():
+            try:
+                reduced = [future.result() for future in section_futures]
+            except RateLimited as e:
+                results['errors'][section] = str(e)
+                results['rate_limited'] = e
+                continue
+            except Exception as e:
+                results['errors'][section] = str(e)
+                continue
+            if len(reduced) == 1:
+                results[section] = reduced[0]
+            else:
+                pending[section] = reduced
+    results['timings']['reduce'] = round(time.perf_counter() - reduce_start, 3)
+    if failed:
+        # Missing chunks leave every section incomplete; reported as errors so
+        # the result isn't stored and the next request retries those chunks
+        for section in SECTIONS:
+            results['errors'].setdefault(section, f"{failed} of {len(chunks)} chunks failed to analyze")
+    return results
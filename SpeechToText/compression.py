@@ -0,0 +1,239 @@
+"""Compressed storage for transcript text.
+
+Transcript.content is stored in the content_z blob as raw deflate, primed
+with a preset dictionary trained on our own transcripts so that even short
+ones compress well. Blobs start with a one-byte format tag:
+
+    0x00  UTF-8 text, too short to be worth compressing
+    0x01  deflate without a dictionary
+    0x02  4-byte big-endian dictionary id, then deflate primed with it
+
+Dictionaries live in the compression_dictionary table and are never
+changed once written, so old rows stay readable after retraining. SQLite
+sees the text through the transcript_text() SQL function, registered on
+every connection by install(), which the transcript_text view and the
+search triggers use.
+"""
+import fcntl
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+
+from sqlalchemy import event, text as sql
+
+log = logging.getLogger(__name__)
+
+LEVEL = int(os.getenv('TRANSCRIPT_COMPRESSION_LEVEL', '6'))
+MIN_COMPRESS_BYTES = 64
+DICTIONARY_SIZE = 32 * 1024
+# Transcripts sampled when training a dictionary, and how many must exist first.
+# Only the opening words of each count; that is where a dictionary matters
+TRAIN_WORDS = 500
+TRAIN_SAMPLE = int(os.getenv('TRANSCRIPT_DICTIONARY_SAMPLE', '2000'))
+TRAIN_MIN_SAMPLES = int(os.getenv('TRANSCRIPT_DICTIONARY_MIN_SAMPLES', '50'))
+
+MIGRATION_BATCH = int(os.getenv('TRANSCRIPT_COMPRESSION_BATCH', '200'))
+MIGRATION_PAUSE = float(os.getenv('TRANSCRIPT_COMPRESSION_PAUSE', '0.05'))
+MIGRATE_IN_BACKGROUND = os.getenv('TRANSCRIPT_COMPRESSION_BACKGROUND', '1') == '1'
+
+RAW, DEFLATE, DEFLATE_DICT = 0, 1, 2
+# Raw deflate: the zlib header and checksum would cost 6 bytes per row
+WBITS = -15
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE):
+    """Preset dictionary from the word n-grams that recur most across `samples`.
+
+    deflate can only refer back 32 KiB, and nearer matches take fewer bits,
+    so the most valuable strings go at the end of the dictionary.
+    """
+    scores = Counter()
+    for sample in samples:
+        words = sample.split()[:TRAIN_WORDS]
+        seen = set()
+        for n in (1, 2, 3, 4):
+            for i in range(len(words) - n + 1):
+                seen.add(' '.join(words[i:i + n]))
+        # Count documents rather than occurrences: repeats within one
+        # transcript are already cheap for deflate
+        scores.update(seen)
+
+    chosen = []
+    total = 0
+    for phrase, count in sorted(scores.items(), key=lambda item: (-item[1] * len(item[0]), item[0])):
+        if count < 2:
+            break
+        encoded = (phrase + ' ').encode('utf-8')
+        if total + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        total += len(encoded)
+    return b''.join(reversed(chosen))
+
+
+class Codec:
+    """Compresses and decompresses transcript blobs; one shared instance per process."""
+
+    def __init__(self):
+        self.engine = None
+        self.dictionaries = {}
+        self.current_id = None
+        self.loaded = False
+        self._compressors = {}
+        self._decompressors = {}
+        self.lock = threading.Lock()
+
+    def bind(self, engine):
+        """Read dictionaries from `engine`, on first use rather than now."""
+        self.engine = engine
+        self.loaded = False
+
+    def reload(self):
+        """Pick up dictionaries written by other processes."""
+        if self.engine is None:
+            return
+        with self.engine.connect() as conn:
+            if not conn.execute(sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'compression_dictionary'"
+            )).first():
+                return
+            rows = conn.execute(sql("SELECT id, data FROM compression_dictionary ORDER BY id")).all()
+        with self.lock:
+            for id, data in rows:
+                self.dictionaries[id] = data
+            self.current_id = rows[-1][0] if rows else None
+            self.loaded = True
+
+    def compress(self, text):
+        data = text.encode('utf-8')
+        if len(data) < MIN_COMPRESS_BYTES:
+            return bytes([RAW]) + data
+        if not self.loaded:
+            self.reload()
+        id = self.current_id
+        if id is None:
+            compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, WBITS)
+            return bytes([DEFLATE]) + compressor.compress(data) + compressor.flush()
+        compressor = self._compressor(id).copy()
+        return bytes([DEFLATE_DICT]) + struct.pack('>I', id) + compressor.compress(data) + compressor.flush()
+
+    def decompress(self, blob):
+        blob = bytes(blob)
+        tag = blob[0]
+        if tag == RAW:
+            return blob[1:].decode('utf-8')
+        if tag == DEFLATE:
+            return zlib.decompress(blob[1:], WBITS).decode('utf-8')
+        if tag == DEFLATE_DICT:
+            id, = struct.unpack('>I', blob[1:5])
+            decompressor = self._decompressor(id).copy()
+            return (decompressor.decompress(blob[5:]) + decompressor.flush()).decode('utf-8')
+        raise ValueError(f'Unknown transcript blob format {tag}')
+
+    def _dictionary(self, id):
+        if id not in self.dictionaries:
+            self.reload()
+        return self.dictionaries[id]
+
+    # Priming deflate with a 32 KiB dictionary costs more than compressing a
+    # typical transcript, so primed objects are kept and copied per call
+    def _compressor(self, id):
+        if id not in self._compressors:
+            self._compressors[id] = zlib.compressobj(LEVEL, zlib.DEFLATED, WBITS, zdict=self._dictionary(id))
+        return self._compressors[id]
+
+    def _decompressor(self, id):
+        if id not in self._decompressors:
+            self._decompressors[id] = zlib.decompressobj(WBITS, zdict=self._dictionary(id))
+        return self._decompressors[id]
+
+
+codec = Codec()
+
+
+def install(engine):
+    """Register transcript_text() on every new connection of `engine`."""
+
+    @event.listens_for(engine, 'connect')
+    def register(dbapi_connection, connection_record):
+        dbapi_connection.create_function('transcript_text', 1, _sql_text, deterministic=True)
+
+
+def _sql_text(blob):
+    return None if blob is None else codec.decompress(blob)
+
+
+def train(engine, sample_size=TRAIN_SAMPLE):
+    """Train and store a dictionary from a sample of saved transcripts; returns its id or None."""
+    with engine.connect() as conn:
+        samples = [row[0] for row in conn.execute(sql(
+            "SELECT content FROM transcript_text ORDER BY random() LIMIT :limit"
+        ), {'limit': sample_size})]
+    if len(samples) < TRAIN_MIN_SAMPLES:
+        return None
+    dictionary = train_dictionary(samples)
+    with engine.begin() as conn:
+        id = conn.execute(sql(
+            "INSERT INTO compression_dictionary (data, created_at) VALUES (:data, CURRENT_TIMESTAMP) RETURNING id"
+        ), {'data': dictionary}).scalar()
+    codec.reload()
+    return id
+
+
+def compress_existing(engine, batch_size=MIGRATION_BATCH, pause=MIGRATION_PAUSE, retrain=False):
+    """Move plain-text rows into content_z, one short transaction per batch.
+
+    Trains a dictionary first if there is none yet (or `retrain`), and
+    sleeps `pause` seconds between batches so request writers get the
+    write lock in between. Returns the number of rows converted.
+    """
+    if retrain or codec.current_id is None:
+        train(engine)
+    converted = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(sql(
+                "SELECT id, content FROM transcript WHERE content_z IS NULL ORDER BY id LIMIT :limit"
+            ), {'limit': batch_size}).all()
+            if not rows:
+                return converted
+            conn.execute(sql(
+                "UPDATE transcript SET content_z = :blob, content = '' WHERE id = :id AND content_z IS NULL"
+            ), [{'id': id, 'blob': codec.compress(content)} for id, content in rows])
+        converted += len(rows)
+        time.sleep(pause)
+
+
+class BackgroundMigration:
+    """Runs compress_existing() once in a daemon thread, in one worker per host."""
+
+    def __init__(self, engine, enabled=MIGRATE_IN_BACKGROUND):
+        self.engine = engine
+        self.enabled = enabled
+        self.lock_path = f'{engine.url.database}.compression'
+        self.converted = 0
+        self.thread = None
+
+    def start(self):
+        if not self.enabled or self.thread is not None:
+            return self
+        self.thread = threading.Thread(target=self._run, name='transcript-compression', daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            with open(self.lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+                self.converted = compress_existing(self.engine)
+                if self.converted:
+                    log.info(f"Compressed {self.converted} stored transcripts")
+        except Exception as e:
+            log.error(f"Transcript compression error: {str(e)}")
@@ -0,0 +1,241 @@
+"""Run text_analysis over many documents across a process pool.
+
+    python corpus_analysis.py --transcripts all --output results.ndjson
+    python corpus_analysis.py notes1.txt notes2.txt --format csv --output results.csv
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from text_analysis import build_result, get_analyzer
+
+CSV_COLUMNS = [
+    'id', 'sentences', 'words', 'avg_sentence_length', 'readability_score', 'reading_level',
+    'sentiment', 'positive', 'neutral', 'negative', 'paragraphs', 'error',
+]
+
+
+class CorpusAggregate:
+    """Corpus-level counters that can be built per chunk and merged.
+
+    Phrase counts are pruned to the most common `max_phrases` whenever they
+    grow past twice that, so memory stays flat on large corpora; the global
+    top phrases are therefore approximate for the long tail.
+    """
+
+    def __init__(self, max_phrases=10000):
+        self.max_phrases = max_phrases
+        self.documents = 0
+        self.errors = 0
+        self.words = 0
+        self.sentences = 0
+        self.phrases = Counter()
+        self.sentiment = Counter()
+        self.readability = Counter()
+
+    def add(self, counts, result):
+        self.documents += 1
+        if 'error' in result:
+            self.errors += 1
+            return
+        self.words += counts['word_count']
+        self.sentences += counts['sentence_count']
+        self.phrases.update(counts['word_freq'])
+        self.sentiment[result['sentiment']['overall']] += 1
+        self.readability[_readability_bin(result['statistics']['readability_score'])] += 1
+        self._prune()
+
+    def merge(self, other):
+        self.documents += other.documents
+        self.errors += other.errors
+        self.words += other.words
+        self.sentences += other.sentences
+        self.phrases.update(other.phrases)
+        self.sentiment.update(other.sentiment)
+        self.readability.update(other.readability)
+        self._prune()
+        return self
+
+    def _prune(self):
+        if len(self.phrases) > 2 * self.max_phrases:
+            self.phrases = Counter(dict(self.phrases.most_common(self.max_phrases)))
+
+    def to_dict(self, top=20):
+        return {
+            'documents': self.documents,
+            'errors': self.errors,
+            'words': self.words,
+            'sentences': self.sentences,
+            'key_phrases': [{'phrase': phrase, 'count': count} for phrase, count in self.phrases.most_common(top)],
+            'sentiment': dict(self.sentiment),
+            'readability_histogram': {f'{low}..{low + 10}': self.readability[low] for low in sorted(self.readability)},
+        }
+
+
+def _readability_bin(score):
+    """Flesch scores bucketed by 10, with everything below 0 or above 100 folded into the ends."""
+    return max(-10, min(100, int(score // 10) * 10))
+
+
+def _init_worker():
+    # Load NLTK/VADER once per worker instead of once per task
+    get_analyzer()
+
+
+def _analyze_chunk(chunk):
+    """Worker task: analyze a list of (id, text) pairs and return rows plus a partial aggregate."""
+    analyzer = get_analyzer()
+    aggregate = CorpusAggregate()
+    rows = []
+    for doc_id, text in chunk:
+        if not text or not text.strip():
+            result = {'error': 'Empty text provided'}
+            counts = None
+        else:
+            counts = analyzer.analyze_counts(text)
+            result = build_result(**counts)
+        aggregate.add(counts, result)
+        rows.append({'id': doc_id, **result})
+    return rows, aggregate
+
+
+def _chunks(items, size):
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def analyze_corpus(documents, processes=None, chunksize=32, on_result=None):
+    """
+    Analyze every document and return the merged CorpusAggregate.
+
+    `documents` is an iterable of texts or (id, text) pairs; texts get their
+    position as id. Work is sent to a process pool in chunks of `chunksize`
+    with a bounded number in flight, and `on_result` is called with each
+    per-document row as soon as its chunk finishes (not in input order).
+    """
+    processes = processes or os.cpu_count() or 1
+    items = ((i, doc) if isinstance(doc, str) else doc for i, doc in enumerate(documents))
+    aggregate = CorpusAggregate()
+    pending = set()
+
+    def collect(done):
+        for future in done:
+            rows, partial = future.result()
+            aggregate.merge(partial)
+            if on_result is not None:
+                for row in rows:
+                    on_result(row)
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as executor:
+        for chunk in _chunks(items, chunksize):
+            pending.add(executor.submit(_analyze_chunk, chunk))
+            if len(pending) >= processes * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    return aggregate
+
+
+def ndjson_writer(stream):
+    def write(row):
+        stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+    return write
+
+
+def csv_writer(stream):
+    """Flat one-row-per-document CSV, for spreadsheets and tools that import CSV."""
+    writer = csv.DictWriter(stream, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+
+    def write(row):
+        if 'error' in row:
+            writer.writerow({'id': row['id'], 'error': row['error']})
+            return
+        statistics = row['statistics']
+        scores = row['sentiment']['scores']
+        writer.writerow({
+            'id': row['id'],
+            'sentences': statistics['sentences'],
+            'words': statistics['words'],
+            'avg_sentence_length': statistics['avg_sentence_length'],
+            'readability_score': statistics['readability_score'],
+            'reading_level': statistics['reading_level'],
+            'sentiment': row['sentiment']['overall'],
+            'positive': scores['positive'],
+            'neutral': scores['neutral'],
+            'negative': scores['negative'],
+            'paragraphs': row['structure']['paragraphs'],
+        })
+    return write
+
+
+def iter_transcripts(ids=None):
+    """Yield (id, content) for saved transcripts, all of them when `ids` is None."""
+    from app import app, Transcript, ensure_migrated
+
+    # The schema the content column reads through may not exist yet on a fresh
+    # or older database, as in the serving paths
+    ensure_migrated()
+    with app.app_context():
+        query = Transcript.query.with_entities(Transcript.id, Transcript.content).order_by(Transcript.id)
+        if ids is not None:
+            query = query.filter(Transcript.id.in_(ids))
+        for doc_id, content in query.yield_per(500):
+            yield doc_id, content
+
+
+def iter_files(paths):
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            yield path, f.read()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='text files to analyze')
+    parser.add_argument('--transcripts', help="'all' or a comma-separated list of transcript ids")
+    parser.add_argument('--output', help='where to write per-document results (default: stdout)')
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson',
+                        help='ndjson keeps the nested results; csv is plain CSV with one flat row per document')
+    parser.add_argument('--summary', help='where to write corpus aggregates as JSON (default: stderr)')
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--chunksize', type=int, default=32)
+    args = parser.parse_args(argv)
+
+    if args.transcripts:
+        ids = None if args.transcripts == 'all' else [int(i) for i in args.transcripts.split(',')]
+        documents = iter_transcripts(ids)
+    elif args.files:
+        documents = iter_files(args.files)
+    else:
+        parser.error('give text files or --transcripts')
+
+    output = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        write = csv_writer(output) if args.format == 'csv' else ndjson_writer(output)
+        aggregate = analyze_corpus(documents, processes=args.processes, chunksize=args.chunksize, on_result=write)
+    finally:
+        if args.output:
+            output.close()
+
+    summary = json.dumps(aggregate.to_dict(), ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(summary)
+    else:
+        print(summary, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
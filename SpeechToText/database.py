@@ -0,0 +1,224 @@
+"""SQLite settings, grouped commits and maintenance for the transcripts database.
+
+Every pooled connection is switched to WAL with synchronous=NORMAL: readers
+no longer block the writer, and a commit appends to the WAL without an
+fsync (the WAL is synced at checkpoints). Concurrent writers from several
+gunicorn workers wait on the busy timeout instead of failing with
+"database is locked".
+"""
+import fcntl
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy import event, text as sql
+from sqlalchemy.orm import Session
+
+from startup import worker_model
+
+log = logging.getLogger(__name__)
+
+BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '30'))
+CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '16384'))
+MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+# One connection per request thread plus the commit group and maintenance threads
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', str(worker_model()['threads'] + 2)))
+# Burst room for servers with more threads than that, e.g. the threaded dev server
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+
+GROUP_COMMIT = os.getenv('DB_GROUP_COMMIT', '0') == '1'
+GROUP_COMMIT_WINDOW = float(os.getenv('DB_GROUP_COMMIT_WINDOW', '0.005'))
+GROUP_COMMIT_MAX = int(os.getenv('DB_GROUP_COMMIT_MAX', '64'))
+
+MAINTENANCE_INTERVAL = float(os.getenv('DB_MAINTENANCE_INTERVAL', '0'))
+# VACUUM only once this share of the file is free pages
+VACUUM_FREE_RATIO = float(os.getenv('DB_VACUUM_FREE_RATIO', '0.2'))
+
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    f'PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}',
+    # Negative cache_size is in KiB rather than pages
+    f'PRAGMA cache_size=-{CACHE_SIZE_KB}',
+    f'PRAGMA mmap_size={MMAP_SIZE}',
+    'PRAGMA temp_store=MEMORY',
+]
+
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri`; only file-backed SQLite is tuned."""
+    if not uri.startswith('sqlite:') or ':memory:' in uri or uri in ('sqlite://', 'sqlite:///'):
+        return {}
+    return {
+        'pool_size': POOL_SIZE,
+        'max_overflow': MAX_OVERFLOW,
+        'pool_timeout': BUSY_TIMEOUT,
+        'connect_args': {'timeout': BUSY_TIMEOUT, 'check_same_thread': False},
+    }
+
+
+def install_pragmas(engine):
+    """Apply PRAGMAS to every new connection of a file-backed SQLite engine."""
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+class CommitGroup:
+    """Commits objects from many request threads in shared transactions.
+
+    add() queues an object and blocks until the background thread has
+    committed it together with whatever else arrived within
+    GROUP_COMMIT_WINDOW (up to GROUP_COMMIT_MAX objects). One transaction
+    per group instead of one per request keeps the write lock, and the
+    commit, off the hot path of every save. If a group fails, its objects
+    are retried one by one so only the bad one reports the error.
+    """
+
+    def __init__(self, engine, window=GROUP_COMMIT_WINDOW, max_size=GROUP_COMMIT_MAX):
+        self.engine = engine
+        self.window = window
+        self.max_size = max_size
+        self.queue = queue.Queue()
+        self.groups = 0
+        self.committed = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def add(self, obj, timeout=None):
+        """Commit `obj` and return it with its primary key and defaults loaded."""
+        future = Future()
+        self._ensure_thread()
+        self.queue.put((obj, future))
+        return future.result(timeout)
+
+    def _ensure_thread(self):
+        # Started lazily so each forked worker gets its own thread
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='commit-group', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            group = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(group) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    group.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(group)
+
+    def _commit(self, group):
+        try:
+            with Session(self.engine, expire_on_commit=False) as session:
+                session.add_all([obj for obj, _ in group])
+                session.commit()
+            self.groups += 1
+            self.committed += len(group)
+            for obj, future in group:
+                future.set_result(obj)
+        except Exception as e:
+            if len(group) == 1:
+                group[0][1].set_exception(e)
+                return
+            for item in group:
+                self._commit([item])
+
+
+def checkpoint(engine):
+    """Fold the WAL back into the database file and truncate it."""
+    with engine.connect() as conn:
+        busy, log_pages, checkpointed = conn.execute(sql('PRAGMA wal_checkpoint(TRUNCATE)')).one()
+    return {'busy': bool(busy), 'wal_pages': log_pages, 'checkpointed_pages': checkpointed}
+
+
+def maintain(engine, vacuum=None, analyze=False):
+    """Checkpoint, refresh planner statistics and reclaim free pages.
+
+    VACUUM rewrites the whole file and blocks writers while it runs, so by
+    default it only happens once VACUUM_FREE_RATIO of the pages are free;
+    pass vacuum=True/False to force it either way. analyze=True runs a full
+    ANALYZE instead of the cheaper PRAGMA optimize.
+    """
+    report = {}
+    with engine.connect() as conn:
+        page_count = conn.execute(sql('PRAGMA page_count')).scalar()
+        free_pages = conn.execute(sql('PRAGMA freelist_count')).scalar()
+        report['free_ratio'] = round(free_pages / page_count, 3) if page_count else 0.0
+        if vacuum is None:
+            vacuum = report['free_ratio'] >= VACUUM_FREE_RATIO
+        conn.exec_driver_sql('ANALYZE' if analyze else 'PRAGMA optimize')
+        conn.commit()
+        if vacuum:
+            # VACUUM cannot run inside a transaction
+            conn.connection.driver_connection.execute('VACUUM')
+        report['analyzed'] = analyze
+        report['vacuumed'] = bool(vacuum)
+    report.update(checkpoint(engine))
+    return report
+
+
+class MaintenanceJob:
+    """Runs maintain() every `interval` seconds in one worker per host.
+
+    Every worker starts the timer. A lock on `<db>.maintenance`, which also
+    records when maintenance last ran, lets only the first worker to tick
+    in each interval do the work.
+    """
+
+    def __init__(self, engine, interval=MAINTENANCE_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self.lock_path = f'{engine.url.database}.maintenance'
+        self.last_report = None
+        self.thread = None
+
+    def start(self):
+        """Start the timer unless it is disabled or already running in this process."""
+        if self.interval <= 0 or (self.thread is not None and self.thread.is_alive()):
+            return self
+        self.thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                log.error(f"Database maintenance error: {str(e)}")
+
+    def run_once(self):
+        """maintain() unless another worker holds the lock or ran it this interval."""
+        with open(self.lock_path, 'a+') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                lock_file.seek(0)
+                last_run = float(lock_file.read() or 0)
+                if time.time() - last_run < self.interval / 2:
+                    return None
+                self.last_report = maintain(self.engine)
+                lock_file.seek(0)
+                lock_file.truncate()
+                lock_file.write(str(time.time()))
+                return self.last_report
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,34 @@
+import os
+
+import startup
+
+# Worker class and counts come from the CPUs available and the environment;
+# see startup.worker_model()
+_model = startup.worker_model()
+worker_class = _model['worker_class']
+workers = _model['workers']
+threads = _model['threads']
+worker_connections = _model['worker_connections']
+bind = f"0.0.0.0:{os.getenv('PORT', '3000')}"
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then, staggered so they don't all restart together;
+# with preload each replacement is forked from the warmed-up master
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = max_requests // 10
+
+# Import the app once in the master, migrate the database and load the NLTK
+# models before forking, so the workers share them; GUNICORN_PRELOAD=0
+# imports the app in each worker, which migrates on its first request.
+# Off by default for gevent, which must patch the standard library before
+# the app creates its locks and connections
+preload_app = os.getenv('GUNICORN_PRELOAD', '0' if worker_class == 'gevent' else '1') == '1'
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from app import migrate
+        migrate()
+        server.log.info(f"Warmed up before fork: {startup.warmup()}")
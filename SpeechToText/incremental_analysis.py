@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict
+
+from text_analysis import RunningTotals, build_result, get_analyzer
+
+# Trailing sentences that are re-tokenized on every append: the last one may
+# still be growing, and punkt's decision about the boundary before it depends
+# on what follows
+REOPEN_SENTENCES = 2
+
+
+class StructureState:
+    """analyze_structure() as a state machine fed one complete line at a time."""
+
+    def __init__(self):
+        self.paragraphs = 0
+        self.sections = []
+        self.current = {'title': 'Main Content', 'content': []}
+
+    def feed(self, line):
+        para = line.strip()
+        if not para:
+            return
+        self.paragraphs += 1
+        # Check if paragraph might be a header (short, ends without period)
+        if len(para) < 50 and not para.endswith('.'):
+            if self.current['content']:
+                self.sections.append(self.current)
+            self.current = {'title': para, 'content': []}
+        else:
+            self.current['content'].append(para)
+
+    def result(self, tail=''):
+        """Structure as if `tail` were the final line, without consuming it."""
+        state = StructureState()
+        state.paragraphs = self.paragraphs
+        state.sections = list(self.sections)
+        state.current = {'title': self.current['title'], 'content': list(self.current['content'])}
+        state.feed(tail)
+
+        sections = state.sections
+        if state.current['content']:
+            sections.append(state.current)
+        return {
+            'paragraphs': state.paragraphs,
+            'sections': sections if len(sections) > 1 else None
+        }
+
+
+class AnalysisSession:
+    """
+    analyze_text() for a transcript that only ever grows.
+
+    `append(delta)` re-tokenizes just the last few sentences plus the new
+    text, adjusting running totals, and `result()` returns what
+    analyze_text() would return for the whole text so far. Interim results
+    score sentiment as the mean over sentences, kept up to date like the
+    counts; `result(final=True)` runs VADER once over the whole text and
+    matches analyze_text() exactly. The text is kept as the list of appended
+    pieces; callers sharing a session hold `lock`.
+    """
+
+    def __init__(self, analyzer=None):
+        self.analyzer = analyzer or get_analyzer()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.length = 0
+        self.totals = RunningTotals()
+        self._pieces = []
+        self._blank = True
+        # Text from the start of the reopened sentences, and their stats
+        self._window = ''
+        self._window_stats = []
+        self._structure = StructureState()
+        self._line_tail = ''
+        return self
+
+    @property
+    def text(self):
+        return ''.join(self._pieces)
+
+    def extended_by(self, text):
+        """Whether `text` starts with everything appended so far."""
+        position = 0
+        for piece in self._pieces:
+            if not text.startswith(piece, position):
+                return False
+            position += len(piece)
+        return True
+
+    def append(self, delta):
+        if not delta:
+            return self
+        self._pieces.append(delta)
+        self.length += len(delta)
+        self._blank = self._blank and not delta.strip()
+
+        for stats in self._window_stats:
+            self.totals.remove(stats)
+        window = self._window + delta
+        spans = list(self.analyzer.sentence_tokenizer.span_tokenize(window))
+        stats = [self.analyzer.sentence_stats(window[start:end], sentiment=True) for start, end in spans]
+        for sentence_stats in stats:
+            self.totals.add(sentence_stats)
+
+        keep = max(len(spans) - REOPEN_SENTENCES, 0)
+        if keep:
+            self._window = window[spans[keep][0]:]
+        else:
+            self._window = window
+        self._window_stats = stats[keep:]
+
+        lines = (self._line_tail + delta).split('\n')
+        for line in lines[:-1]:
+            self._structure.feed(line)
+        self._line_tail = lines[-1]
+        return self
+
+    def result(self, final=False):
+        if self._blank:
+            return {
+                'error': 'Empty text provided'
+            }
+        counts = self.totals.counts(self._structure.result(self._line_tail))
+        if final:
+            # VADER's whole-text score doesn't decompose by sentence, so it is
+            # paid for once, when the transcript is done
+            counts['sentiment_scores'] = self.analyzer.sia.polarity_scores(self.text)
+        return build_result(**counts)
+
+
+class SessionStore:
+    """
+    AnalysisSessions by owner, dropped after `ttl` seconds unused and, past
+    `max_sessions`, least recently used first.
+    """
+
+    def __init__(self, max_sessions=1000, ttl=1800):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, owner):
+        """The owner's session, created if there is none."""
+        now = time.monotonic()
+        with self._lock:
+            while self._sessions:
+                oldest, (_, used) = next(iter(self._sessions.items()))
+                if now - used <= self.ttl and len(self._sessions) <= self.max_sessions:
+                    break
+                del self._sessions[oldest]
+            session, _ = self._sessions.pop(owner, (None, None))
+            if session is None:
+                session = AnalysisSession()
+            self._sessions[owner] = (session, now)
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def discard(self, owner):
+        with self._lock:
+            self._sessions.pop(owner, None)
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1 @@
+../jobqueue.py
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""Schema changes that db.create_all() cannot make to an existing database.
+
+create_all() only creates missing tables, so columns and indexes added to
+existing models are applied here. Every step checks before it changes
+anything and is safe to run on each start.
+"""
+from sqlalchemy import inspect, text as sql
+
+PREVIEW_CHARS = 200
+
+
+def _columns(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def add_transcript_listing_columns(conn):
+    """preview/length for the transcript list, backfilled from content."""
+    columns = _columns(conn, 'transcript')
+    if 'preview' not in columns:
+        conn.execute(sql("ALTER TABLE transcript ADD COLUMN preview VARCHAR(200) NOT NULL DEFAULT ''"))
+    if 'length' not in columns:
+        conn.execute(sql("ALTER TABLE transcript ADD COLUMN length INTEGER NOT NULL DEFAULT 0"))
+    if 'preview' not in columns or 'length' not in columns:
+        conn.execute(sql(
+            "UPDATE transcript SET preview = substr(content, 1, :chars), length = length(content)"
+        ), {'chars': PREVIEW_CHARS})
+
+
+def add_transcript_listing_index(conn):
+    conn.execute(sql(
+        "CREATE INDEX IF NOT EXISTS ix_transcript_user_created ON transcript (user_id, created_at, id)"
+    ))
+
+
+def add_compressed_content(conn):
+    """content_z blob; rows are compressed later by compression.compress_existing()."""
+    if 'content_z' not in _columns(conn, 'transcript'):
+        conn.execute(sql("ALTER TABLE transcript ADD COLUMN content_z BLOB"))
+
+
+def add_transcript_text_view(conn):
+    """Plain text of every transcript, compressed or not, for SQL readers."""
+    conn.execute(sql("""
+        CREATE VIEW IF NOT EXISTS transcript_text AS
+        SELECT id, title, user_id, created_at,
+               CASE WHEN content_z IS NULL THEN content ELSE transcript_text(content_z) END AS content
+        FROM transcript
+    """))
+
+
+def index_search_from_view(conn):
+    """Drop a search index that reads transcript.content directly; search.install() rebuilds it."""
+    fts = conn.execute(sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transcript_fts'"
+    )).scalar()
+    if fts and "content='transcript'," in fts:
+        for trigger in ('transcript_fts_ai', 'transcript_fts_ad', 'transcript_fts_au'):
+            conn.execute(sql(f"DROP TRIGGER IF EXISTS {trigger}"))
+        conn.execute(sql("DROP TABLE transcript_fts"))
+
+
+STEPS = [
+    add_transcript_listing_columns,
+    add_transcript_listing_index,
+    add_compressed_content,
+    add_transcript_text_view,
+    index_search_from_view,
+]
+
+
+def upgrade(engine):
+    with engine.begin() as conn:
+        for step in STEPS:
+            step(conn)
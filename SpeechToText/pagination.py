@@ -0,0 +1,19 @@
+"""Opaque keyset cursors shared by the listing and search endpoints."""
+import base64
+import json
+
+
+def encode_cursor(*values):
+    """Cursor for the row after which the next page starts."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, *types):
+    """Values from encode_cursor(), converted with `types`; ValueError if malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(types):
+            raise ValueError
+        return tuple(convert(value) for convert, value in zip(types, values))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
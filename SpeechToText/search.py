@@ -0,0 +1,317 @@
+"""Ranked full-text search over saved transcripts.
+
+SQLite FTS5 is used when the sqlite3 build has it: an external-content
+table over the `transcript_text` view, kept in sync by triggers, ranked with bm25() and
+highlighted with snippet(). user_id is indexed as a token too, so a query
+only walks the searching user's postings instead of every user's matches. Builds without FTS5 (or SEARCH_BACKEND=local)
+fall back to an in-process inverted index per user, tokenized with
+text_analysis.index_terms and scored with the same BM25 formula.
+
+Both backends page with an opaque (score, id) keyset cursor.
+"""
+import bisect
+import html
+import math
+import os
+import re
+import threading
+import unicodedata
+
+from sqlalchemy import text as sql
+from sqlalchemy.exc import OperationalError
+
+from pagination import decode_cursor, encode_cursor
+from text_analysis import index_terms
+
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')
+MAX_LIMIT = 100
+
+# Title matches count five times as much as body matches
+TITLE_WEIGHT = 5.0
+CONTENT_WEIGHT = 1.0
+# BM25 parameters; these are FTS5's built-in values
+K1 = 1.2
+B = 0.75
+
+SNIPPET_TOKENS = 12
+# Control characters cannot occur in stored text, so they mark matches
+# safely until the snippet has been HTML-escaped
+_OPEN, _CLOSE = '\x02', '\x03'
+
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE transcript_fts USING fts5(
+        title, content, user_id,
+        content='transcript_text', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS transcript_fts_ai AFTER INSERT ON transcript BEGIN
+        INSERT INTO transcript_fts(rowid, title, content, user_id) VALUES (new.id, new.title, {new_text}, new.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transcript_fts_ad AFTER DELETE ON transcript BEGIN
+        INSERT INTO transcript_fts(transcript_fts, rowid, title, content, user_id) VALUES ('delete', old.id, old.title, {old_text}, old.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transcript_fts_au AFTER UPDATE ON transcript BEGIN
+        INSERT INTO transcript_fts(transcript_fts, rowid, title, content, user_id) VALUES ('delete', old.id, old.title, {old_text}, old.user_id);
+        INSERT INTO transcript_fts(rowid, title, content, user_id) VALUES (new.id, new.title, {new_text}, new.user_id);
+    END""",
+]
+
+# Compressed rows keep their text in content_z (see compression.py)
+_TEXT = "CASE WHEN {row}.content_z IS NULL THEN {row}.content ELSE transcript_text({row}.content_z) END"
+FTS_SCHEMA = [
+    statement.format(new_text=_TEXT.format(row='new'), old_text=_TEXT.format(row='old'))
+    for statement in FTS_SCHEMA
+]
+
+FTS_QUERY = f"""
+    SELECT t.id, t.title, t.created_at,
+           snippet(transcript_fts, 1, '{_OPEN}', '{_CLOSE}', '…', {SNIPPET_TOKENS}) AS snippet,
+           bm25(transcript_fts, {TITLE_WEIGHT}, {CONTENT_WEIGHT}, 0.0) AS score
+    FROM transcript_fts JOIN transcript t ON t.id = transcript_fts.rowid
+    WHERE transcript_fts MATCH :match {{after}}
+    ORDER BY score, t.id
+    LIMIT :limit
+"""
+FTS_AFTER = "AND (score > :score OR (score = :score AND t.id > :id))"
+
+
+def install(engine):
+    """Create the search index and triggers if missing. Returns False if FTS5 is unavailable."""
+    if _has_index(engine):
+        return True
+    with engine.begin() as conn:
+        try:
+            conn.execute(sql(FTS_SCHEMA[0]))
+        except OperationalError as e:
+            if 'fts5' in str(e):
+                return False
+            raise
+        for statement in FTS_SCHEMA[1:]:
+            conn.execute(sql(statement))
+        # Index whatever was saved before the table existed
+        conn.execute(sql("INSERT INTO transcript_fts(transcript_fts) VALUES ('rebuild')"))
+    return True
+
+
+def _has_index(engine):
+    with engine.connect() as conn:
+        return conn.execute(sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transcript_fts'"
+        )).first() is not None
+
+
+def query_terms(query):
+    """Search terms from free text; the last one is treated as a prefix while typing."""
+    terms = [_fold(term) for term in re.findall(r'\w+', query.lower())]
+    if not terms:
+        raise ValueError('Empty query')
+    return terms
+
+
+def fts_match(user_id, terms):
+    """FTS5 MATCH expression: the user's rows with every term, the last one as a prefix."""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return f'user_id : "{int(user_id)}" AND {{title content}} : ({" ".join(quoted)})'
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and turn the match markers into <mark> tags."""
+    return html.escape(snippet).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def _fold(term):
+    """Strip diacritics like FTS5's remove_diacritics option."""
+    decomposed = unicodedata.normalize('NFKD', term)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _created_at(value):
+    # Raw SQLite rows hold the DateTime column as text
+    return value[:19] if isinstance(value, str) else value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class _UserIndex:
+    """Inverted index over one user's transcripts."""
+
+    def __init__(self, rows):
+        self.docs = {}
+        # term -> {doc id: [title tf, content tf]}
+        self.postings = {}
+        self.lengths = [0, 0]
+        for id, title, content, created_at in rows:
+            fields = (title, content)
+            doc_lengths = []
+            for field, value in enumerate(fields):
+                terms = [_fold(term) for term in index_terms(value)]
+                doc_lengths.append(len(terms))
+                self.lengths[field] += len(terms)
+                for term in terms:
+                    self.postings.setdefault(term, {}).setdefault(id, [0, 0])[field] += 1
+            self.docs[id] = (title, content, _created_at(created_at), doc_lengths)
+        self.vocabulary = sorted(self.postings)
+
+    def expand(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + '\U0010ffff')
+        return self.vocabulary[start:end]
+
+    def search(self, terms):
+        """[(score, id, matched terms)] for documents containing every term, best first.
+
+        Scores are negated BM25 so that, like FTS5's bm25(), lower is better.
+        """
+        groups = [[term] for term in terms[:-1]] + [self.expand(terms[-1])]
+        candidates = None
+        for group in groups:
+            ids = set()
+            for term in group:
+                ids.update(self.postings.get(term, ()))
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return []
+
+        count = len(self.docs)
+        averages = [max(total / count, 1) for total in self.lengths]
+        weights = (TITLE_WEIGHT, CONTENT_WEIGHT)
+        matched = {term for group in groups for term in group}
+        scores = dict.fromkeys(candidates, 0.0)
+        for term in matched:
+            postings = self.postings.get(term, {})
+            hits = candidates.intersection(postings)
+            if not hits:
+                continue
+            idf = max(math.log((count - len(postings) + 0.5) / (len(postings) + 0.5)), 1e-6)
+            for id in hits:
+                doc_lengths = self.docs[id][3]
+                for field, tf in enumerate(postings[id]):
+                    if tf:
+                        norm = K1 * (1 - B + B * doc_lengths[field] / averages[field])
+                        scores[id] -= weights[field] * idf * tf * (K1 + 1) / (tf + norm)
+        return sorted(((score, id, matched) for id, score in scores.items()), key=lambda hit: hit[:2])
+
+
+class LocalIndex:
+    """Per-user inverted indexes, rebuilt when the user's transcripts change.
+
+    Each worker process keeps its own copy. A (count, max id) signature is
+    checked on every search, so saves and deletes made by other processes
+    are picked up on the next query.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.engine.connect() as conn:
+            signature = tuple(conn.execute(sql(
+                "SELECT count(*), max(id) FROM transcript WHERE user_id = :user_id"
+            ), {'user_id': user_id}).one())
+            with self.lock:
+                cached = self.indexes.get(user_id)
+                if cached and cached[0] == signature:
+                    return cached[1]
+            rows = conn.execute(sql(
+                "SELECT id, title, content, created_at FROM transcript_text WHERE user_id = :user_id"
+            ), {'user_id': user_id}).all()
+        index = _UserIndex(rows)
+        with self.lock:
+            self.indexes[user_id] = (signature, index)
+        return index
+
+    def search(self, user_id, terms, limit, after=None):
+        index = self.get(user_id)
+        hits = index.search(terms)
+        if after:
+            start = bisect.bisect_right([hit[:2] for hit in hits], after)
+            hits = hits[start:]
+        results = []
+        for score, id, matched in hits[:limit]:
+            title, content, created_at, _ = index.docs[id]
+            results.append((id, title, created_at, _local_snippet(content or title, matched), score))
+        return results
+
+
+def _local_snippet(content, terms):
+    """About SNIPPET_TOKENS words around the first match, with matches marked."""
+    words = list(re.finditer(r'\w+', content))
+    first = next((i for i, word in enumerate(words) if _fold(word.group().lower()) in terms), 0)
+    start = max(first - SNIPPET_TOKENS // 4, 0)
+    window = words[start:start + SNIPPET_TOKENS]
+    if not window:
+        return ''
+    begin, end = window[0].start(), window[-1].end()
+    parts = []
+    position = begin
+    for word in window:
+        parts.append(content[position:word.start()])
+        if _fold(word.group().lower()) in terms:
+            parts.append(_OPEN + word.group() + _CLOSE)
+        else:
+            parts.append(word.group())
+        position = word.end()
+    snippet = ''.join(parts)
+    if begin > 0:
+        snippet = '…' + snippet
+    if end < len(content):
+        snippet += '…'
+    return snippet
+
+
+class TranscriptSearch:
+    """Search entry point; picks FTS5 when available."""
+
+    def __init__(self, engine, backend=SEARCH_BACKEND):
+        self.engine = engine
+        self._backend = None
+        self.local = None
+        if backend == 'local':
+            self._backend = 'local'
+            self.local = LocalIndex(engine)
+
+    @property
+    def backend(self):
+        # Decided on first search: the index is created by install() during
+        # migration, after the app (and this object) may already exist
+        if self._backend is None:
+            if _has_index(self.engine):
+                self._backend = 'fts5'
+            else:
+                self.local = LocalIndex(self.engine)
+                self._backend = 'local'
+        return self._backend
+
+    def search(self, user_id, query, limit=20, cursor=None):
+        """One page of results: {'results': [...], 'next_cursor': str or None, 'backend': ...}."""
+        terms = query_terms(query)
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        after = decode_cursor(cursor, float, int) if cursor else None
+
+        # One extra row tells whether another page exists
+        if self.backend == 'fts5':
+            rows = self._search_fts(user_id, terms, limit + 1, after)
+        else:
+            rows = self.local.search(user_id, terms, limit + 1, after)
+
+        page = rows[:limit]
+        return {
+            'results': [{
+                'id': id,
+                'title': title,
+                'created_at': _created_at(created_at),
+                'snippet': highlight(snippet),
+                'score': round(-score, 4)
+            } for id, title, created_at, snippet, score in page],
+            'next_cursor': encode_cursor(page[-1][4], page[-1][0]) if len(rows) > limit else None,
+            'backend': self.backend
+        }
+
+    def _search_fts(self, user_id, terms, limit, after):
+        params = {'match': fts_match(user_id, terms), 'limit': limit}
+        if after:
+            params['score'], params['id'] = after
+        query = FTS_QUERY.format(after=FTS_AFTER if after else '')
+        with self.engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(sql(query), params)]
@@ -0,0 +1,93 @@
+import math
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import audio_pipeline
+from audio_pipeline import BYTES_PER_SECOND, AudioError, SAMPLE_RATE, EnergyVad, Recognizer, frames, split_on_silence, transcribe_pcm
+
+
+class LengthRecognizer(Recognizer):
+    """Names each chunk after its length, so the tests can see the split."""
+
+    def transcribe(self, pcm):
+        return f'{len(pcm) / BYTES_PER_SECOND:.1f}s'
+
+
+class CrashingRecognizer(Recognizer):
+    def transcribe(self, pcm):
+        os._exit(1)
+
+
+def tone(seconds, amplitude=8000, frequency=220, syllables=4):
+    """A voiced sound whose loudness rises and falls `syllables` times a second, like speech."""
+    count = int(seconds * SAMPLE_RATE)
+    return struct.pack(f'<{count}h', *(
+        int(amplitude * (0.55 - 0.45 * math.cos(2 * math.pi * syllables * i / SAMPLE_RATE))
+            * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE))
+        for i in range(count)
+    ))
+
+
+def silence(seconds):
+    return tone(seconds, amplitude=20, syllables=0)
+
+
+def blocks(pcm, size=7919):
+    # An odd block size so frames straddle block boundaries
+    return [pcm[i:i + size] for i in range(0, len(pcm), size)]
+
+
+def test_splits_on_pauses_and_pads_chunks():
+    pcm = silence(0.5) + tone(1.0) + silence(1.0) + tone(2.0) + silence(0.3) + tone(0.5) + silence(1.0)
+    chunks = list(split_on_silence(frames(blocks(pcm)), EnergyVad()))
+
+    # The 0.3s pause is too short to split on
+    assert len(chunks) == 2
+    starts = [start for start, _ in chunks]
+    assert abs(starts[0] - 0.5) < 0.25 and abs(starts[1] - 2.5) < 0.25
+    durations = [len(chunk) / BYTES_PER_SECOND for _, chunk in chunks]
+    assert 1.0 <= durations[0] <= 1.5
+    assert 2.8 <= durations[1] <= 3.3
+
+
+def test_long_speech_is_cut_at_max_chunk_length():
+    chunks = list(split_on_silence(frames(blocks(tone(5.0))), EnergyVad(), max_chunk_seconds=2))
+    assert [round(len(chunk) / BYTES_PER_SECOND) for _, chunk in chunks] == [2, 2, 1]
+
+
+def test_clicks_are_dropped():
+    pcm = silence(0.5) + tone(0.06) + silence(1.0)
+    assert list(split_on_silence(frames(blocks(pcm)), EnergyVad())) == []
+
+
+def test_transcribes_chunks_in_order_with_progress():
+    pcm = silence(0.3) + tone(1.0) + silence(1.0) + tone(3.0) + silence(1.0) + tone(0.5) + silence(0.5)
+    updates = []
+    executor = ThreadPoolExecutor(
+        max_workers=2, initializer=audio_pipeline._init_worker,
+        initargs=('test_audio_pipeline:LengthRecognizer',)
+    )
+    with executor:
+        text = transcribe_pcm(blocks(pcm), on_progress=lambda **p: updates.append(p), executor=executor, window=1)
+
+    # Chunks come back in audio order even though the 3s one takes longest
+    assert [round(float(part[:-1])) for part in text.split()] == [1, 3, 1]
+    assert updates[-1]['chunks_done'] == updates[-1]['chunks_total'] == 3
+    assert abs(updates[-1]['audio_seconds'] - len(pcm) / BYTES_PER_SECOND) < 0.01
+
+
+def test_unloadable_engine_and_crashed_pool_raise_audio_error(monkeypatch):
+    monkeypatch.setattr(audio_pipeline, '_executor', None)
+    monkeypatch.setattr(audio_pipeline, 'ENGINE', 'no_such_engine:Recognizer')
+    with pytest.raises(AudioError):
+        transcribe_pcm(blocks(tone(1.0)))
+
+    monkeypatch.setattr(audio_pipeline, 'ENGINE', 'test_audio_pipeline:CrashingRecognizer')
+    for _ in range(2):
+        # Each attempt gets a fresh pool instead of the broken one
+        with pytest.raises(AudioError):
+            transcribe_pcm(blocks(tone(1.0)))
+        assert audio_pipeline._executor is None
@@ -0,0 +1,125 @@
+import random
+import re
+
+import pytest
+
+from incremental_analysis import AnalysisSession, SessionStore
+from text_analysis import RunningTotals, TextAnalyzer, analyze_structure, build_result, get_analyzer
+
+
+class StubSentenceTokenizer:
+    """Ends a sentence at . ! or ? followed by whitespace."""
+
+    def span_tokenize(self, text):
+        for match in re.finditer(r'\S.*?(?:[.!?](?=\s)|\Z)', text, re.S):
+            yield match.start(), match.start() + len(match.group().rstrip())
+
+    def tokenize(self, text):
+        return [text[start:end] for start, end in self.span_tokenize(text)]
+
+
+class StubSentiment:
+    """polarity_scores() from two short word lists, rounded the way VADER rounds."""
+    positive = frozenset(['great', 'improve', 'sure', 'good'])
+    negative = frozenset(['fails', 'confused', 'delayed', 'issues', 'long'])
+
+    def polarity_scores(self, text):
+        words = re.findall(r'[a-z]+', text.lower())
+        pos = sum(word in self.positive for word in words)
+        neg = sum(word in self.negative for word in words)
+        total = len(words) or 1
+        return {
+            'neg': round(neg / total, 3),
+            'neu': round((total - pos - neg) / total, 3),
+            'pos': round(pos / total, 3),
+            'compound': round((pos - neg) / (pos + neg + 1), 4),
+        }
+
+
+class StubAnalyzer(TextAnalyzer):
+    """TextAnalyzer that needs no NLTK data files."""
+
+    def __init__(self):
+        from nltk.tokenize import NLTKWordTokenizer
+
+        self.stop_words = frozenset(['a', 'are', 'and', 'for', 'is', 'our', 'the', 'to', 'we', 'with'])
+        self.sia = StubSentiment()
+        self.sentence_tokenizer = StubSentenceTokenizer()
+        self.word_tokenizer = NLTKWordTokenizer()
+
+
+@pytest.fixture(params=['stub', 'nltk'])
+def analyzer(request):
+    if request.param == 'stub':
+        return StubAnalyzer()
+    try:
+        return get_analyzer()
+    except LookupError:
+        pytest.skip('NLTK punkt/stopwords/vader_lexicon data not installed')
+
+
+def interim(analyzer, text):
+    """What an interim session result should be: sentiment averaged over sentences."""
+    totals = RunningTotals()
+    for sentence in analyzer.sentence_tokenizer.tokenize(text):
+        totals.add(analyzer.sentence_stats(sentence, sentiment=True))
+    return build_result(**totals.counts(analyze_structure(text)))
+
+TRANSCRIPT = """Weekly sync
+We need to improve our document signing workflow. The current process takes too long and users get confused.
+Key issues
+PDF upload sometimes fails with large files! Email notifications are delayed, e.g. when sharing documents.
+Dr. Smith thinks mobile signatures are a great idea... Are they really? Nobody is sure yet.
+Next steps
+Add a progress bar for large file uploads. Improve mobile UI for signature placement.
+"""
+
+
+def deltas(text, rng):
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 40)
+        yield text[position:position + size]
+        position += size
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_full_recompute_after_every_delta(analyzer, seed):
+    rng = random.Random(seed)
+    session = AnalysisSession(analyzer)
+    so_far = ''
+    for delta in deltas(TRANSCRIPT, rng):
+        so_far += delta
+        assert session.append(delta).result() == interim(analyzer, so_far)
+        assert session.result(final=True) == analyzer.analyze(so_far)
+
+
+def test_word_by_word_dictation(analyzer):
+    session = AnalysisSession(analyzer)
+    so_far = ''
+    for word in TRANSCRIPT.split(' '):
+        delta = word + ' '
+        so_far += delta
+        session.append(delta)
+    assert session.result() == interim(analyzer, so_far)
+    assert session.result(final=True) == analyzer.analyze(so_far)
+
+
+def test_empty_session_reports_error(analyzer):
+    assert AnalysisSession(analyzer).append('   \n').result() == {'error': 'Empty text provided'}
+
+
+def test_session_store_evicts_idle_and_least_recently_used(monkeypatch):
+    store = SessionStore(max_sessions=2, ttl=60)
+    clock = [0.0]
+    monkeypatch.setattr('incremental_analysis.get_analyzer', StubAnalyzer)
+    monkeypatch.setattr('incremental_analysis.time.monotonic', lambda: clock[0])
+    first = store.get('a')
+    store.get('b')
+    assert store.get('a') is first
+    store.get('c')
+    assert len(store) == 2 and store.get('a') is first
+
+    clock[0] = 120
+    assert store.get('a') is not first
+    assert len(store) == 1
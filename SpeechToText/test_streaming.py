@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+import ai_analysis
+from ratelimit import RateLimited, RateLimiter
+from together_stub import TogetherStub
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = TogetherStub().start()
+    monkeypatch.setattr(ai_analysis, 'TOGETHER_API_URL', server.url)
+    # The key is read when ai_analysis is first imported, maybe by another test module
+    monkeypatch.setattr(ai_analysis, 'TOGETHER_API_KEY', 'test-key')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_stream_completion_yields_tokens(stub):
+    tokens = list(ai_analysis.stream_completion('prompt'))
+    assert tokens == stub.tokens
+
+
+def test_stream_analyses_tags_tokens_by_section(stub):
+    text = {'analysis': '', 'summary': ''}
+    done = []
+    for section, kind, payload in ai_analysis.stream_analyses('hola', ['analysis', 'summary']):
+        if kind == 'token':
+            text[section] += payload
+        elif kind == 'done':
+            done.append(section)
+    assert sorted(done) == ['analysis', 'summary']
+    assert text['analysis'] == text['summary'] == ''.join(stub.tokens)
+
+
+def test_closing_the_stream_cancels_upstream(stub):
+    stub.token_delay = 0.2
+    events = ai_analysis.stream_analyses('hola', ['analysis'])
+    assert next(events)[1] == 'token'
+    events.close()
+    deadline = time.time() + 3
+    while not stub.disconnects and time.time() < deadline:
+        time.sleep(0.05)
+    assert stub.disconnects == 1
+
+
+def test_quota_exhaustion_is_returned_for_a_429(stub, monkeypatch, tmp_path):
+    limiter = RateLimiter(str(tmp_path / 'ratelimit.db'))
+    limiter.configure('together', '2/hour', upstream=True)
+    monkeypatch.setattr(ai_analysis, 'quota_check', lambda: limiter.check('together'))
+    results = ai_analysis.run_all_analyses('hola')
+    assert stub.requests == 2
+    assert len(results['errors']) == 2 and len(results['timings']) == 2
+    assert isinstance(results['rate_limited'], RateLimited)
+    assert results['rate_limited'].retry_after > 0
@@ -1,38 +1,168 @@
-import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import stopwords
-from nltk.sentiment import SentimentIntensityAnalyzer
 from collections import Counter
+from functools import lru_cache
 from string import punctuation
 import re
+import threading
 
-def analyze_text(text):
-    """Analyze text and return various insights."""
-    if not text.strip():
+# VADER rounds pos/neu/neg to 3 decimals and compound to 4, so per-sentence
+# scores are summed as scaled integers and running totals stay exact
+SENTIMENT_SCALE = {'pos': 1000, 'neu': 1000, 'neg': 1000, 'compound': 10000}
+
+class SentenceStats:
+    """Everything one sentence contributes to the text totals."""
+    __slots__ = ('word_count', 'words', 'syllables', 'sentiment')
+
+    def __init__(self, word_count, words, syllables, sentiment):
+        self.word_count = word_count
+        self.words = words
+        self.syllables = syllables
+        self.sentiment = sentiment
+
+class RunningTotals:
+    """Sums of SentenceStats; sentences can be added and taken back out."""
+
+    def __init__(self):
+        self.sentence_count = 0
+        self.word_count = 0
+        self.word_freq = Counter()
+        self.syllables = 0
+        self.sentiment = dict.fromkeys(SENTIMENT_SCALE, 0)
+
+    def add(self, stats):
+        self.sentence_count += 1
+        self.word_count += stats.word_count
+        self.word_freq.update(stats.words)
+        self.syllables += stats.syllables
+        if stats.sentiment:
+            for key, value in stats.sentiment.items():
+                self.sentiment[key] += value
+
+    def remove(self, stats):
+        self.sentence_count -= 1
+        self.word_count -= stats.word_count
+        word_freq = self.word_freq
+        for word in stats.words:
+            word_freq[word] -= 1
+            if not word_freq[word]:
+                # Dropping the key keeps first-occurrence order identical to a fresh Counter
+                del word_freq[word]
+        self.syllables -= stats.syllables
+        if stats.sentiment:
+            for key, value in stats.sentiment.items():
+                self.sentiment[key] -= value
+
+    def counts(self, structure):
+        """Keyword arguments for build_result(); sentiment is the mean of the sentences' scores."""
+        sentences = self.sentence_count or 1
         return {
-            'error': 'Empty text provided'
+            'sentence_count': self.sentence_count,
+            'word_count': self.word_count,
+            'word_freq': self.word_freq,
+            'total_syllables': self.syllables,
+            'sentiment_scores': {key: total / sentences / SENTIMENT_SCALE[key] for key, total in self.sentiment.items()},
+            'structure': structure,
         }
 
-    # Basic text statistics
-    sentences = sent_tokenize(text)
-    words = word_tokenize(text.lower())
-    word_count = len([word for word in words if word.isalnum()])
-    
-    # Remove stopwords and punctuation for key phrases
-    stop_words = set(stopwords.words('english'))
-    words_no_stop = [word for word in words 
-                     if word.isalnum() and word not in stop_words]
-    
+class TextAnalyzer:
+    """Reusable analyzer: NLTK resources are loaded once and each text is tokenized once."""
+
+    def __init__(self):
+        # NLTK alone takes longer to import than the rest of the app, so it
+        # waits for the first analyzer (or the pre-fork warmup)
+        import nltk
+        from nltk.corpus import stopwords
+        from nltk.sentiment import SentimentIntensityAnalyzer
+        from nltk.tokenize import NLTKWordTokenizer
+
+        self.stop_words = frozenset(stopwords.words('english'))
+        self.sia = SentimentIntensityAnalyzer()
+        self.sentence_tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+        self.word_tokenizer = NLTKWordTokenizer()
+
+    def sentence_stats(self, sentence, sentiment=False):
+        """Word count, non-stopwords and syllables for one sentence, plus VADER scores if `sentiment`.
+
+        Sentences are lowercased and word-tokenized one at a time, which is
+        what word_tokenize(text.lower()) does internally minus its second
+        sentence split.
+        """
+        word_count = 0
+        words = []
+        stop_words = self.stop_words
+        for word in self.word_tokenizer.tokenize(sentence.lower()):
+            if word.isalnum():
+                word_count += 1
+                if word not in stop_words:
+                    words.append(word)
+        syllables = sum(count_syllables(word) for word in words)
+        if sentiment:
+            scores = self.sia.polarity_scores(sentence)
+            sentiment = {key: round(scores[key] * scale) for key, scale in SENTIMENT_SCALE.items()}
+        return SentenceStats(word_count, words, syllables, sentiment or None)
+
+    def analyze(self, text):
+        """Analyze text and return various insights."""
+        if not text.strip():
+            return {
+                'error': 'Empty text provided'
+            }
+        return build_result(**self.analyze_counts(text))
+
+    def analyze_counts(self, text):
+        """Raw counts behind analyze(); build_result() turns them into the response.
+
+        Sentiment is one VADER pass over the whole text; everything else is a
+        sum over sentences, which AnalysisSession maintains incrementally.
+        """
+        totals = RunningTotals()
+        for sentence in self.sentence_tokenizer.tokenize(text):
+            totals.add(self.sentence_stats(sentence))
+        return dict(totals.counts(analyze_structure(text)), sentiment_scores=self.sia.polarity_scores(text))
+
+
+@lru_cache(maxsize=None)
+def _word_tokenizer():
+    from nltk.tokenize import NLTKWordTokenizer
+    return NLTKWordTokenizer()
+
+def index_terms(text):
+    """Lowercased alphanumeric words, tokenized the way sentence_stats() counts them.
+
+    Without a sentence split the tokenizer leaves periods attached to
+    sentence-final words, so surrounding punctuation is stripped first.
+    Needs no NLTK data, so the search fallback can use it anywhere.
+    """
+    terms = []
+    for word in _word_tokenizer().tokenize(text.lower()):
+        word = word.strip(punctuation)
+        if word.isalnum():
+            terms.append(word)
+    return terms
+
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+def get_analyzer():
+    """Process-wide TextAnalyzer, created on first use."""
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                _analyzer = TextAnalyzer()
+    return _analyzer
+
+def analyze_text(text):
+    """Analyze text and return various insights."""
+    return get_analyzer().analyze(text)
+
+def build_result(sentence_count, word_count, word_freq, total_syllables, sentiment_scores, structure):
+    """Assemble the analyze_text() response from raw counts."""
     # Get key phrases (most common words)
-    word_freq = Counter(words_no_stop)
     key_phrases = word_freq.most_common(5)
     
     # Calculate average sentence length
-    avg_sentence_length = word_count / len(sentences) if sentences else 0
-    
-    # Sentiment analysis
-    sia = SentimentIntensityAnalyzer()
-    sentiment_scores = sia.polarity_scores(text)
+    avg_sentence_length = word_count / sentence_count if sentence_count else 0
     
     # Determine overall sentiment
     compound_score = sentiment_scores['compound']
@@ -44,21 +174,17 @@ def analyze_text(text):
         sentiment = 'Neutral'
     
     # Calculate readability (Flesch Reading Ease approximation)
-    total_syllables = sum(count_syllables(word) for word in words_no_stop)
-    if word_count > 0 and len(sentences) > 0:
-        flesch_score = 206.835 - 1.015 * (word_count / len(sentences)) - 84.6 * (total_syllables / word_count)
+    if word_count > 0 and sentence_count > 0:
+        flesch_score = 206.835 - 1.015 * (word_count / sentence_count) - 84.6 * (total_syllables / word_count)
     else:
         flesch_score = 0
         
     # Get reading level
     reading_level = get_reading_level(flesch_score)
     
-    # Structure analysis
-    structure = analyze_structure(text)
-    
     return {
         'statistics': {
-            'sentences': len(sentences),
+            'sentences': sentence_count,
             'words': word_count,
             'avg_sentence_length': round(avg_sentence_length, 1),
             'readability_score': round(flesch_score, 1),
@@ -76,16 +202,13 @@ def analyze_text(text):
         'structure': structure
     }
 
+_VOWEL_GROUPS = re.compile(r'[aeiouy]+')
+
+@lru_cache(maxsize=65536)
 def count_syllables(word):
-    """Approximate syllable count."""
+    """Approximate syllable count: one per vowel group, minus a silent final 'e'."""
     word = word.lower()
-    count = 0
-    vowels = 'aeiouy'
-    if word[0] in vowels:
-        count += 1
-    for index in range(1, len(word)):
-        if word[index] in vowels and word[index-1] not in vowels:
-            count += 1
+    count = len(_VOWEL_GROUPS.findall(word))
     if word.endswith('e'):
         count -= 1
     if count == 0:
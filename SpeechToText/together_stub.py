@@ -0,0 +1,108 @@
+"""Local stand-in for the Together.ai completions API.
+
+Run `python together_stub.py` and point the app at it with
+TOGETHER_API_URL=http://127.0.0.1:5098/v1/completions. Streaming requests
+get the canned tokens as server-sent events, one every `token_delay` seconds.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_TOKENS = ['1. ', 'Punto ', 'importante', '.\n', '2. ', 'Otro ', 'punto', '.']
+
+
+class TogetherStub(ThreadingHTTPServer):
+    """Threaded HTTP server that answers /v1/completions with canned text."""
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), tokens=None, token_delay=0.0, latency=0.0, error_rate=0.0):
+        super().__init__(address, _Handler)
+        self.tokens = list(tokens or DEFAULT_TOKENS)
+        self.token_delay = token_delay
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.disconnects = 0
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1/completions'
+
+    def record(self, prompt):
+        with self._lock:
+            self.requests += 1
+            self.prompts.append(prompt)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        self.server.record(body.get('prompt', ''))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if random.random() < self.server.error_rate:
+            return self._send_json(500, {'error': 'stub error'})
+        if body.get('stream'):
+            return self._stream()
+        return self._send_json(200, {'choices': [{'text': ''.join(self.server.tokens)}]})
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for token in self.server.tokens:
+                self._chunk(f"data: {json.dumps({'choices': [{'text': token}]})}\n\n")
+                if self.server.token_delay:
+                    time.sleep(self.server.token_delay)
+            self._chunk('data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            with self.server._lock:
+                self.server.disconnects += 1
+        self.close_connection = True
+
+    def _chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 5098)))
+    parser.add_argument('--token-delay', type=float, default=0.05)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = TogetherStub(('127.0.0.1', args.port), token_delay=args.token_delay,
+                          latency=args.latency, error_rate=args.error_rate)
+    print(f"Together.ai stub listening on {server.url}")
+    server.serve_forever()
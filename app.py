@@ -1,36 +1,227 @@
-from flask import Flask, render_template, request, send_file, jsonify
-import qrcode
-from io import BytesIO
+from flask import Flask, Response, request, send_file, jsonify, url_for
 import base64
-import requests
-from PIL import Image
+import click
+import math
+from PIL import UnidentifiedImageError
 import os
+import tempfile
 from dotenv import load_dotenv
+import assets
+import image_prep
+import jobqueue
+import qr_batch
+from qr_cache import QRCache, make_key
+from qr_render import MIME_TYPES, parse_options, render_qr
+from ratelimit import RateLimited, RateLimiter, client_address
+from removebg_cache import ResultCache, content_hash
+from removebg_client import CircuitOpenError, RemoveBgClient, RemoveBgError, UpstreamBusyError
+from startup import Lazy, load, on_warmup
+import telemetry
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
+# Request latency, sizes and upstream timings on /metrics, added up over all
+# workers through this file; set up first so every other hook is timed too
+telemetry.init_app(app, os.getenv('METRICS_DB_PATH', os.path.join(tempfile.gettempdir(), 'utility-metrics.db')))
+# Static files fingerprinted and precompressed by `flask build-assets`
+assets.init_app(app)
+# The hub page has no per-request content, so it is rendered once per worker
+index_page = assets.CachedPage('index.html')
 
 # Get API key from environment variable
 REMOVEBG_API_KEY = os.getenv('REMOVEBG_API_KEY')
+# Built on the first upload, so workers that never see one skip the HTTP stack
+removebg = Lazy(lambda: RemoveBgClient.from_env(REMOVEBG_API_KEY))
+
+# Background removal results are cached on disk and shared by all workers
+removebg_cache = ResultCache(
+    os.getenv('REMOVEBG_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'removebg-cache')),
+    max_bytes=int(os.getenv('REMOVEBG_CACHE_MAX_MB', 256)) * 1024 * 1024,
+    ttl=int(os.getenv('REMOVEBG_CACHE_TTL', 7 * 24 * 3600)),
+)
+
+# Uploads are oriented and downscaled before they go to remove.bg; with
+# REMOVEBG_FULL_RES=1 the returned mask is applied back to the original
+REMOVEBG_FULL_RES = os.getenv('REMOVEBG_FULL_RES') == '1'
+REMOVEBG_VARIANT = f'auto|edge={image_prep.MAX_EDGE}|full_res={int(REMOVEBG_FULL_RES)}'
+prep_stats = image_prep.PipelineStats()
+
+# Rendered QR codes are cached per worker, and optionally in a SQLite file
+# shared by all workers when QR_CACHE_PATH is set
+qr_cache = QRCache(
+    max_entries=int(os.getenv('QR_CACHE_SIZE', 512)),
+    disk_path=os.getenv('QR_CACHE_PATH'),
+    disk_max_entries=int(os.getenv('QR_CACHE_DISK_SIZE', 10000)),
+)
+
+# Endpoints that cost money or CPU are rate limited per client IP, and paid
+# remove.bg calls also overall; buckets are shared by all workers on the host
+rate_limiter = RateLimiter(os.getenv('RATE_LIMIT_DB_PATH', os.path.join(tempfile.gettempdir(), 'utility-ratelimit.db')))
+rate_limiter.configure('remove-background', os.getenv('RATE_LIMIT_REMOVEBG', '10/minute'))
+rate_limiter.configure('qr-batch', os.getenv('RATE_LIMIT_QR_BATCH', '6/minute'))
+rate_limiter.configure('removebg', os.getenv('REMOVEBG_QUOTA', ''), upstream=True)
+# Endpoint -> (per-client scope, upstream it spends)
+RATE_LIMITED = {
+    'remove_background': ('remove-background', 'removebg'),
+    'generate_qr_batch': ('qr-batch', None),
+}
+RATE_LIMIT_ADMIN_KEY = os.getenv('RATE_LIMIT_ADMIN_KEY')
+
+@telemetry.CACHE_LOOKUPS.source
+def cache_lookups():
+    return [
+        ({'cache': 'qr', 'result': 'hit'}, qr_cache.hits),
+        ({'cache': 'qr', 'result': 'disk_hit'}, qr_cache.disk_hits),
+        ({'cache': 'qr', 'result': 'miss'}, qr_cache.misses),
+        ({'cache': 'removebg', 'result': 'hit'}, removebg_cache.hits),
+        ({'cache': 'removebg', 'result': 'coalesced'}, removebg_cache.coalesced),
+        ({'cache': 'removebg', 'result': 'miss'}, removebg_cache.misses),
+    ]
+
+@app.before_request
+def rate_limit():
+    limited = RATE_LIMITED.get(request.endpoint)
+    if limited is None:
+        return None
+    # Runs before anything reads the body, so a rejected upload is never buffered
+    scope, upstream = limited
+    retry_after = rate_limiter.hit(scope, client_address(request))
+    if not retry_after and upstream:
+        retry_after = rate_limiter.peek(upstream)
+    if retry_after:
+        return _too_many_requests(retry_after)
+
+def _too_many_requests(retry_after):
+    response = jsonify({'error': 'Too many requests. Please try again shortly.', 'retry_after': math.ceil(retry_after)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+# Slow work can be queued with ?async=1 instead of holding a gunicorn worker;
+# the queue file is shared by every worker on the host
+jobs = jobqueue.JobQueue(os.getenv('JOB_DB_PATH', os.path.join(tempfile.gettempdir(), 'utility-jobs.db')))
+
+@app.before_request
+def start_job_workers():
+    # Started on the first request so each forked worker gets its own threads
+    jobs.start_embedded()
+
+@app.cli.command('jobs-worker')
+@click.option('--threads', default=2, show_default=True)
+def jobs_worker(threads):
+    """Run queued jobs in this process until interrupted."""
+    telemetry.metrics.start()
+    jobqueue.Worker(jobs, threads=threads).run_forever()
+
+def _wants_async():
+    return request.args.get('async') == '1'
+
+def _job_accepted(job_id):
+    response = jsonify(_job_json(jobs.get(job_id)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id=job_id)
+    return response
+
+def _job_json(job):
+    data = {key: job[key] for key in ('id', 'type', 'status', 'attempts', 'progress', 'result', 'error')}
+    data['status_url'] = url_for('job_status', job_id=job['id'])
+    if job['has_output']:
+        data['output_url'] = url_for('job_output', job_id=job['id'])
+    return data
+
+@on_warmup
+def load_imaging():
+    # Under preload_app the master loads these once for every worker to share
+    load(image_prep.Image, image_prep.ImageOps)
+    image_prep.Image.init()
+    render_qr('warmup', parse_options({}))
+    if REMOVEBG_API_KEY:
+        removebg.get()
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return index_page.response()
 
-@app.route('/generate-qr', methods=['POST'])
+@app.route('/generate-qr', methods=['GET', 'POST'])
 def generate_qr():
-    data = request.json.get('data')
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(data)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return jsonify({'qr_code': f'data:image/png;base64,{img_str}'})
+    payload = request.args if request.method != 'POST' else (request.get_json(silent=True) or {})
+    data = payload.get('data')
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+
+    try:
+        options = parse_options(payload)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    # GET is meant for <img src> and CDNs, so it returns the image itself; POST
+    # keeps the JSON data URI the front end uses unless raw bytes are asked for
+    mime_type = MIME_TYPES[options['format']]
+    output = payload.get('output')
+    if output not in ('json', 'raw'):
+        if request.method != 'POST':
+            output = 'raw'
+        else:
+            output = 'raw' if request.accept_mimetypes.best_match(['application/json', mime_type]) == mime_type else 'json'
+
+    key = make_key(data, options)
+    etag = key if output == 'raw' else f'{key}-json'
+    # 304 is only defined for GET and HEAD; POST just renders again
+    if request.method != 'POST' and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        try:
+            image = qr_cache.get_or_render(key, lambda: render_qr(data, options))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if output == 'raw':
+            response = Response(image, mimetype=mime_type)
+        else:
+            img_str = base64.b64encode(image).decode()
+            response = jsonify({'qr_code': f'data:{mime_type};base64,{img_str}'})
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.vary.add('Accept')
+    return response
+
+@app.route('/generate-qr/batch', methods=['POST'])
+def generate_qr_batch():
+    try:
+        items = qr_batch.parse_items(request)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    ndjson = request.args.get('output') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+    if _wants_async():
+        return _job_accepted(jobs.enqueue('qr-batch', {'items': items, 'ndjson': ndjson}))
+
+    results = qr_batch.render_batch(items, cache=qr_cache)
+    if ndjson:
+        return Response(qr_batch.stream_ndjson(results), mimetype='application/x-ndjson')
+
+    return Response(
+        qr_batch.stream_zip(results),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=qr-codes.zip'},
+    )
+
+@jobs.register('qr-batch', priority=-1, concurrency=int(os.getenv('JOB_QR_BATCH_CONCURRENCY', 1)))
+def qr_batch_job(job):
+    results = qr_batch.render_batch(job.payload['items'], cache=qr_cache)
+    stream = qr_batch.stream_ndjson(results) if job.payload['ndjson'] else qr_batch.stream_zip(results)
+    with open(job.output_path, 'wb') as output:
+        for piece in stream:
+            output.write(piece.encode('utf-8') if isinstance(piece, str) else piece)
+    if job.payload['ndjson']:
+        return {'mimetype': 'application/x-ndjson', 'filename': 'qr-codes.ndjson', 'count': len(job.payload['items'])}
+    return {'mimetype': 'application/zip', 'filename': 'qr-codes.zip', 'count': len(job.payload['items'])}
+
+@app.route('/qr-cache/stats')
+def qr_cache_stats():
+    return jsonify(qr_cache.stats())
 
 @app.route('/generate-whatsapp-link', methods=['POST'])
 def generate_whatsapp_link():
@@ -57,30 +248,99 @@ def remove_background():
         return jsonify({'error': 'No image uploaded'}), 400
     
     file = request.files['image']
+    if _wants_async():
+        return _job_accepted(jobs.enqueue('remove-background', data=file.stream))
     
     try:
-        # Read the file into memory
-        img_data = file.read()
-        
-        # Call remove.bg API
-        response = requests.post(
-            'https://api.remove.bg/v1.0/removebg',
-            files={'image_file': img_data},
-            data={'size': 'auto'},
-            headers={'X-Api-Key': REMOVEBG_API_KEY},
-        )
-        
-        if response.status_code != 200:
-            return jsonify({'error': 'Error processing image with remove.bg API'}), 500
-            
+        processed = _remove_background_cached(image_prep.spool(file.stream))
+
         # Convert the response content to base64
-        img_str = base64.b64encode(response.content).decode()
+        img_str = base64.b64encode(processed).decode()
         return jsonify({'processed_image': f'data:image/png;base64,{img_str}'})
+
+    except RateLimited as e:
+        return _too_many_requests(e.retry_after)
+
+    except RemoveBgError as e:
+        app.logger.error(f"remove.bg error: {str(e)}")
+        if isinstance(e, (UpstreamBusyError, CircuitOpenError)):
+            response = jsonify({'error': 'Background removal is busy. Please try again shortly.'})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        return jsonify({'error': 'Error processing image with remove.bg API'}), 500
+
+    except UnidentifiedImageError:
+        return jsonify({'error': 'Unsupported image format'}), 400
         
     except Exception as e:
-        print(f"Error processing image: {str(e)}")
+        app.logger.exception(f"Error processing image: {str(e)}")
         return jsonify({'error': 'Error processing image. Please try again.'}), 500
 
+def _remove_background_cached(upload):
+    key = content_hash(upload, REMOVEBG_VARIANT)
+    return removebg_cache.get_or_compute(key, lambda: _remove_background_upstream(upload))
+
+@jobs.register('remove-background', concurrency=int(os.getenv('JOB_REMOVEBG_CONCURRENCY', 2)), max_attempts=4)
+def remove_background_job(job):
+    if not REMOVEBG_API_KEY:
+        raise jobqueue.JobFailed('API key not configured')
+    try:
+        with open(job.input_path, 'rb') as upload:
+            processed = _remove_background_cached(upload)
+    except UnidentifiedImageError:
+        raise jobqueue.JobFailed('Unsupported image format')
+    except RemoveBgError as e:
+        # Rejected uploads will be rejected again; 429s and 5xx are retried
+        if e.status_code and e.status_code < 500 and e.status_code != 429:
+            raise jobqueue.JobFailed(str(e))
+        raise
+    img_str = base64.b64encode(processed).decode()
+    return {'processed_image': f'data:image/png;base64,{img_str}'}
+
+def _remove_background_upstream(upload):
+    prepared, prep_seconds = image_prep.timed(image_prep.prepare, upload)
+    # Only calls that reach remove.bg spend its quota: not cache hits, and not
+    # uploads that prepare() could not read
+    rate_limiter.check('removebg')
+    cutout, upstream_seconds = image_prep.timed(removebg.get().remove_background, prepared.data)
+    prep_stats.record(prepared.original_bytes, len(prepared.data), prep_seconds, upstream_seconds)
+    if REMOVEBG_FULL_RES and prepared.downscaled:
+        cutout = image_prep.composite_alpha(upload, cutout)
+    return cutout
+
+@app.route('/remove-background/stats')
+def remove_background_stats():
+    stats = {'cache': removebg_cache.stats(), 'preprocess': prep_stats.stats()}
+    if removebg.loaded:
+        stats['upstream'] = removebg.get().stats()
+    return jsonify(stats)
+
+@app.route('/rate-limits/stats')
+def rate_limit_stats():
+    """Quota used per scope, and the caller's own; all clients with ?key=RATE_LIMIT_ADMIN_KEY."""
+    days = request.args.get('days', 1, type=int)
+    admin = RATE_LIMIT_ADMIN_KEY and request.args.get('key') == RATE_LIMIT_ADMIN_KEY
+    return jsonify(rate_limiter.usage(days=days, client=None if admin else client_address(request)))
+
+@app.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    if request.method == 'DELETE':
+        if jobs.cancel(job_id) is None:
+            return jsonify({'error': 'Job not found'}), 404
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(_job_json(job))
+
+@app.route('/jobs/<job_id>/output')
+def job_output(job_id):
+    job = jobs.get(job_id)
+    if job is None or not job['has_output']:
+        return jsonify({'error': 'No output for this job'}), 404
+    return send_file(jobs.output_path(job_id), mimetype=job['result']['mimetype'],
+                     as_attachment=True, download_name=job['result']['filename'])
+
 if __name__ == '__main__':
     if not REMOVEBG_API_KEY:
         print("Warning: REMOVEBG_API_KEY environment variable not set. Background removal will not work.")
@@ -0,0 +1,169 @@
+"""Fingerprinted, precompressed static files and pages rendered once per process.
+
+`flask build-assets` copies every file in static/ to static/dist/ under a
+name carrying a hash of its content (script.js -> script.3f9a1c2b7d4e.js),
+next to .gz and, when the optional brotli package is installed, .br
+copies, and records the names in static/dist/manifest.json. Once the
+manifest exists, url_for('static', filename='script.js') points at the
+hashed copy, which is served with the best encoding the client accepts and
+cached for a year: a changed file gets a new name. Files that changed
+since the build are served as they are, uncached, until the next build.
+
+CachedPage renders a template on first use and keeps the bytes, and their
+gzipped copy, for the life of the worker. The SpeechToText app uses this
+same module through a symlink.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = 'dist'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Smaller files aren't worth compressing
+MIN_COMPRESS_BYTES = 256
+
+
+def _hashed_name(static_folder, filename):
+    stem, extension = os.path.splitext(filename)
+    with open(os.path.join(static_folder, filename), 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    return f'{DIST}/{stem}.{digest}{extension}'
+
+
+def build(static_folder):
+    """Write the hashed and compressed copies of static_folder's files; returns the manifest."""
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    os.makedirs(dist)
+    manifest = {}
+    for directory, subdirectories, files in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(static_folder):
+            subdirectories[:] = [name for name in subdirectories if name != DIST]
+        for name in files:
+            source = os.path.join(directory, name)
+            filename = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            hashed = _hashed_name(static_folder, filename)
+            target = os.path.join(static_folder, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            with open(source, 'rb') as f:
+                data = f.read()
+            if len(data) >= MIN_COMPRESS_BYTES and _compressible(filename):
+                # mtime=0 keeps the output identical between builds
+                with open(f'{target}.gz', 'wb') as f:
+                    f.write(gzip.compress(data, 9, mtime=0))
+                if brotli is not None:
+                    with open(f'{target}.br', 'wb') as f:
+                        f.write(brotli.compress(data, quality=11))
+            manifest[filename] = hashed
+    with open(os.path.join(dist, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def _compressible(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or ''
+    return mimetype.startswith('text/') or mimetype in ('application/javascript', 'application/json', 'image/svg+xml')
+
+
+def load_manifest(static_folder):
+    """The built manifest, without entries whose source file changed since the build."""
+    try:
+        with open(os.path.join(static_folder, DIST, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    current = {}
+    for filename, hashed in manifest.items():
+        if os.path.exists(os.path.join(static_folder, filename)) and _hashed_name(static_folder, filename) == hashed:
+            current[filename] = hashed
+    return current
+
+
+def _encoding(request, path):
+    """The precompressed variant of `path` to send: ('br' or 'gzip' or None, file suffix)."""
+    accepted = request.accept_encodings
+    if accepted['br'] and os.path.exists(f'{path}.br'):
+        return 'br', '.br'
+    if accepted['gzip'] and os.path.exists(f'{path}.gz'):
+        return 'gzip', '.gz'
+    return None, ''
+
+
+def init_app(app):
+    """Serve the built assets of `app.static_folder` and add `flask build-assets`."""
+    from flask import request, send_from_directory
+
+    manifest = load_manifest(app.static_folder)
+    hashed_files = set(manifest.values())
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def static(filename):
+        if filename not in hashed_files:
+            return app.send_static_file(filename)
+        encoding, suffix = _encoding(request, os.path.join(app.static_folder, filename))
+        response = send_from_directory(
+            app.static_folder, filename + suffix,
+            mimetype=mimetypes.guess_type(filename)[0], max_age=31536000,
+        )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static
+
+    @app.cli.command('build-assets')
+    def build_assets():
+        """Fingerprint and precompress the static files."""
+        built = build(app.static_folder)
+        print(f"Built {len(built)} assets into {os.path.join(app.static_folder, DIST)}")
+
+
+class CachedPage:
+    """A template rendered once per worker, served with an ETag and gzipped when accepted."""
+
+    def __init__(self, template, cache_control='public, max-age=300'):
+        self.template = template
+        self.cache_control = cache_control
+        self._page = None
+        self._lock = threading.Lock()
+
+    def _render(self):
+        from flask import render_template
+
+        if self._page is None:
+            with self._lock:
+                if self._page is None:
+                    html = render_template(self.template).encode('utf-8')
+                    self._page = (html, gzip.compress(html, 9, mtime=0), hashlib.sha256(html).hexdigest()[:16])
+        return self._page
+
+    def response(self):
+        from flask import Response, request
+
+        html, compressed, etag = self._render()
+        if request.accept_encodings['gzip']:
+            response = Response(compressed, mimetype='text/html')
+            response.headers['Content-Encoding'] = 'gzip'
+            response.set_etag(f'{etag}-gzip')
+        else:
+            response = Response(html, mimetype='text/html')
+            response.set_etag(etag)
+        response.headers['Cache-Control'] = self.cache_control
+        response.vary.add('Accept-Encoding')
+        return response.make_conditional(request)
@@ -0,0 +1,131 @@
+"""Size and latency of compressed transcript storage.
+
+Generates dictation-like transcripts (a Zipf-distributed vocabulary of
+common words and pseudo-words, sentence and paragraph breaks, lengths from
+a few hundred characters to tens of KB), trains a dictionary on one
+sample and measures another. Each storage format gets its own SQLite
+table; file sizes are taken after VACUUM.
+
+    python benchmarks/bench_compression.py [--count 5000] [--runs 2000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SpeechToText'))
+
+import compression
+
+COMMON = (
+    "the we to and a of in is that it for on are with this be as have not so i you they "
+    "need think about going just like really because then maybe okay right yes know mean"
+).split()
+
+
+def make_vocabulary(size, rng):
+    syllables = [c + v for c in 'bcdfghklmnprstvz' for v in 'aeiou']
+    return [''.join(rng.choice(syllables) for _ in range(rng.randint(1, 4))) for _ in range(size)]
+
+
+def make_transcripts(count, seed):
+    rng = random.Random(seed)
+    vocabulary = COMMON + make_vocabulary(8000, random.Random(0))
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    transcripts = []
+    for _ in range(count):
+        size = int(min(max(rng.lognormvariate(7.5, 1.0), 200), 40000))
+        words = rng.choices(vocabulary, weights, k=size // 6)
+        sentences = [' '.join(words[i:i + rng.randint(6, 20)]).capitalize() + '.' for i in range(0, len(words), 14)]
+        paragraphs = [' '.join(sentences[i:i + 5]) for i in range(0, len(sentences), 5)]
+        transcripts.append('\n'.join(paragraphs))
+    return transcripts
+
+
+def store(path, rows, column_type):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE transcript (id INTEGER PRIMARY KEY, content {column_type})")
+    conn.executemany("INSERT INTO transcript (content) VALUES (?)", [(row,) for row in rows])
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(path)
+
+
+def read_latency(path, decode, count, runs, rng):
+    conn = sqlite3.connect(path)
+    timings = []
+    for _ in range(runs):
+        id = rng.randint(1, count)
+        start = time.perf_counter()
+        decode(conn.execute("SELECT content FROM transcript WHERE id = ?", (id,)).fetchone()[0])
+        timings.append(time.perf_counter() - start)
+    conn.close()
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def write_latency(path, encode, transcripts, runs, rng):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    timings = []
+    for _ in range(runs):
+        text = rng.choice(transcripts)
+        start = time.perf_counter()
+        conn.execute("INSERT INTO transcript (content) VALUES (?)", (encode(text),))
+        conn.commit()
+        timings.append(time.perf_counter() - start)
+    conn.close()
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--runs', type=int, default=2000)
+    args = parser.parse_args()
+
+    training = make_transcripts(compression.TRAIN_SAMPLE, seed=1)
+    transcripts = make_transcripts(args.count, seed=2)
+    raw_bytes = sum(len(text.encode('utf-8')) for text in transcripts)
+    print(f"{args.count} transcripts, {raw_bytes / 1024 / 1024:.1f} MiB of text")
+
+    plain = compression.Codec()
+    with_dictionary = compression.Codec()
+    start = time.perf_counter()
+    with_dictionary.dictionaries[1] = compression.train_dictionary(training)
+    with_dictionary.current_id = 1
+    print(f"dictionary trained on {len(training)} transcripts in {time.perf_counter() - start:.1f}s")
+
+    formats = {
+        'text': (lambda text: text, lambda value: value, 'TEXT'),
+        'deflate': (plain.compress, plain.decompress, 'BLOB'),
+        'deflate+dict': (with_dictionary.compress, with_dictionary.decompress, 'BLOB'),
+    }
+    # Short transcripts are where a dictionary matters most
+    short = [text for text in transcripts if len(text) < 2000]
+
+    print(f"{'format':<13} {'db MiB':>7} {'ratio':>6} {'short ratio':>12} {'read p50 us':>12} {'write p50 us':>13}")
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = None
+        short_baseline = sum(len(text.encode('utf-8')) for text in short)
+        for name, (encode, decode, column_type) in formats.items():
+            path = os.path.join(directory, f'{name}.db')
+            size = store(path, [encode(text) for text in transcripts], column_type)
+            baseline = baseline or size
+            short_size = sum(len(encode(text)) if column_type == 'BLOB' else len(text.encode('utf-8')) for text in short)
+            read = read_latency(path, decode, args.count, args.runs, random.Random(3))
+            write = write_latency(path, encode, transcripts, args.runs, random.Random(4))
+            print(f"{name:<13} {size / 1024 / 1024:>7.1f} {baseline / size:>6.2f} {short_baseline / short_size:>12.2f} "
+                  f"{read * 1e6:>12.0f} {write * 1e6:>13.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Compare sending uploads to remove.bg as-is against the pre-processing pipeline.
+
+Runs against the local remove.bg stub, so only our side of the cost is
+measured: bytes sent upstream, wall time and peak resident memory. Each
+case runs in a fresh interpreter, so its peak RSS (VmHWM, or ru_maxrss
+off Linux) covers Pillow's decode and resize buffers, which live outside
+the Python heap; "added" is the peak less the RSS after imports and
+reading the photo.
+
+    python benchmarks/bench_image_prep.py [--megapixels 12] [--runs 5]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image
+
+import image_prep
+from removebg_client import RemoveBgClient
+from removebg_stub import RemoveBgStub
+
+
+def make_photo(megapixels):
+    """Noisy gradient JPEG, roughly as hard to compress as a phone photo."""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    img = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    buffered = BytesIO()
+    img.save(buffered, format='JPEG', quality=92)
+    return buffered.getvalue()
+
+
+def peak_rss_kib():
+    # VmHWM starts afresh at exec; ru_maxrss would carry over the parent's
+    # peak, which holds the generated photo
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # KiB on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(case, photo_path, stub_url, runs):
+    """Run in the child interpreter: time `case` and report its peak RSS as JSON."""
+    with open(photo_path, 'rb') as f:
+        photo = f.read()
+    client = RemoveBgClient('bench', url=stub_url)
+
+    def raw():
+        data = BytesIO(photo).read()
+        client.remove_background(data)
+        return len(data)
+
+    def prepared():
+        prepared = image_prep.prepare(image_prep.spool(BytesIO(photo)))
+        client.remove_background(prepared.data)
+        return len(prepared.data)
+
+    func = {'as-is': raw, 'prepared': prepared}[case]
+    baseline = peak_rss_kib()
+    timings = []
+    sent = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        sent = func()
+        timings.append(time.perf_counter() - start)
+    peak = peak_rss_kib()
+    print(json.dumps({'sent': sent, 'timings': timings, 'peak_kib': peak, 'added_kib': peak - baseline}))
+
+
+def measure(case, photo_path, stub_url, runs):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--case', case, '--photo', photo_path,
+         '--stub-url', stub_url, '--runs', str(runs)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    timings = sorted(result['timings'])
+    print(f"{case:<12} sent={result['sent'] / 1024:>9.1f} KiB  p50={timings[len(timings) // 2] * 1000:>8.1f} ms  "
+          f"peak_rss={result['peak_kib'] / 1024:>7.1f} MiB  added={result['added_kib'] / 1024:>7.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megapixels', type=float, default=12)
+    parser.add_argument('--runs', type=int, default=5)
+    # Used for the per-case child processes
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--photo', help=argparse.SUPPRESS)
+    parser.add_argument('--stub-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(args.case, args.photo, args.stub_url, args.runs)
+        return
+
+    photo = make_photo(args.megapixels)
+    print(f"Input: {len(photo) / 1024:.1f} KiB JPEG, {args.megapixels} MP")
+
+    stub = RemoveBgStub().start()
+    with tempfile.NamedTemporaryFile(suffix='.jpg') as f:
+        f.write(photo)
+        f.flush()
+        for case in ('as-is', 'prepared'):
+            measure(case, f.name, stub.url, args.runs)
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
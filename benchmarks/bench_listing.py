@@ -0,0 +1,123 @@
+"""Latency and memory of listing one user's transcripts.
+
+Fills a throwaway database with `--count` transcripts for a single user and
+compares the old index() query (every row, full content, no composite
+index) with the keyset-paginated, column-projected listing: the first page,
+and a page reached by walking `--depth` pages in.
+
+    python benchmarks/bench_listing.py [--count 50000] [--content-chars 2000] [--runs 5]
+"""
+import argparse
+import atexit
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SpeechToText'))
+
+directory = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, directory, True)
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+os.environ.setdefault('TOGETHER_API_KEY', 'benchmark')
+
+from sqlalchemy import insert, text as sql
+from sqlalchemy.orm import undefer
+
+import app as transcripts_app
+from app import Transcript, User, db, _transcript_page
+from compression import codec
+from migrations import PREVIEW_CHARS
+
+WORDS = "we need to improve the document signing workflow because users get confused".split()
+
+
+def populate(count, content_chars, seed=0):
+    rng = random.Random(seed)
+    user = User(username='bench', password_hash='-')
+    db.session.add(user)
+    db.session.commit()
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        content = ' '.join(rng.choice(WORDS) for _ in range(content_chars // 6))[:content_chars]
+        rows.append({
+            'title': f'Transcript {i}', 'content_z': codec.compress(content), 'preview': content[:PREVIEW_CHARS],
+            'length': len(content), 'created_at': start + timedelta(seconds=i), 'user_id': user.id
+        })
+        if len(rows) == 5000:
+            db.session.execute(insert(Transcript), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(Transcript), rows)
+    db.session.commit()
+    return user.id
+
+
+def old_listing(user_id):
+    transcripts = Transcript.query.filter_by(user_id=user_id).options(undefer(Transcript.content_z)) \
+        .order_by(Transcript.created_at.desc()).all()
+    # The old listing held every transcript's text
+    return [transcript.content for transcript in transcripts]
+
+
+def deep_page(user_id, depth):
+    cursor = None
+    for _ in range(depth):
+        _, cursor = _transcript_page(user_id, cursor=cursor)
+    # Only the last hop is the request being measured; earlier ones set up its cursor
+    start = time.perf_counter()
+    _transcript_page(user_id, cursor=cursor)
+    return time.perf_counter() - start
+
+
+def measure(func, runs):
+    timings = []
+    for _ in range(runs):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    db.session.expunge_all()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings.sort()
+    return timings[len(timings) // 2], peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=50000)
+    parser.add_argument('--content-chars', type=int, default=2000)
+    parser.add_argument('--depth', type=int, default=100)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    transcripts_app.migrate()
+    with transcripts_app.app.app_context():
+        user_id = populate(args.count, args.content_chars)
+        print(f"{args.count} transcripts of {args.content_chars} chars for one user")
+        print(f"{'variant':<28} {'p50 ms':>9} {'peak MiB':>9}")
+
+        db.session.execute(sql("DROP INDEX ix_transcript_user_created"))
+        p50, peak = measure(lambda: old_listing(user_id), args.runs)
+        print(f"{'before: .all() with content':<28} {p50 * 1000:>9.1f} {peak / 1024 / 1024:>9.2f}")
+
+        db.session.execute(sql(
+            "CREATE INDEX ix_transcript_user_created ON transcript (user_id, created_at, id)"
+        ))
+        p50, peak = measure(lambda: _transcript_page(user_id), args.runs)
+        print(f"{'after: first page':<28} {p50 * 1000:>9.1f} {peak / 1024 / 1024:>9.2f}")
+
+        timings = sorted(deep_page(user_id, args.depth) for _ in range(args.runs))
+        print(f"{f'after: page {args.depth + 1}':<28} {timings[len(timings) // 2] * 1000:>9.1f} {'':>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Query latency of transcript search on a synthetic corpus.
+
+Builds a throwaway SQLite database with `--count` transcripts spread over
+`--users` users, then times /search-style queries (common, rare, multi-term
+and prefix) against the FTS5 backend and the in-process fallback index.
+
+    python benchmarks/bench_search.py [--count 100000] [--users 100] [--runs 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SpeechToText'))
+
+from sqlalchemy import create_engine, text as sql
+
+from search import TranscriptSearch, install
+
+SCHEMA = """
+    CREATE TABLE transcript (
+        id INTEGER PRIMARY KEY,
+        title VARCHAR(200) NOT NULL,
+        content TEXT NOT NULL,
+        created_at DATETIME NOT NULL,
+        user_id INTEGER NOT NULL
+    )
+"""
+
+QUERIES = ['budget', 'signature mobile', 'w1234', 'upload fail', 'contrac', 'review budget w42']
+
+COMMON = (
+    "the we to and a of in is that it for on are with this be as have not meeting team "
+    "budget review upload signature mobile document contract workflow email fail delay"
+).split()
+
+
+def make_vocabulary(size):
+    """`size` synthetic words and Zipf-like weights for drawing them."""
+    rare = [f'w{i}' for i in range(size)]
+    weights = [1 / (rank + 1) for rank in range(size)]
+    return rare, weights
+
+
+def make_corpus(engine, count, users, seed=0):
+    rng = random.Random(seed)
+    rare, weights = make_vocabulary(20000)
+    batch = []
+    with engine.begin() as conn:
+        conn.execute(sql(SCHEMA))
+        for id in range(1, count + 1):
+            words = [rng.choice(COMMON) for _ in range(rng.randint(60, 200))]
+            words += rng.choices(rare, weights, k=len(words) // 4)
+            rng.shuffle(words)
+            content = '. '.join(' '.join(words[i:i + 12]).capitalize() for i in range(0, len(words), 12)) + '.'
+            title = ' '.join(rng.choice(COMMON + rare[:200]) for _ in range(3)).title()
+            batch.append({'id': id, 'title': title, 'content': content,
+                          'created_at': f'2024-01-01 00:00:{id % 60:02d}', 'user_id': id % users})
+            if len(batch) == 5000:
+                conn.execute(sql("INSERT INTO transcript VALUES (:id, :title, :content, :created_at, :user_id)"), batch)
+                batch = []
+        if batch:
+            conn.execute(sql("INSERT INTO transcript VALUES (:id, :title, :content, :created_at, :user_id)"), batch)
+
+
+def measure(search, users, runs):
+    """Sorted per-query latencies in seconds over every query, two pages deep."""
+    timings = []
+    for run in range(runs):
+        user_id = run % users
+        for query in QUERIES:
+            start = time.perf_counter()
+            page = search.search(user_id, query)
+            if page['next_cursor']:
+                search.search(user_id, query, cursor=page['next_cursor'])
+            timings.append((time.perf_counter() - start) / (2 if page['next_cursor'] else 1))
+    return sorted(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        start = time.perf_counter()
+        make_corpus(engine, args.count, args.users)
+        print(f"corpus: {args.count} transcripts, {args.users} users, built in {time.perf_counter() - start:.1f}s")
+
+        print(f"{'backend':<8} {'setup s':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+        for backend in ('fts5', 'local'):
+            start = time.perf_counter()
+            install(engine)
+            search = TranscriptSearch(engine, backend)
+            if backend == 'local':
+                # Build every user's index up front so queries are measured warm
+                for user_id in range(args.users):
+                    search.local.get(user_id)
+            setup = time.perf_counter() - start
+            timings = measure(search, args.users, args.runs)
+            p50 = timings[len(timings) // 2]
+            p95 = timings[int(len(timings) * 0.95)]
+            print(f"{search.backend:<8} {setup:>8.1f} {p50 * 1000:>8.2f} {p95 * 1000:>8.2f} {timings[-1] * 1000:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
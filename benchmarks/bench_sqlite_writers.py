@@ -0,0 +1,129 @@
+"""Transcript save throughput with several worker processes writing at once.
+
+Each mode gets a fresh database with the app's schema (indexes and FTS
+triggers included), then `--workers` processes with `--threads` threads
+each insert transcripts for `--seconds`:
+
+  default   SQLAlchemy/pysqlite defaults, rollback journal, commit per save
+  tuned     WAL, synchronous=NORMAL, busy timeout and pool from database.py
+  grouped   tuned, with saves funnelled through database.CommitGroup
+
+    python benchmarks/bench_sqlite_writers.py [--workers 4] [--threads 4] [--seconds 5]
+"""
+import argparse
+import atexit
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SpeechToText'))
+
+scratch = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, scratch, True)
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(scratch, 'app.db')}"
+os.environ.setdefault('TOGETHER_API_KEY', 'benchmark')
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import compression
+import database
+import migrations
+import search
+from app import Transcript, User, db
+
+CONTENT = "We need to improve the document signing workflow. " * 40
+MODES = ('default', 'tuned', 'grouped')
+
+
+def make_engine(path, mode):
+    url = f'sqlite:///{path}'
+    if mode == 'default':
+        engine = create_engine(url)
+    else:
+        engine = create_engine(url, **database.engine_options(url))
+        database.install_pragmas(engine)
+    # The search triggers call transcript_text()
+    compression.install(engine)
+    return engine
+
+
+def prepare(path, mode):
+    engine = make_engine(path, mode)
+    db.metadata.create_all(engine)
+    migrations.upgrade(engine)
+    search.install(engine)
+    with Session(engine) as session:
+        session.add(User(username='bench', password_hash='-'))
+        session.commit()
+    engine.dispose()
+
+
+def writer(path, mode, threads, seconds, results):
+    engine = make_engine(path, mode)
+    group = database.CommitGroup(engine) if mode == 'grouped' else None
+    counts = {'saved': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def run():
+        saved = errors = 0
+        while time.monotonic() < deadline:
+            transcript = Transcript(title='Benchmark', content=CONTENT, user_id=1)
+            try:
+                if group:
+                    group.add(transcript)
+                else:
+                    with Session(engine) as session:
+                        session.add(transcript)
+                        session.commit()
+                saved += 1
+            except Exception:
+                errors += 1
+        with lock:
+            counts['saved'] += saved
+            counts['errors'] += errors
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('fork')
+    print(f"{args.workers} workers x {args.threads} threads, {args.seconds:g}s per mode")
+    print(f"{'mode':<8} {'saves/s':>9} {'errors':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in MODES:
+            path = os.path.join(directory, f'{mode}.db')
+            prepare(path, mode)
+            results = context.Queue()
+            processes = [
+                context.Process(target=writer, args=(path, mode, args.threads, args.seconds, results))
+                for _ in range(args.workers)
+            ]
+            for process in processes:
+                process.start()
+            totals = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+            saved = sum(total['saved'] for total in totals)
+            errors = sum(total['errors'] for total in totals)
+            print(f"{mode:<8} {saved / args.seconds:>9.0f} {errors:>7}")
+
+
+if __name__ == '__main__':
+    main()
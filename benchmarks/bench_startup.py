@@ -0,0 +1,161 @@
+"""Import time of both apps, and per-worker memory with and without preload_app.
+
+Import time is the median over fresh interpreters of `import app`, and of
+importing it and serving one request. Memory is read from
+/proc/<pid>/smaps_rollup for each gunicorn worker after the same warmup
+hooks have run either once in the master before forking (preload) or in
+every worker after it (no preload): PSS counts shared pages split between
+the processes sharing them, private is what each worker costs on its own.
+Linux only; databases go to a temporary directory.
+
+    python benchmarks/bench_startup.py [--workers 4] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+APPS = {
+    'utility': (ROOT, '/'),
+    'transcripts': (os.path.join(ROOT, 'SpeechToText'), '/login'),
+}
+
+IMPORT = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+app.app.test_client().get({path!r})
+print(imported, time.perf_counter() - start)
+"""
+
+# Without preload every worker imports the app itself and runs the warmup
+# hooks once it has started, as it would on its first requests
+PER_WORKER_CONF = """
+exec(open({conf!r}).read())
+preload_app = False
+
+def when_ready(server):
+    pass
+
+def post_worker_init(worker):
+    import startup
+    startup.warmup()
+"""
+
+
+def app_env(directory):
+    env = dict(os.environ)
+    env.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(directory, 'transcripts.db')}",
+        JOB_DB_PATH=os.path.join(directory, 'jobs.db'),
+        RATE_LIMIT_DB_PATH=os.path.join(directory, 'ratelimit.db'),
+        JOB_EMBEDDED_WORKERS='0',
+    )
+    return env
+
+
+def import_times(cwd, path, env, runs):
+    imported, served = [], []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', IMPORT.format(path=path)],
+            cwd=cwd, env=env, capture_output=True, text=True, check=True,
+        ).stdout.split()
+        imported.append(float(output[-2]))
+        served.append(float(output[-1]))
+    return statistics.median(imported), statistics.median(served)
+
+
+def smaps(pid):
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'private': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+def workers_memory(cwd, path, env, workers, preload, port):
+    conf = os.path.join(cwd, 'gunicorn.conf.py')
+    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as f:
+        f.write(PER_WORKER_CONF.format(conf=conf))
+        per_worker_conf = f.name
+    server = subprocess.Popen(
+        ['gunicorn', '-c', conf if preload else per_worker_conf,
+         '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app'],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.time() + 60
+        while True:
+            children = _children(server.pid)
+            if len(children) == workers:
+                try:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=5).read()
+                    break
+                except OSError:
+                    pass
+            if time.time() > deadline:
+                raise RuntimeError('gunicorn did not start')
+            time.sleep(0.2)
+        for _ in range(workers * 4):
+            urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=5).read()
+        # Let the post_worker_init warmups finish
+        time.sleep(2)
+        samples = [smaps(pid) for pid in _children(server.pid)]
+        return {key: statistics.mean(sample[key] for sample in samples) for key in samples[0]}
+    finally:
+        server.terminate()
+        server.wait()
+        os.unlink(per_worker_conf)
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=18731)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = app_env(directory)
+        subprocess.run(
+            [sys.executable, '-c', 'import app; app.migrate()'],
+            cwd=APPS['transcripts'][0], env=env, check=True, capture_output=True,
+        )
+
+        print(f"{'app':<12} {'import ms':>10} {'+ first request ms':>19}")
+        for name, (cwd, path) in APPS.items():
+            imported, served = import_times(cwd, path, env, args.runs)
+            print(f"{name:<12} {imported * 1000:>10.0f} {served * 1000:>19.0f}")
+
+        print(f"\nper worker, {args.workers} workers (MiB)")
+        print(f"{'app':<12} {'mode':<11} {'RSS':>8} {'PSS':>8} {'private':>8}")
+        for name, (cwd, path) in APPS.items():
+            for preload in (False, True):
+                memory = workers_memory(cwd, path, env, args.workers, preload, args.port)
+                mode = 'preload' if preload else 'per-worker'
+                print(f"{name:<12} {mode:<11} {memory['rss']:>8.1f} {memory['pss']:>8.1f} {memory['private']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Per-call latency and allocations of text_analysis.analyze_text.
+
+"warm" reuses the process-wide TextAnalyzer; "cold" builds a new one per
+call, which is what every call used to pay for. Needs the NLTK punkt,
+stopwords and vader_lexicon data.
+
+    python benchmarks/bench_text_analysis.py [--sizes 1K,100K,10M] [--runs 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SpeechToText'))
+
+import text_analysis
+
+WORDS = (
+    "we need to improve the document signing workflow because users get confused and the "
+    "current process takes too long great idea terrible delay upload mobile signature review"
+).split()
+
+
+def make_text(size, seed=0):
+    """Paragraphs of random sentences, roughly `size` characters long."""
+    rng = random.Random(seed)
+    parts = []
+    total = 0
+    while total < size:
+        if rng.random() < 0.1:
+            line = ' '.join(rng.choice(WORDS) for _ in range(3)).title()
+        else:
+            line = ' '.join(
+                ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))).capitalize() + rng.choice('.!?')
+                for _ in range(rng.randint(1, 4))
+            )
+        parts.append(line)
+        total += len(line) + 1
+    return '\n'.join(parts)[:size]
+
+
+def parse_size(value):
+    units = {'K': 1024, 'M': 1024 * 1024}
+    value = value.strip().upper()
+    return int(float(value[:-1]) * units[value[-1]]) if value[-1] in units else int(value)
+
+
+def measure(func, text, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(text)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(text)
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    timings.sort()
+    return timings[len(timings) // 2], peak, blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1K,100K,10M')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    text_analysis.get_analyzer()
+    variants = {
+        'warm': text_analysis.analyze_text,
+        'cold': lambda text: text_analysis.TextAnalyzer().analyze(text),
+    }
+    print(f"{'size':>6} {'variant':<6} {'p50 ms':>10} {'peak MiB':>9} {'live blocks':>12}")
+    for label in args.sizes.split(','):
+        text = make_text(parse_size(label))
+        # Large inputs are slow enough that a single run is representative
+        runs = 1 if len(text) > 1024 * 1024 else args.runs
+        for name, func in variants.items():
+            p50, peak, blocks = measure(func, text, runs)
+            print(f"{label:>6} {name:<6} {p50 * 1000:>10.1f} {peak / 1024 / 1024:>9.1f} {blocks:>12}")
+
+
+if __name__ == '__main__':
+    main()
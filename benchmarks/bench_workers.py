@@ -0,0 +1,130 @@
+"""Concurrent-request throughput of the utility app under each gunicorn worker class.
+
+Serves the app with its gunicorn.conf.py as sync, gthread and gevent (when
+installed) workers, with the same number of worker processes, against the
+local remove.bg stub answering after --latency seconds. --concurrency
+client threads then send /remove-background uploads (distinct photos, so
+the result cache never answers) and /generate-qr requests, the CPU-bound
+contrast. REMOVEBG_MAX_CONCURRENCY is raised so the per-worker upstream
+cap doesn't decide the result.
+
+    python benchmarks/bench_workers.py [--workers 2] [--concurrency 32] [--latency 0.2]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import requests
+from PIL import Image
+
+from removebg_stub import RemoveBgStub
+from suite import ROOT, app_environment, summarize
+
+WORKER_CLASSES = ['sync', 'gthread', 'gevent']
+
+
+def load(url, send, count, concurrency):
+    timings = []
+    errors = [0]
+    lock = threading.Lock()
+    next_index = iter(range(count))
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            begin = time.perf_counter()
+            try:
+                status = send(session, url, i).status_code
+            except requests.RequestException:
+                status = 599
+            took = time.perf_counter() - begin
+            with lock:
+                timings.append(took)
+                errors[0] += status >= 400
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(timings, time.perf_counter() - start, errors[0])
+
+
+def serve(worker_class, args, env):
+    env = dict(env, GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(args.workers),
+               PORT=str(args.port), REMOVEBG_MAX_CONCURRENCY='256')
+    server = subprocess.Popen(['gunicorn', '-c', 'gunicorn.conf.py', 'app:app'], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while True:
+        try:
+            requests.get(f'http://127.0.0.1:{args.port}/', timeout=1)
+            return server
+        except requests.RequestException:
+            if time.time() > deadline or server.poll() is not None:
+                server.terminate()
+                raise RuntimeError(f'gunicorn with {worker_class} workers did not start')
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=320)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--port', type=int, default=18741)
+    args = parser.parse_args()
+
+    photos = []
+    for i in range(args.requests * len(WORKER_CLASSES)):
+        buffered = BytesIO()
+        Image.new('RGB', (640, 480), (i % 256, i // 256 % 256, 64)).save(buffered, format='JPEG')
+        photos.append(buffered.getvalue())
+    offset = [0]
+
+    def remove_background(session, url, i):
+        photo = photos[offset[0] + i]
+        return session.post(f'{url}/remove-background', files={'image': ('photo.jpg', photo, 'image/jpeg')})
+
+    def generate_qr(session, url, i):
+        return session.get(f'{url}/generate-qr', params={'data': f'https://example.com/{offset[0] + i}'})
+
+    stub = RemoveBgStub(latency=args.latency).start()
+    print(f"{args.workers} workers, {args.concurrency} clients, remove.bg stub latency {args.latency * 1000:.0f} ms")
+    print(f"{'workers':<9} {'endpoint':<19} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8} {'errors':>7}")
+    for worker_class in WORKER_CLASSES:
+        if worker_class == 'gevent':
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print(f"{worker_class:<9} skipped: gevent is not installed")
+                continue
+        with tempfile.TemporaryDirectory() as directory:
+            server = serve(worker_class, args, dict(os.environ, **app_environment(directory, stub.url)))
+            try:
+                for name, send in (('/remove-background', remove_background), ('/generate-qr', generate_qr)):
+                    result = load(f'http://127.0.0.1:{args.port}', send, args.requests, args.concurrency)
+                    print(f"{worker_class:<9} {name:<19} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                          f"{result['throughput_rps']:>8.1f} {result['errors']:>7}")
+            finally:
+                server.terminate()
+                server.wait()
+        offset[0] += args.requests
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
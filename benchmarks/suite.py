@@ -0,0 +1,314 @@
+"""Micro-benchmarks and load tests for both apps, saved as JSON to compare commits.
+
+Micro-benchmarks time render_qr (what /generate-qr does on a cache miss),
+analyze_text, count_syllables and analyze_structure. Load tests drive
+/generate-qr, /remove-background, /save_transcript and /analyze_transcript
+in-process through Flask test clients, one thread per simulated client.
+remove.bg and Together.ai are replaced by the local stubs, with
+--latency and --error-rate. Databases, caches and job files go to a
+temporary directory and rate limits are off. Each app runs in its own
+interpreter, since both are imported as `app`.
+
+Every entry records p50/p99/mean latency in ms, throughput and errors
+(responses with status >= 400). Results go to benchmarks/results/<commit>.json
+unless --output is given, and --compare flags any regression over --threshold:
+
+    python benchmarks/suite.py [--quick] [--latency 0.05] [--error-rate 0.01]
+    python benchmarks/suite.py --compare before.json after.json [--threshold 0.1]
+
+analyze_text needs the NLTK punkt, stopwords and vader_lexicon data;
+without it that entry is skipped.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS, '..')
+SPEECH = os.path.join(ROOT, 'SpeechToText')
+
+
+def summarize(timings, elapsed, errors=0):
+    """Latency percentiles (ms) and throughput for `timings` in seconds, run over `elapsed` seconds."""
+    ordered = sorted(timings)
+    return {
+        'count': len(ordered),
+        'errors': errors,
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+        'throughput_rps': round(len(ordered) / elapsed, 1),
+    }
+
+
+def micro(func, samples, number=1):
+    """Time `samples` batches of `number` calls to func(i); latency is per call."""
+    timings = []
+    start = time.perf_counter()
+    i = 0
+    for _ in range(samples):
+        batch = time.perf_counter()
+        for _ in range(number):
+            func(i)
+            i += 1
+        timings.append((time.perf_counter() - batch) / number)
+    # summarize() counts samples, not calls
+    return summarize(timings, (time.perf_counter() - start) / number)
+
+
+def drive(make_client, call, count, concurrency):
+    """Send `count` requests from `concurrency` threads, each with its own client; call(client, i) sends one."""
+    timings = []
+    errors = [0]
+    lock = threading.Lock()
+    next_index = iter(range(count))
+
+    def worker(client):
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            begin = time.perf_counter()
+            response = call(client, i)
+            # Streamed bodies are part of the request's time
+            response.get_data()
+            took = time.perf_counter() - begin
+            response.close()
+            with lock:
+                timings.append(took)
+                if response.status_code >= 400:
+                    errors[0] += 1
+
+    clients = [make_client() for _ in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(timings, time.perf_counter() - start, errors[0])
+
+
+def app_environment(directory, upstream_url):
+    return {
+        'REMOVEBG_API_KEY': 'bench',
+        'REMOVEBG_API_URL': upstream_url,
+        'REMOVEBG_CACHE_DIR': os.path.join(directory, 'removebg-cache'),
+        'TOGETHER_API_KEY': 'bench',
+        'TOGETHER_API_URL': upstream_url,
+        'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'transcripts.db')}",
+        'JOB_DB_PATH': os.path.join(directory, 'jobs.db'),
+        'JOB_EMBEDDED_WORKERS': '0',
+        'METRICS_DB_PATH': os.path.join(directory, 'metrics.db'),
+        'RATE_LIMIT_DB_PATH': os.path.join(directory, 'ratelimit.db'),
+        'RATE_LIMIT_REMOVEBG': 'off',
+        'RATE_LIMIT_QR_BATCH': 'off',
+        'RATE_LIMIT_ANALYSIS': 'off',
+        'RATE_LIMIT_TRANSCRIPTION': 'off',
+        'TRANSCRIPT_COMPRESSION_BACKGROUND': '0',
+        'LOG_LEVEL': 'WARNING',
+    }
+
+
+def run_utility(args, directory):
+    sys.path.insert(0, ROOT)
+    from removebg_stub import RemoveBgStub
+
+    stub = RemoveBgStub(latency=args.latency, error_rate=args.error_rate).start()
+    os.environ.update(app_environment(directory, stub.url))
+    from PIL import Image
+
+    import app as utility
+    from qr_render import parse_options, render_qr
+
+    results = {}
+    options = parse_options({})
+    results['micro.generate_qr'] = micro(lambda i: render_qr(f'https://example.com/micro/{i}', options), args.samples)
+
+    # Distinct data per request, so every one renders instead of hitting the cache
+    results['load.generate_qr'] = drive(
+        utility.app.test_client,
+        lambda client, i: client.get(f'/generate-qr?data=https://example.com/load/{i}'),
+        args.requests, args.concurrency,
+    )
+
+    # Distinct photos too, or the result cache would answer all but the first
+    photos = []
+    for i in range(args.requests):
+        buffered = BytesIO()
+        Image.new('RGB', (640, 480), (i % 256, i // 256 % 256, 128)).save(buffered, format='JPEG')
+        photos.append(buffered.getvalue())
+    results['load.remove_background'] = drive(
+        utility.app.test_client,
+        lambda client, i: client.post('/remove-background', data={'image': (BytesIO(photos[i]), 'photo.jpg')}),
+        args.requests, args.concurrency,
+    )
+    stub.shutdown()
+    return results
+
+
+def run_transcripts(args, directory):
+    sys.path.insert(0, SPEECH)
+    from together_stub import TogetherStub
+
+    stub = TogetherStub(latency=args.latency, error_rate=args.error_rate).start()
+    os.environ.update(app_environment(directory, stub.url))
+    import app as transcripts
+    import text_analysis
+    from bench_text_analysis import make_text
+
+    transcripts.migrate()
+    results = {}
+    text = make_text(args.text_chars)
+    words = text.split()
+    results['micro.count_syllables'] = micro(lambda i: text_analysis.count_syllables(words[i % len(words)]), args.samples, 1000)
+    # Without the per-word cache, as for a word seen for the first time
+    results['micro.count_syllables_uncached'] = micro(
+        lambda i: text_analysis.count_syllables.__wrapped__(words[i % len(words)]), args.samples, 1000)
+    results['micro.analyze_structure'] = micro(lambda i: text_analysis.analyze_structure(text), args.samples)
+    try:
+        text_analysis.get_analyzer()
+    except LookupError as e:
+        results['micro.analyze_text'] = {'skipped': f'NLTK data missing: {str(e).splitlines()[0]}'}
+    else:
+        results['micro.analyze_text'] = micro(lambda i: text_analysis.analyze_text(text), args.samples)
+
+    transcripts.app.test_client().post('/register', data={'username': 'bench', 'password': 'bench'})
+
+    def logged_in():
+        client = transcripts.app.test_client()
+        client.post('/login', data={'username': 'bench', 'password': 'bench'})
+        return client
+
+    ids = []
+
+    def save(client, i):
+        response = client.post('/save_transcript', json={'title': f'Bench {i}', 'content': make_text(args.text_chars, seed=i)})
+        if response.status_code == 200:
+            ids.append(response.get_json()['id'])
+        return response
+
+    results['load.save_transcript'] = drive(logged_in, save, args.requests, args.concurrency)
+    # Each transcript once, so every request goes upstream rather than to stored results
+    results['load.analyze_transcript'] = drive(
+        logged_in,
+        lambda client, i: client.get(f'/analyze_transcript/{ids[i]}'),
+        len(ids), args.concurrency,
+    )
+    results['load.analyze_transcript']['upstream_requests'] = stub.requests
+    stub.shutdown()
+    return results
+
+
+WORKERS = {'utility': (ROOT, run_utility), 'transcripts': (SPEECH, run_transcripts)}
+
+
+def commit():
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return head.stdout.strip() + ('-dirty' if dirty.stdout.strip() else '')
+
+
+def run_suite(args):
+    config = {key: getattr(args, key) for key in ('requests', 'concurrency', 'samples', 'latency', 'error_rate', 'text_chars')}
+    report = {
+        'commit': commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': config,
+        'results': {},
+    }
+    for name, (cwd, _) in WORKERS.items():
+        command = [sys.executable, os.path.abspath(__file__), '--worker', name]
+        command += [f"--{key.replace('_', '-')}={value}" for key, value in config.items()]
+        process = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
+        if process.returncode != 0:
+            print(process.stderr, file=sys.stderr)
+            raise SystemExit(f'{name} benchmarks failed')
+        report['results'].update(
+            (f'{name}.{key}', value) for key, value in json.loads(process.stdout.splitlines()[-1]).items()
+        )
+
+    output = args.output or os.path.join(BENCHMARKS, 'results', f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print(f"{'benchmark':<44} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7}")
+    for name, result in report['results'].items():
+        if 'skipped' in result:
+            print(f"{name:<44} skipped: {result['skipped']}")
+        else:
+            print(f"{name:<44} {result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['throughput_rps']:>9.1f} {result['errors']:>7}")
+    print(f"\nSaved to {output}")
+
+
+def compare(before_path, after_path, threshold):
+    """Print the change per benchmark; returns the number of regressions over `threshold`."""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    if before['config'] != after['config']:
+        print(f"Warning: configs differ: {before['config']} vs {after['config']}")
+
+    regressions = 0
+    print(f"{before['commit']} -> {after['commit']}")
+    print(f"{'benchmark':<44} {'p50':>8} {'p99':>8} {'req/s':>8}")
+    for name in sorted(set(before['results']) & set(after['results'])):
+        old, new = before['results'][name], after['results'][name]
+        if 'skipped' in old or 'skipped' in new:
+            continue
+        changes = {key: (new[key] - old[key]) / old[key] if old[key] else 0.0
+                   for key in ('p50_ms', 'p99_ms', 'throughput_rps')}
+        worse = (changes['p50_ms'] > threshold or changes['p99_ms'] > threshold
+                 or changes['throughput_rps'] < -threshold or new['errors'] > old['errors'])
+        regressions += worse
+        print(f"{name:<44} {changes['p50_ms']:>+8.1%} {changes['p99_ms']:>+8.1%} "
+              f"{changes['throughput_rps']:>+8.1%}{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per load test')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--samples', type=int, default=200, help='samples per micro-benchmark')
+    parser.add_argument('--latency', type=float, default=0.05, help='stub upstream latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of stub upstream calls that fail')
+    parser.add_argument('--text-chars', type=int, default=5000, help='transcript size')
+    parser.add_argument('--quick', action='store_true', help='a smoke run: 20 requests, 20 samples')
+    parser.add_argument('--output')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--worker', choices=WORKERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        raise SystemExit(1 if compare(*args.compare, args.threshold) else 0)
+    if args.quick:
+        args.requests = args.samples = 20
+    if args.worker:
+        with tempfile.TemporaryDirectory() as directory:
+            results = WORKERS[args.worker][1](args, directory)
+        print(json.dumps(results))
+        return
+    run_suite(args)
+
+
+if __name__ == '__main__':
+    main()
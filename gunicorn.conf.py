@@ -1,3 +1,31 @@
-workers = 4
-bind = "0.0.0.0:10000"
-timeout = 120
+import os
+
+import startup
+
+# Worker class and counts come from the CPUs available and the environment;
+# see startup.worker_model()
+_model = startup.worker_model()
+worker_class = _model['worker_class']
+workers = _model['workers']
+threads = _model['threads']
+worker_connections = _model['worker_connections']
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then, staggered so they don't all restart together;
+# with preload each replacement is forked from the warmed-up master
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = max_requests // 10
+
+# Import the app once in the master and warm it up before forking, so the
+# workers share its memory; GUNICORN_PRELOAD=0 imports it in each worker.
+# Off by default for gevent, which must patch the standard library before
+# the app creates its locks and connections
+preload_app = os.getenv('GUNICORN_PRELOAD', '0' if worker_class == 'gevent' else '1') == '1'
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        server.log.info(f"Warmed up before fork: {startup.warmup()}")
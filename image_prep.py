@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from startup import lazy_import
+
+Image = lazy_import('PIL.Image')
+ImageOps = lazy_import('PIL.ImageOps')
+
+MAX_EDGE = int(os.getenv('REMOVEBG_MAX_EDGE', 1600))
+JPEG_QUALITY = int(os.getenv('REMOVEBG_JPEG_QUALITY', 90))
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+def spool(stream):
+    """Return a seekable file for an upload stream without loading it into one bytes object.
+
+    Werkzeug already hands us a temp file or small BytesIO, which is reused
+    as-is; anything else is copied into a SpooledTemporaryFile in chunks.
+    """
+    if getattr(stream, 'seekable', lambda: False)():
+        stream.seek(0)
+        return stream
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    shutil.copyfileobj(stream, spooled)
+    spooled.seek(0)
+    return spooled
+
+
+def file_size(fileobj):
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+class PreparedImage:
+    """Bytes to send upstream plus what was done to produce them."""
+
+    def __init__(self, data, original_size, size, original_bytes, downscaled):
+        self.data = data
+        self.original_size = original_size
+        self.size = size
+        self.original_bytes = original_bytes
+        self.downscaled = downscaled
+
+
+def prepare(fileobj, max_edge=MAX_EDGE, quality=JPEG_QUALITY):
+    """Orient and downscale an upload so its longest edge is at most `max_edge`.
+
+    JPEGs are decoded at a reduced DCT scale via `Image.draft`, then brought
+    down by an integer factor with `reduce` before the final resample, so a
+    12 MP photo never has to be decoded at full size. Uploads that are already
+    small and upright are sent unchanged.
+    """
+    original_bytes = file_size(fileobj)
+    with Image.open(fileobj) as img:
+        original_size = img.size
+        orientation = img.getexif().get(0x0112, 1)
+        longest = max(img.size)
+
+        if longest <= max_edge and orientation == 1:
+            fileobj.seek(0)
+            return PreparedImage(fileobj.read(), original_size, original_size, original_bytes, False)
+
+        if longest > max_edge:
+            scale = max_edge / longest
+            img.draft('RGB', (int(img.width * scale), int(img.height * scale)))
+        img = ImageOps.exif_transpose(img)
+
+        if max(img.size) > max_edge:
+            factor = max(img.size) // max_edge
+            if factor >= 2:
+                img = img.reduce(factor)
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        buffered = BytesIO()
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            img.save(buffered, format='PNG')
+        else:
+            img.convert('RGB').save(buffered, format='JPEG', quality=quality)
+        return PreparedImage(buffered.getvalue(), original_size, img.size, original_bytes, longest > max_edge)
+
+
+def composite_alpha(fileobj, cutout):
+    """Apply the alpha mask of a (downscaled) remove.bg result to the full-resolution original."""
+    fileobj.seek(0)
+    with Image.open(BytesIO(cutout)) as result:
+        mask = result.getchannel('A') if 'A' in result.getbands() else result.convert('L')
+    with Image.open(fileobj) as original:
+        full = ImageOps.exif_transpose(original).convert('RGBA')
+    full.putalpha(mask.resize(full.size, Image.BILINEAR))
+
+    buffered = BytesIO()
+    full.save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+class PipelineStats:
+    """Running totals for comparing what was uploaded with what was sent upstream."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.prep_seconds = 0.0
+        self.upstream_seconds = 0.0
+
+    def record(self, bytes_in, bytes_out, prep_seconds, upstream_seconds):
+        with self._lock:
+            self.images += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.prep_seconds += prep_seconds
+            self.upstream_seconds += upstream_seconds
+
+    def stats(self):
+        with self._lock:
+            images = self.images or 1
+            return {
+                'images': self.images,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'bytes_saved_ratio': round(1 - self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+                'avg_prep_ms': round(self.prep_seconds / images * 1000, 1),
+                'avg_upstream_ms': round(self.upstream_seconds / images * 1000, 1),
+            }
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -0,0 +1,434 @@
+"""Background jobs in a local SQLite file, with no broker to run.
+
+Requests enqueue work and answer 202 straight away; worker threads in any
+process on the host claim jobs in priority order, respecting a concurrency
+limit per job type, and store the result (or the error) back in the file.
+Failed attempts are retried with exponential backoff. Uploads that a job
+needs, and files it produces, live next to the database as <id>.in and
+<id>.out.
+
+Workers run embedded in the web processes (JOB_EMBEDDED_WORKERS threads
+each, 0 to disable) or as separate processes via the apps' `flask
+jobs-worker` command. Both can share the same queue file.
+
+The SpeechToText app uses this same module through a symlink.
+"""
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.5'))
+HEARTBEAT_INTERVAL = 10
+# A running job whose worker has not checked in for this long is requeued
+STALE_AFTER = float(os.getenv('JOB_STALE_AFTER', '120'))
+RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', str(24 * 3600)))
+PURGE_INTERVAL = 600
+EMBEDDED_WORKERS = int(os.getenv('JOB_EMBEDDED_WORKERS', '1'))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobFailed(Exception):
+    """Raised by a handler to fail its job without further retries."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler once its job has been cancelled."""
+
+
+class JobType:
+    def __init__(self, name, handler, priority=0, concurrency=1, max_attempts=3, backoff=5.0, max_backoff=300.0):
+        self.name = name
+        self.handler = handler
+        self.priority = priority
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def retry_delay(self, attempts):
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        return delay * random.uniform(0.8, 1.2)
+
+
+class Job:
+    """What a handler gets: the payload, its files, and progress/cancellation hooks."""
+
+    def __init__(self, queue, id, type, payload, attempts, worker_id):
+        self.queue = queue
+        self.id = id
+        self.type = type
+        self.payload = payload
+        self.attempts = attempts
+        self.worker_id = worker_id
+
+    @property
+    def input_path(self):
+        return self.queue.input_path(self.id)
+
+    @property
+    def output_path(self):
+        return self.queue.output_path(self.id)
+
+    def progress(self, **fields):
+        """Record progress for the status endpoint; raises JobCancelled if the job was cancelled."""
+        conn = self.queue._connect()
+        conn.execute(
+            'UPDATE job SET progress = ?, heartbeat = ? WHERE id = ? AND worker = ?',
+            (json.dumps(fields), time.time(), self.id, self.worker_id),
+        )
+        self.check_cancelled()
+
+    def cancelled(self):
+        row = self.queue._connect().execute('SELECT cancel_requested FROM job WHERE id = ?', (self.id,)).fetchone()
+        return not row or bool(row[0])
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise JobCancelled(self.id)
+
+
+class JobQueue:
+    def __init__(self, path):
+        self.path = path
+        self.files_dir = f'{path}.files'
+        self.types = {}
+        self.workers = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(self.files_dir, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS job ('
+            ' id TEXT PRIMARY KEY,'
+            ' type TEXT NOT NULL,'
+            ' status TEXT NOT NULL,'
+            ' priority INTEGER NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' owner TEXT,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' max_attempts INTEGER NOT NULL,'
+            ' run_after REAL NOT NULL,'
+            ' worker TEXT,'
+            ' heartbeat REAL,'
+            ' cancel_requested INTEGER NOT NULL DEFAULT 0,'
+            ' progress TEXT,'
+            ' result TEXT,'
+            ' error TEXT,'
+            ' created_at REAL NOT NULL,'
+            ' started_at REAL,'
+            ' finished_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_job_ready ON job (status, priority DESC, run_after)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_job_finished ON job (finished_at) WHERE finished_at IS NOT NULL')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # Never reuse a connection inherited from a preloading gunicorn master
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit; claims take the write lock explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """A transaction that holds the write lock from the start."""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def register(self, name, handler=None, **options):
+        """Register handler(job) for jobs of type `name`; also usable as a decorator.
+
+        Options are those of JobType: priority (higher runs first),
+        concurrency (running jobs of this type across all workers),
+        max_attempts, and backoff/max_backoff in seconds between attempts.
+        """
+        if handler is None:
+            return lambda handler: self.register(name, handler, **options)
+        self.types[name] = JobType(name, handler, **options)
+        return handler
+
+    def input_path(self, id):
+        return os.path.join(self.files_dir, f'{id}.in')
+
+    def output_path(self, id):
+        return os.path.join(self.files_dir, f'{id}.out')
+
+    def enqueue(self, type, payload=None, data=None, owner=None, priority=None):
+        """Queue a job and return its id. `data` (bytes or a file object) is saved as its input file."""
+        job_type = self.types[type]
+        id = uuid.uuid4().hex
+        if data is not None:
+            with open(self.input_path(id), 'wb') as f:
+                if isinstance(data, (bytes, bytearray)):
+                    f.write(data)
+                else:
+                    shutil.copyfileobj(data, f)
+        now = time.time()
+        self._connect().execute(
+            'INSERT INTO job (id, type, status, priority, payload, owner, max_attempts, run_after, created_at)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (id, type, QUEUED, job_type.priority if priority is None else priority, json.dumps(payload),
+             None if owner is None else str(owner), job_type.max_attempts, now, now),
+        )
+        return id
+
+    def get(self, id):
+        """The job as a dict, or None if it does not exist (or was purged)."""
+        cursor = self._connect().execute('SELECT * FROM job WHERE id = ?', (id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([column[0] for column in cursor.description], row))
+        for field in ('payload', 'progress', 'result'):
+            job[field] = json.loads(job[field]) if job[field] is not None else None
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        job['has_output'] = job['status'] == DONE and os.path.exists(self.output_path(id))
+        return job
+
+    def cancel(self, id):
+        """Cancel a job; a running one stops at its handler's next progress or cancellation check.
+
+        Returns the job's status afterwards, or None if there is no such job.
+        """
+        with self._write() as conn:
+            row = conn.execute('SELECT status FROM job WHERE id = ?', (id,)).fetchone()
+            if row is None:
+                return None
+            status = row[0]
+            if status == QUEUED:
+                conn.execute(
+                    'UPDATE job SET status = ?, cancel_requested = 1, finished_at = ? WHERE id = ?',
+                    (CANCELLED, time.time(), id),
+                )
+                status = CANCELLED
+            elif status == RUNNING:
+                conn.execute('UPDATE job SET cancel_requested = 1 WHERE id = ?', (id,))
+        if status == CANCELLED:
+            self._remove_files(id, output=False)
+        return status
+
+    def claim(self, worker_id, types=None):
+        """Mark the next runnable job as ours and return it as a Job, or None.
+
+        Highest priority first, then oldest. Types already running at their
+        concurrency limit are skipped. Runs in one write transaction, so two
+        workers can never claim the same job or overshoot a limit.
+        """
+        names = [name for name in (types or self.types) if name in self.types]
+        if not names:
+            return None
+        now = time.time()
+        with self._write() as conn:
+            self._requeue_stale(conn, now)
+            running = dict(conn.execute('SELECT type, COUNT(*) FROM job WHERE status = ? GROUP BY type', (RUNNING,)))
+            names = [name for name in names if running.get(name, 0) < self.types[name].concurrency]
+            if not names:
+                return None
+            row = conn.execute(
+                f'SELECT id, type, payload, attempts FROM job'
+                f' WHERE status = ? AND run_after <= ? AND type IN ({",".join("?" * len(names))})'
+                f' ORDER BY priority DESC, run_after, created_at LIMIT 1',
+                (QUEUED, now, *names),
+            ).fetchone()
+            if row is None:
+                return None
+            id, type, payload, attempts = row
+            conn.execute(
+                'UPDATE job SET status = ?, worker = ?, attempts = ?, heartbeat = ?, started_at = ? WHERE id = ?',
+                (RUNNING, worker_id, attempts + 1, now, now, id),
+            )
+        return Job(self, id, type, json.loads(payload), attempts + 1, worker_id)
+
+    def _requeue_stale(self, conn, now):
+        conn.execute(
+            'UPDATE job SET worker = NULL, run_after = ?, error = ?,'
+            ' status = CASE WHEN cancel_requested THEN ? WHEN attempts < max_attempts THEN ? ELSE ? END,'
+            ' finished_at = CASE WHEN cancel_requested OR attempts >= max_attempts THEN ? END'
+            ' WHERE status = ? AND heartbeat < ?',
+            (now, 'Worker stopped responding', CANCELLED, QUEUED, FAILED, now, RUNNING, now - STALE_AFTER),
+        )
+
+    def heartbeat(self, ids, worker_id):
+        if ids:
+            self._connect().executemany(
+                'UPDATE job SET heartbeat = ? WHERE id = ? AND worker = ?',
+                [(time.time(), id, worker_id) for id in ids],
+            )
+
+    def complete(self, job, result):
+        cursor = self._connect().execute(
+            'UPDATE job SET status = CASE WHEN cancel_requested THEN ? ELSE ? END,'
+            ' result = CASE WHEN cancel_requested THEN NULL ELSE ? END, finished_at = ?'
+            ' WHERE id = ? AND worker = ? AND status = ?',
+            (CANCELLED, DONE, json.dumps(result), time.time(), job.id, job.worker_id, RUNNING),
+        )
+        # No row means the job was requeued as stale or claimed again, and the
+        # files now belong to that attempt
+        if cursor.rowcount == 1:
+            self._remove_files(job.id, output=job.cancelled())
+
+    def fail(self, job, error, retry=True, retry_after=None):
+        """Requeue the job after a backoff delay, or fail it for good once out of attempts."""
+        job_type = self.types[job.type]
+        retry = retry and job.attempts < job_type.max_attempts and not job.cancelled()
+        now = time.time()
+        if retry:
+            delay = retry_after if retry_after is not None else job_type.retry_delay(job.attempts)
+            self._connect().execute(
+                'UPDATE job SET status = ?, worker = NULL, run_after = ?, error = ? WHERE id = ? AND worker = ?',
+                (QUEUED, now + delay, error, job.id, job.worker_id),
+            )
+            return
+        cursor = self._connect().execute(
+            'UPDATE job SET status = CASE WHEN cancel_requested THEN ? ELSE ? END, error = ?, finished_at = ?'
+            ' WHERE id = ? AND worker = ? AND status = ?',
+            (CANCELLED, FAILED, error, now, job.id, job.worker_id, RUNNING),
+        )
+        if cursor.rowcount == 1:
+            self._remove_files(job.id, output=True)
+
+    def run(self, job):
+        """Run one claimed job through its handler and record the outcome."""
+        try:
+            result = self.types[job.type].handler(job)
+        except JobCancelled:
+            self.fail(job, 'Cancelled', retry=False)
+        except JobFailed as e:
+            self.fail(job, str(e), retry=False)
+        except Exception as e:
+            log.warning(f"Job {job.id} ({job.type}) attempt {job.attempts} failed: {str(e)}")
+            self.fail(job, str(e), retry_after=_retry_after(e))
+        else:
+            self.complete(job, result)
+
+    def purge(self, older_than=RESULT_TTL):
+        """Delete finished jobs, and their files, older than `older_than` seconds."""
+        conn = self._connect()
+        ids = [row[0] for row in conn.execute(
+            'SELECT id FROM job WHERE finished_at < ?', (time.time() - older_than,)
+        )]
+        for id in ids:
+            self._remove_files(id, output=True)
+        conn.executemany('DELETE FROM job WHERE id = ?', [(id,) for id in ids])
+        return len(ids)
+
+    def _remove_files(self, id, output):
+        paths = [self.input_path(id)] + ([self.output_path(id)] if output else [])
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def start_embedded(self, threads=EMBEDDED_WORKERS, context=None):
+        """Start worker threads in this process once; call it after forking."""
+        with self._lock:
+            if threads > 0 and self.workers is None:
+                self.workers = Worker(self, threads=threads, context=context).start()
+        return self.workers
+
+
+def _retry_after(error):
+    """Seconds to wait that an error such as an upstream 429 asked for, if any."""
+    try:
+        return float(error.retry_after)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class Worker:
+    """`threads` threads claiming and running jobs from one queue.
+
+    `context`, if given, is called for a context manager to run each job
+    in, e.g. a Flask app context.
+    """
+
+    def __init__(self, queue, threads=1, types=None, context=None, poll_interval=POLL_INTERVAL):
+        self.queue = queue
+        self.threads = threads
+        self.types = types
+        self.context = context
+        self.poll_interval = poll_interval
+        self.id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.current = set()
+        self.processed = 0
+        self.stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._maintain, name='job-heartbeat', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def run_forever(self):
+        """Run in the foreground until interrupted."""
+        self.start()
+        try:
+            while not self.stopping.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _work(self):
+        while not self.stopping.is_set():
+            try:
+                job = self.queue.claim(self.id, self.types)
+            except sqlite3.OperationalError as e:
+                log.error(f"Job queue error: {str(e)}")
+                job = None
+            if job is None:
+                # Jittered so idle workers in different processes do not poll in step
+                self.stopping.wait(self.poll_interval * random.uniform(0.5, 1.5))
+                continue
+            self.current.add(job.id)
+            try:
+                if self.context:
+                    with self.context():
+                        self.queue.run(job)
+                else:
+                    self.queue.run(job)
+            except Exception as e:
+                log.error(f"Job worker error: {str(e)}")
+            finally:
+                self.current.discard(job.id)
+                self.processed += 1
+
+    def _maintain(self):
+        last_purge = 0.0
+        while not self.stopping.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.queue.heartbeat(list(self.current), self.id)
+                if time.monotonic() - last_purge >= PURGE_INTERVAL:
+                    last_purge = time.monotonic()
+                    self.queue.purge()
+            except Exception as e:
+                log.error(f"Job queue maintenance error: {str(e)}")
@@ -0,0 +1,195 @@
+import base64
+import csv
+import io
+import json
+import multiprocessing
+import os
+import re
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from qr_cache import make_key
+from qr_render import MIME_TYPES, parse_options, render_qr
+
+MAX_ITEMS = int(os.getenv('QR_BATCH_MAX_ITEMS', 10000))
+POOL_WORKERS = int(os.getenv('QR_BATCH_WORKERS', os.cpu_count() or 1))
+
+# Created on first use so plain page loads never fork a pool
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # Forking a threaded gunicorn worker can copy locks other threads
+        # hold; forkserver children start from a clean single-threaded process
+        _executor = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context('forkserver'))
+    return _executor
+
+
+def _discard(executor):
+    """Drop a pool whose child died, so the next batch starts a fresh one."""
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False)
+
+
+def _submit(data, options):
+    executor = get_executor()
+    try:
+        return executor.submit(render_qr, data, options), executor
+    except BrokenProcessPool:
+        _discard(executor)
+        executor = get_executor()
+        return executor.submit(render_qr, data, options), executor
+
+
+def parse_items(request):
+    """Read batch items from a JSON array or an uploaded CSV/NDJSON file.
+
+    Each item is either a plain string or an object with a `data` key plus
+    any of the /generate-qr options and an optional `name`.
+    """
+    if 'file' in request.files:
+        upload = request.files['file']
+        text = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+        if upload.filename.lower().endswith('.csv') or upload.mimetype == 'text/csv':
+            items = list(csv.DictReader(text))
+        else:
+            items = [json.loads(line) for line in text if line.strip()]
+    else:
+        payload = request.get_json(silent=True)
+        items = payload.get('items') if isinstance(payload, dict) else payload
+
+    if not isinstance(items, list) or not items:
+        raise ValueError('Expected a non-empty list of items')
+    if len(items) > MAX_ITEMS:
+        raise ValueError(f'Batches are limited to {MAX_ITEMS} items')
+    return items
+
+
+def _safe_name(name, index, extension):
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', str(name)).strip('._') if name else ''
+    return f'{name or f"{index:05d}"}.{extension}'
+
+
+def _prepare(index, item):
+    """Normalize one item into (name, data, options); raises ValueError on bad input."""
+    if isinstance(item, str):
+        item = {'data': item}
+    if not isinstance(item, dict) or not item.get('data'):
+        raise ValueError('Item has no data')
+    options = parse_options(item)
+    return _safe_name(item.get('name'), index, options['format'].lower()), item['data'], options
+
+
+def render_batch(items, cache=None, window=None):
+    """Yield (index, name, image_bytes, error) for every item as soon as it is ready.
+
+    Cached codes are yielded straight away; the rest are rendered in the process
+    pool with at most `window` renders in flight so memory stays bounded.
+    """
+    window = window or POOL_WORKERS * 4
+    pending = {}
+
+    for index, item in enumerate(items):
+        try:
+            name, data, options = _prepare(index, item)
+        except (TypeError, ValueError) as e:
+            # Keep the item's own name so the manifest entry can be matched to it
+            name = item.get('name') if isinstance(item, dict) else None
+            yield index, _safe_name(name, index, 'png'), None, str(e)
+            continue
+
+        key = make_key(data, options)
+        image = cache.get(key) if cache is not None else None
+        if image is not None:
+            yield index, name, image, None
+            continue
+
+        future, executor = _submit(data, options)
+        pending[future] = (index, name, key, executor)
+        if len(pending) >= window:
+            yield from _drain(pending, cache)
+
+    while pending:
+        yield from _drain(pending, cache)
+
+
+def _drain(pending, cache):
+    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+    for future in done:
+        index, name, key, executor = pending.pop(future)
+        try:
+            image = future.result()
+        except BrokenProcessPool:
+            # A render crashed the pool, e.g. killed for memory; every item
+            # still in it fails and later ones go to a new pool
+            _discard(executor)
+            yield index, name, None, 'Renderer crashed; retry this item'
+            continue
+        except Exception as e:
+            yield index, name, None, str(e)
+            continue
+        if cache is not None:
+            cache.put(key, image)
+        yield index, name, image, None
+
+
+class _StreamBuffer:
+    """Write-only sink for ZipFile that lets us hand out bytes as they are written."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(results):
+    """Stream results as a ZIP archive with a trailing manifest.ndjson.
+
+    Failed items are written as `<name>.error.txt` entries so one bad row
+    never aborts the archive. Items sharing a name get their index appended.
+    """
+    buffer = _StreamBuffer()
+    manifest = []
+    used = {'manifest.ndjson'}
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for index, name, image, error in results:
+            while name in used or f'{name}.error.txt' in used:
+                stem, extension = name.rsplit('.', 1)
+                name = f'{stem}-{index:05d}.{extension}'
+            used.update((name, f'{name}.error.txt'))
+            if error is None:
+                archive.writestr(name, image)
+                manifest.append({'index': index, 'name': name, 'success': True})
+            else:
+                archive.writestr(f'{name}.error.txt', error)
+                manifest.append({'index': index, 'name': name, 'success': False, 'error': error})
+            yield buffer.drain()
+        archive.writestr('manifest.ndjson', ''.join(json.dumps(entry) + '\n' for entry in manifest))
+    yield buffer.drain()
+
+
+def stream_ndjson(results):
+    """Stream one JSON line per item, carrying the same data URI as /generate-qr."""
+    for index, name, image, error in results:
+        if error is None:
+            mime_type = MIME_TYPES[name.rsplit('.', 1)[-1].upper()]
+            qr_code = f'data:{mime_type};base64,{base64.b64encode(image).decode()}'
+            line = {'index': index, 'name': name, 'success': True, 'qr_code': qr_code}
+        else:
+            line = {'index': index, 'name': name, 'success': False, 'error': error}
+        yield json.dumps(line) + '\n'
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+def make_key(data, options):
+    """Content-addressed key for a rendered QR code.
+
+    Everything that changes the output bytes goes into the hash, so two requests
+    with the same key are guaranteed to produce the same image.
+    """
+    material = json.dumps(
+        [
+            data,
+            options['version'],
+            options['box_size'],
+            options['border'],
+            options['fill_color'],
+            options['back_color'],
+            options['format'],
+        ],
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class DiskTier:
+    """SQLite-backed LRU store shared by every gunicorn worker on the host.
+
+    A hit refreshes the entry's last_used at most every TOUCH_INTERVAL
+    seconds, so hot entries aren't rewritten on every read.
+    """
+
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS qr_cache ('
+            ' key TEXT PRIMARY KEY,'
+            ' value BLOB NOT NULL,'
+            ' last_used REAL NOT NULL DEFAULT 0)'
+        )
+        # Tables created before eviction by last use
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(qr_cache)')}
+        if 'last_used' not in columns:
+            conn.execute('ALTER TABLE qr_cache ADD COLUMN last_used REAL NOT NULL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS qr_cache_last_used ON qr_cache (last_used)')
+        conn.commit()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # Never reuse a connection inherited from a preloading gunicorn master
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value, last_used FROM qr_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] >= self.TOUCH_INTERVAL:
+            with conn:
+                conn.execute('UPDATE qr_cache SET last_used = ? WHERE key = ?', (now, key))
+        return bytes(row[0])
+
+    def put(self, key, value):
+        """Store `value` and return how many least recently used entries were evicted to make room."""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO qr_cache (key, value, last_used) VALUES (?, ?, ?)',
+                (key, value, time.time()),
+            )
+            excess = conn.execute('SELECT COUNT(*) FROM qr_cache').fetchone()[0] - self.max_entries
+            if excess <= 0:
+                return 0
+            cursor = conn.execute(
+                'DELETE FROM qr_cache WHERE key IN (SELECT key FROM qr_cache ORDER BY last_used LIMIT ?)',
+                (excess,),
+            )
+        return cursor.rowcount
+
+    def size(self):
+        return self._connect().execute('SELECT COUNT(*) FROM qr_cache').fetchone()[0]
+
+
+class QRCache:
+    """Bounded in-memory LRU with an optional shared on-disk tier behind it.
+
+    Counters are per worker process; the pid is included in `stats()` so
+    numbers scraped from different workers can be told apart.
+    """
+
+    def __init__(self, max_entries=512, disk_path=None, disk_max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = DiskTier(disk_path, disk_max_entries) if disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except sqlite3.Error as e:
+                log.error(f"QR disk cache read failed: {str(e)}")
+                value = None
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.disk is not None:
+            try:
+                evicted = self.disk.put(key, value)
+            except sqlite3.Error as e:
+                log.error(f"QR disk cache write failed: {str(e)}")
+                return
+            with self._lock:
+                self.disk_evictions += evicted
+
+    def get_or_render(self, key, render):
+        """Return the cached bytes for `key`, calling `render()` only on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.put(key, value)
+        return value
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            stats = {
+                'pid': os.getpid(),
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'disk_evictions': self.disk_evictions,
+                'hit_ratio': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
+        if self.disk is not None:
+            try:
+                stats['disk_entries'] = self.disk.size()
+            except sqlite3.Error:
+                stats['disk_entries'] = None
+        return stats
@@ -0,0 +1,135 @@
+import os
+from io import BytesIO
+
+from startup import lazy_import
+
+qrcode = lazy_import('qrcode')
+Image = lazy_import('PIL.Image')
+ImageColor = lazy_import('PIL.ImageColor')
+
+# Defaults match what /generate-qr has always produced
+DEFAULT_OPTIONS = {
+    'version': 1,
+    'box_size': 10,
+    'border': 5,
+    'fill_color': 'black',
+    'back_color': 'white',
+    'format': 'PNG',
+}
+
+MIME_TYPES = {
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+    'SVG': 'image/svg+xml',
+}
+
+SUPPORTED_FORMATS = tuple(MIME_TYPES)
+
+# Rendering allocates the whole image up front, so its size is bounded
+MAX_BOX_SIZE = 50
+MAX_BORDER = 20
+MAX_IMAGE_SIZE = int(os.getenv('QR_MAX_IMAGE_SIZE', 4000))
+
+
+def parse_options(payload):
+    """Pull QR rendering options out of a request payload, falling back to defaults.
+
+    Raises ValueError for values that qrcode would reject.
+    """
+    options = dict(DEFAULT_OPTIONS)
+    for name in ('version', 'box_size', 'border'):
+        value = payload.get(name)
+        # A blank CSV column means the default, like a missing key
+        if value is not None and str(value).strip():
+            options[name] = int(value)
+    for name in ('fill_color', 'back_color'):
+        value = payload.get(name)
+        if value:
+            options[name] = str(value)
+            ImageColor.getrgb(options[name])
+    if payload.get('format'):
+        options['format'] = str(payload['format']).upper()
+
+    if options['format'] not in SUPPORTED_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(SUPPORTED_FORMATS)}")
+    if not 1 <= options['version'] <= 40:
+        raise ValueError('version must be between 1 and 40')
+    if not 1 <= options['box_size'] <= MAX_BOX_SIZE:
+        raise ValueError(f'box_size must be between 1 and {MAX_BOX_SIZE}')
+    if not 0 <= options['border'] <= MAX_BORDER:
+        raise ValueError(f'border must be between 0 and {MAX_BORDER}')
+    return options
+
+
+def build_matrix(data, options):
+    """Return the QR module matrix for `data`, border included."""
+    qr = qrcode.QRCode(version=options['version'], box_size=options['box_size'], border=options['border'])
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def render_qr(data, options=None):
+    """Build the QR matrix for `data` and encode it in the requested format.
+
+    Raises ValueError when the image would be wider than MAX_IMAGE_SIZE pixels.
+    """
+    options = options or DEFAULT_OPTIONS
+    matrix = build_matrix(data, options)
+    if len(matrix) * options['box_size'] > MAX_IMAGE_SIZE:
+        raise ValueError(f'QR code would be larger than {MAX_IMAGE_SIZE}px; use a smaller box_size or border')
+    if options['format'] == 'SVG':
+        return render_svg(matrix, options)
+    return render_raster(matrix, options)
+
+
+def render_raster(matrix, options):
+    """Encode the matrix as a two-colour palette image.
+
+    Drawing one pixel per module and scaling up with nearest-neighbour is much
+    cheaper than qrcode's per-box drawing, and a 1-bit palette keeps PNGs small
+    whatever the colours are.
+    """
+    size = len(matrix)
+    img = Image.frombytes('P', (size, size), bytes(1 if cell else 0 for row in matrix for cell in row))
+    img.putpalette(ImageColor.getrgb(options['back_color'])[:3] + ImageColor.getrgb(options['fill_color'])[:3])
+    scaled = size * options['box_size']
+    img = img.resize((scaled, scaled), Image.NEAREST)
+
+    buffered = BytesIO()
+    if options['format'] == 'PNG':
+        img.save(buffered, format='PNG', bits=1)
+    elif options['format'] == 'WEBP':
+        img.convert('RGB').save(buffered, format='WEBP', lossless=True)
+    else:
+        img.save(buffered, format=options['format'])
+    return buffered.getvalue()
+
+
+def render_svg(matrix, options):
+    """Encode the matrix as SVG, one path segment per horizontal run of dark modules."""
+    size = len(matrix)
+    scaled = size * options['box_size']
+    fill = '#%02x%02x%02x' % ImageColor.getrgb(options['fill_color'])[:3]
+    back = '#%02x%02x%02x' % ImageColor.getrgb(options['back_color'])[:3]
+
+    segments = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                segments.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+            else:
+                x += 1
+
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{scaled}" height="{scaled}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="{back}"/>'
+        f'<path fill="{fill}" d="{"".join(segments)}"/></svg>'
+    )
+    return svg.encode('utf-8')
@@ -0,0 +1,239 @@
+"""Token-bucket rate limits shared by every worker on the host through SQLite.
+
+Each bucket holds up to `count` tokens and refills at count/period, so a
+client can burst up to its limit and then continues at the average rate.
+Buckets are kept per client (user id or IP) for each limited endpoint, and
+per upstream API, where every paid call takes a token whoever caused it.
+Limits are written like '10/minute', '500/day' or '5/30s'.
+
+Every decision is also counted per day in the usage table, which is what
+the apps' quota endpoints report. The SpeechToText app uses this same
+module through a symlink.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+USAGE_DAYS = int(os.getenv('RATE_LIMIT_USAGE_DAYS', '31'))
+# X-Forwarded-For entries added by proxies we trust, e.g. 1 behind Render's load balancer
+PROXY_HOPS = int(os.getenv('RATE_LIMIT_PROXY_HOPS', '0'))
+UPSTREAM_CLIENT = '-'
+
+PERIODS = {
+    's': 1, 'sec': 1, 'second': 1,
+    'm': 60, 'min': 60, 'minute': 60,
+    'h': 3600, 'hour': 3600,
+    'd': 86400, 'day': 86400,
+    'month': 30 * 86400,
+}
+_LIMIT = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([a-z]+?)s?\s*$')
+
+
+class RateLimited(Exception):
+    """A bucket is empty; `retry_after` is how many seconds until it has a token again."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Limit:
+    def __init__(self, count, period):
+        self.count = count
+        self.period = period
+        self.rate = count / period
+
+    @classmethod
+    def parse(cls, spec):
+        """Limit for '10/minute' and the like; None for '', '0' or 'off' (unlimited)."""
+        if not spec or spec.strip().lower() in ('0', 'off', 'none'):
+            return None
+        match = _LIMIT.match(spec.lower())
+        if not match or match.group(3) not in PERIODS or int(match.group(1)) <= 0:
+            raise ValueError(f'Invalid rate limit {spec!r}, expected e.g. 10/minute')
+        count, multiple, unit = match.groups()
+        return cls(int(count), int(multiple or 1) * PERIODS[unit])
+
+    def __str__(self):
+        return f'{self.count}/{self.period:g}s'
+
+
+def client_address(request, hops=PROXY_HOPS):
+    """The caller's IP, taken from X-Forwarded-For when behind `hops` trusted proxies."""
+    if hops > 0:
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.remote_addr or 'unknown'
+
+
+class RateLimiter:
+    def __init__(self, path):
+        self.path = path
+        self.limits = {}
+        self.upstreams = set()
+        self._local = threading.local()
+        self._pruned_day = None
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS bucket ('
+            ' scope TEXT NOT NULL,'
+            ' client TEXT NOT NULL,'
+            ' tokens REAL NOT NULL,'
+            ' updated REAL NOT NULL,'
+            ' PRIMARY KEY (scope, client))'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS usage ('
+            ' day TEXT NOT NULL,'
+            ' scope TEXT NOT NULL,'
+            ' client TEXT NOT NULL,'
+            ' allowed INTEGER NOT NULL DEFAULT 0,'
+            ' rejected INTEGER NOT NULL DEFAULT 0,'
+            ' PRIMARY KEY (day, scope, client))'
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # Never reuse a connection inherited from a preloading gunicorn master
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def configure(self, scope, spec, upstream=False):
+        """Limit `scope` to `spec` ('10/minute'); an empty spec leaves it unlimited.
+
+        Upstream scopes have one bucket shared by all clients.
+        """
+        limit = Limit.parse(spec)
+        if upstream:
+            self.upstreams.add(scope)
+        if limit is None:
+            self.limits.pop(scope, None)
+        else:
+            self.limits[scope] = limit
+        return limit
+
+    def hit(self, scope, client=UPSTREAM_CLIENT, cost=1):
+        """Take `cost` tokens from the bucket; returns 0, or the seconds to wait if it is empty.
+
+        Unlimited scopes always allow, but are still counted in the usage table.
+        """
+        limit = self.limits.get(scope)
+        now = time.time()
+        with self._write() as conn:
+            retry_after = 0.0
+            if limit is not None:
+                tokens = self._refilled(conn, scope, client, limit, now)
+                if tokens >= cost:
+                    tokens -= cost
+                else:
+                    retry_after = (cost - tokens) / limit.rate
+                conn.execute(
+                    'INSERT OR REPLACE INTO bucket (scope, client, tokens, updated) VALUES (?, ?, ?, ?)',
+                    (scope, client, tokens, now),
+                )
+            allowed = retry_after == 0
+            conn.execute(
+                'INSERT INTO usage (day, scope, client, allowed, rejected) VALUES (?, ?, ?, ?, ?)'
+                ' ON CONFLICT (day, scope, client) DO UPDATE SET'
+                ' allowed = allowed + excluded.allowed, rejected = rejected + excluded.rejected',
+                (_today(now), scope, client, int(allowed), int(not allowed)),
+            )
+        self._prune(now)
+        return retry_after
+
+    def check(self, scope, client=UPSTREAM_CLIENT, cost=1):
+        """hit(), raising RateLimited instead of returning a delay."""
+        retry_after = self.hit(scope, client, cost)
+        if retry_after:
+            raise RateLimited(f'Rate limit for {scope} exceeded, retry in {retry_after:.0f}s', retry_after)
+
+    def peek(self, scope, client=UPSTREAM_CLIENT, cost=1):
+        """Seconds until `cost` tokens are available, without taking them."""
+        limit = self.limits.get(scope)
+        if limit is None:
+            return 0.0
+        tokens = self._refilled(self._connect(), scope, client, limit, time.time())
+        return 0.0 if tokens >= cost else (cost - tokens) / limit.rate
+
+    def _refilled(self, conn, scope, client, limit, now):
+        row = conn.execute('SELECT tokens, updated FROM bucket WHERE scope = ? AND client = ?', (scope, client)).fetchone()
+        if row is None:
+            return float(limit.count)
+        tokens, updated = row
+        return min(float(limit.count), tokens + (now - updated) * limit.rate)
+
+    def _prune(self, now):
+        # Once a day per process: old usage, and buckets idle long enough to be full again
+        day = _today(now)
+        if day == self._pruned_day:
+            return
+        self._pruned_day = day
+        longest = max([limit.period for limit in self.limits.values()] or [0])
+        conn = self._connect()
+        conn.execute('DELETE FROM usage WHERE day < ?', (_today(now - USAGE_DAYS * 86400),))
+        conn.execute('DELETE FROM bucket WHERE updated < ?', (now - longest,))
+
+    def usage(self, days=1, scopes=None, client=None, top=20):
+        """Consumed quota over the last `days` days.
+
+        Per scope: allowed and rejected totals, the limit and the tokens left
+        (in `client`'s own bucket for per-client scopes). Per client: the
+        `top` heaviest (client, scope) pairs, or only `client` if given.
+        """
+        now = time.time()
+        since = _today(now - (days - 1) * 86400)
+        conn = self._connect()
+        filters, params = 'day >= ?', [since]
+        if scopes is not None:
+            filters += f' AND scope IN ({",".join("?" * len(scopes))})'
+            params += list(scopes)
+
+        report = {'since': since, 'scopes': {}, 'clients': {}}
+        for scope in scopes if scopes is not None else self.limits:
+            limit = self.limits.get(scope)
+            report['scopes'][scope] = {'limit': str(limit) if limit else None, 'allowed': 0, 'rejected': 0}
+        for scope, allowed, rejected in conn.execute(
+            f'SELECT scope, SUM(allowed), SUM(rejected) FROM usage WHERE {filters} GROUP BY scope', params
+        ):
+            limit = self.limits.get(scope)
+            entry = report['scopes'].setdefault(scope, {'limit': str(limit) if limit else None})
+            entry.update(allowed=allowed, rejected=rejected)
+        for scope, entry in report['scopes'].items():
+            bucket = UPSTREAM_CLIENT if scope in self.upstreams else client
+            if scope in self.limits and bucket:
+                entry['tokens_left'] = round(self._refilled(conn, scope, bucket, self.limits[scope], now), 2)
+
+        client_filter = ' AND client = ?' if client else ' AND client != ?'
+        rows = conn.execute(
+            f'SELECT client, scope, SUM(allowed), SUM(rejected) FROM usage WHERE {filters}{client_filter}'
+            f' GROUP BY client, scope ORDER BY SUM(allowed) + SUM(rejected) DESC LIMIT ?',
+            params + [client or UPSTREAM_CLIENT, top],
+        )
+        for name, scope, allowed, rejected in rows:
+            report['clients'].setdefault(name, {})[scope] = {'allowed': allowed, 'rejected': rejected}
+        return report
+
+
+def _today(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
@@ -0,0 +1,198 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def content_hash(image, variant='auto'):
+    """Exact key: the uploaded bytes plus every setting that changes the result.
+
+    `image` may be bytes or a seekable file, which is hashed in chunks.
+    """
+    digest = hashlib.sha256()
+    if isinstance(image, bytes):
+        digest.update(image)
+    else:
+        image.seek(0)
+        for chunk in iter(lambda: image.read(64 * 1024), b''):
+            digest.update(chunk)
+        image.seek(0)
+    digest.update(f'|{variant}'.encode())
+    return f'sha256-{digest.hexdigest()}'
+
+
+class ResultCache:
+    """Bounded on-disk cache of remove.bg results shared by every worker.
+
+    A hit refreshes the entry's mtime, so entries expire after `ttl` seconds
+    unused and the least recently used are evicted once the directory grows
+    past `max_bytes`. `get_or_compute` coalesces concurrent
+    misses for the same key: threads in a worker wait on an in-process lock,
+    and workers wait on an flock() so only one upstream call is made.
+    """
+
+    SCAN_EVERY = 256
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.evictions = 0
+        # Bytes this process knows to be in the directory; other workers'
+        # writes only show up at the next scan
+        self._bytes = None
+        self._writes_since_scan = 0
+        self._evict_lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.png')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, value):
+        # Write then rename so other workers never see a half-written file
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        with self._stats_lock:
+            self._writes_since_scan += 1
+            if self._bytes is not None:
+                self._bytes += len(value)
+            # Scanning the directory costs as much as it holds, so only when
+            # over the limit, and every SCAN_EVERY writes for other workers' files
+            scan = self._bytes is None or self._bytes > self.max_bytes or self._writes_since_scan >= self.SCAN_EVERY
+        if scan:
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        """Return the cached result for `key`, else `compute()` and store it."""
+        value = self.get(key)
+        if value is not None:
+            self._count('hits')
+            return value
+
+        with self._thread_lock(key), self._worker_lock(key):
+            # Someone else may have filled the entry while we waited
+            value = self.get(key)
+            if value is not None:
+                self._count('coalesced')
+                return value
+            self._count('misses')
+            value = compute()
+            self._count('upstream_calls')
+            self.put(key, value)
+            return value
+
+    @contextmanager
+    def _thread_lock(self, key):
+        with self._locks_guard:
+            lock, waiters = self._locks.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._locks[key] = (lock, waiters + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_guard:
+                lock, waiters = self._locks[key]
+                if waiters == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, waiters - 1)
+
+    @contextmanager
+    def _worker_lock(self, key):
+        # A fixed set of striped lock files avoids deleting a lock someone is waiting on
+        stripe = hashlib.md5(key.encode()).hexdigest()[:2]
+        with open(os.path.join(self.directory, f'{stripe}.lock'), 'wb') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict(self):
+        # One scan at a time per process is enough
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            self._scan_and_evict()
+        finally:
+            self._evict_lock.release()
+
+    def _scan_and_evict(self):
+        entries = []
+        total = 0
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.png'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl:
+                    self._remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        entries.sort()
+        while total > self.max_bytes and entries:
+            _, size, path = entries.pop(0)
+            self._remove(path)
+            total -= size
+        with self._stats_lock:
+            self._bytes = total
+            self._writes_since_scan = 0
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self._count('evictions')
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self._stats_lock:
+            lookups = self.hits + self.coalesced + self.misses
+            return {
+                'pid': os.getpid(),
+                'hits': self.hits,
+                'coalesced': self.coalesced,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'upstream_calls': self.upstream_calls,
+                'upstream_calls_saved': self.hits + self.coalesced,
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,220 @@
+import os
+import random
+import threading
+import time
+
+import telemetry
+from startup import lazy_import
+
+# Only loaded once the first upload goes upstream
+requests = lazy_import('requests')
+
+REMOVEBG_API_URL = os.getenv('REMOVEBG_API_URL', 'https://api.remove.bg/v1.0/removebg')
+
+
+class RemoveBgError(Exception):
+    """remove.bg could not process the image."""
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class UpstreamBusyError(RemoveBgError):
+    """Every remove.bg slot in this worker stayed busy for the whole wait."""
+
+
+class CircuitOpenError(RemoveBgError):
+    """remove.bg has been failing and calls are being short-circuited."""
+
+
+class CircuitBreaker:
+    """Classic closed / open / half-open breaker.
+
+    After `failure_threshold` consecutive failures calls are rejected for
+    `reset_timeout` seconds, then a single trial call decides whether to close
+    again or re-open.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            # A trial that never reported back (e.g. an unexpected exception) must not wedge the breaker
+            stale = time.monotonic() - self._trial_started >= self.reset_timeout
+            if self.state == 'half_open' and (not self._trial_in_flight or stale):
+                self._trial_in_flight = True
+                self._trial_started = time.monotonic()
+                return True
+            return False
+
+    def retry_after(self):
+        with self._lock:
+            return max(0, int(self.reset_timeout - (time.monotonic() - self._opened_at)) + 1)
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class RemoveBgClient:
+    """Pooled remove.bg client with timeouts, a concurrency cap, retries and a circuit breaker.
+
+    Calls share one keep-alive `requests.Session`, which also makes them
+    cooperative under gevent workers. Retries stop at `deadline` seconds after
+    the call started, so a request always ends before gunicorn's timeout.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        url=REMOVEBG_API_URL,
+        pool_size=10,
+        max_concurrency=4,
+        connect_timeout=5.0,
+        read_timeout=60.0,
+        max_retries=3,
+        backoff_base=0.5,
+        backoff_max=8.0,
+        acquire_timeout=10.0,
+        deadline=90.0,
+        breaker=None,
+    ):
+        self.api_key = api_key
+        self.url = url
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.acquire_timeout = acquire_timeout
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = telemetry.timed_adapter('removebg', pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.short_circuited = 0
+
+    @classmethod
+    def from_env(cls, api_key):
+        return cls(
+            api_key,
+            max_concurrency=int(os.getenv('REMOVEBG_MAX_CONCURRENCY', 4)),
+            read_timeout=float(os.getenv('REMOVEBG_TIMEOUT', 60)),
+            max_retries=int(os.getenv('REMOVEBG_MAX_RETRIES', 3)),
+            deadline=float(os.getenv('REMOVEBG_DEADLINE', 90)),
+        )
+
+    def remove_background(self, image_data, size='auto'):
+        """Send `image_data` to remove.bg and return the resulting PNG bytes."""
+        deadline = time.monotonic() + self.deadline
+        if not self._semaphore.acquire(timeout=min(self.acquire_timeout, self.deadline)):
+            raise UpstreamBusyError('Too many concurrent remove.bg requests', 503, retry_after=1)
+        try:
+            for attempt in range(self.max_retries + 1):
+                self._before_attempt(attempt)
+                remaining = deadline - time.monotonic()
+                try:
+                    response = self.session.post(
+                        self.url,
+                        files={'image_file': image_data},
+                        data={'size': size},
+                        headers={'X-Api-Key': self.api_key},
+                        timeout=(min(self.timeout[0], remaining), min(self.timeout[1], remaining)),
+                    )
+                except requests.RequestException as e:
+                    error = self._transport_error(e)
+                else:
+                    error = self._check_response(response.status_code, response.headers)
+                    if error is None:
+                        return response.content
+                delay = self._backoff(attempt, error.retry_after)
+                # Leave at least a second for the next attempt
+                if attempt == self.max_retries or time.monotonic() + delay + 1 > deadline:
+                    break
+                time.sleep(delay)
+            raise error
+        finally:
+            self._semaphore.release()
+
+    def _before_attempt(self, attempt):
+        if not self.breaker.allow():
+            with self._stats_lock:
+                self.short_circuited += 1
+            raise CircuitOpenError('remove.bg is unavailable, try again later', 503, self.breaker.retry_after())
+        with self._stats_lock:
+            self.calls += 1
+            if attempt:
+                self.retries += 1
+
+    def _transport_error(self, exc):
+        self._record_failure()
+        return RemoveBgError(f'remove.bg request failed: {str(exc)}')
+
+    def _check_response(self, status_code, headers):
+        """Return None on success, a retryable error for 429/5xx, and raise for other 4xx."""
+        if status_code == 200:
+            self.breaker.record_success()
+            return None
+        if status_code == 429 or status_code >= 500:
+            self._record_failure()
+            return RemoveBgError(f'remove.bg returned status {status_code}', status_code, headers.get('Retry-After'))
+        # Anything else is a problem with our request, not an upstream outage
+        self.breaker.record_success()
+        raise RemoveBgError(f'remove.bg returned status {status_code}', status_code)
+
+    def _record_failure(self):
+        self.breaker.record_failure()
+        with self._stats_lock:
+            self.failures += 1
+
+    def _backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, never shorter than a numeric Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        try:
+            delay = max(delay, min(float(retry_after), self.backoff_max))
+        except (TypeError, ValueError):
+            pass
+        return delay
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'failures': self.failures,
+                'short_circuited': self.short_circuited,
+                'circuit': self.breaker.state,
+            }
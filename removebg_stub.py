@@ -0,0 +1,89 @@
+"""Local stand-in for the remove.bg API.
+
+Run `python removebg_stub.py` and point the app at it with
+REMOVEBG_API_URL=http://127.0.0.1:5099/v1.0/removebg.
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from PIL import Image
+
+
+def _transparent_png():
+    buffered = BytesIO()
+    Image.new('RGBA', (1, 1), (0, 0, 0, 0)).save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+class RemoveBgStub(ThreadingHTTPServer):
+    """Threaded HTTP server that answers remove.bg-style requests.
+
+    `statuses` is consumed one per request before falling back to
+    `error_rate`; `latency` (seconds) is slept before every response.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, error_rate=0.0, statuses=None):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.statuses = list(statuses or [])
+        self.requests = 0
+        self.png = _transparent_png()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1.0/removebg'
+
+    def next_status(self):
+        with self._lock:
+            self.requests += 1
+            if self.statuses:
+                return self.statuses.pop(0)
+        return 500 if random.random() < self.error_rate else 200
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        status = self.server.next_status()
+        if not self.headers.get('X-Api-Key'):
+            status = 403
+        body = self.server.png if status == 200 else b'{"errors": [{"title": "stub error"}]}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'image/png' if status == 200 else 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 5099)))
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = RemoveBgStub(('127.0.0.1', args.port), latency=args.latency, error_rate=args.error_rate)
+    print(f"remove.bg stub listening on {server.url}")
+    server.serve_forever()
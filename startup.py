@@ -0,0 +1,140 @@
+"""Deferred imports and clients, and pre-fork warmup.
+
+Heavy modules are imported with lazy_import() and upstream clients are
+wrapped in Lazy, so nothing is loaded or connected until a request needs
+it; a worker that only serves the index page never pays for PIL or
+requests.
+
+With gunicorn's preload_app the master imports the app once and calls
+warmup() before forking (see gunicorn.conf.py). That runs every hook
+registered with @on_warmup, which load models and finish the lazy
+imports, then freezes the garbage collector so the objects they created
+stay in pages the forked workers share copy-on-write instead of each
+worker building, and later dirtying, its own copy.
+
+worker_model() sizes the gunicorn workers for both gunicorn.conf.py
+files, and the apps call it too, e.g. to size their connection pools.
+The SpeechToText app uses this same module through a symlink.
+"""
+import gc
+import importlib.util
+import logging
+import math
+import os
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_hooks = []
+
+
+def lazy_import(name):
+    """Return module `name`, executing it only when one of its attributes is first used."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load(*modules):
+    """Finish importing modules from lazy_import() now."""
+    for module in modules:
+        # Any attribute access runs the deferred import
+        module.__dict__
+
+
+class Lazy:
+    """An object built by `factory` on first get(), once, whichever thread asks first."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self.factory()
+        return self._value
+
+
+def on_warmup(func):
+    """Register `func` to run in warmup(); usable as a decorator."""
+    _hooks.append(func)
+    return func
+
+
+def warmup():
+    """Run the warmup hooks, then freeze the GC; call in the master just before forking.
+
+    Returns how long each hook took, in seconds.
+    """
+    timings = {}
+    for hook in _hooks:
+        start = time.perf_counter()
+        try:
+            hook()
+        except Exception as e:
+            log.exception(f"Warmup error in {hook.__name__}: {str(e)}")
+        timings[hook.__name__] = round(time.perf_counter() - start, 3)
+    # Collect first so only live objects are frozen, then move them out of
+    # the collector's reach: its bookkeeping writes would otherwise copy
+    # every page they live on into each worker
+    gc.collect()
+    gc.freeze()
+    return timings
+
+
+def cpu_count():
+    """CPUs this process may use: its affinity mask, capped by a cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def worker_model():
+    """gunicorn settings for GUNICORN_WORKER_CLASS (gthread, sync or gevent) on this machine.
+
+    Requests mostly wait on remove.bg and Together.ai, so the default is
+    gthread: one process per CPU plus one, each serving GUNICORN_THREADS
+    (8) requests at once. sync runs 2 * CPUs + 1 single-request workers;
+    gevent runs CPUs + 1 workers of GUNICORN_WORKER_CONNECTIONS (200)
+    greenlets each. WEB_CONCURRENCY overrides the worker count.
+    """
+    worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+    cpus = cpu_count()
+    if worker_class == 'sync':
+        workers, threads = 2 * cpus + 1, 1
+    else:
+        workers = cpus + 1
+        threads = int(os.getenv('GUNICORN_THREADS', '8')) if worker_class == 'gthread' else 1
+    workers = int(os.getenv('WEB_CONCURRENCY', str(workers)))
+    return {
+        'worker_class': worker_class,
+        'workers': workers,
+        'threads': threads,
+        'worker_connections': int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '200')),
+    }
@@ -0,0 +1,582 @@
+"""Prometheus metrics, per-request sampling profiles and structured logs.
+
+Each process keeps its counters and histograms in memory and writes a
+snapshot of them to a SQLite file shared by every gunicorn worker on the
+host, every few seconds and whenever it serves /metrics. /metrics adds up
+the snapshots of all workers, so a scrape that lands on any one of them
+sees the whole server. Snapshots of workers that have exited are folded
+into a single row, so counters never go backwards when one is replaced.
+
+Recorded for every request: latency per endpoint, request and response
+sizes, and the number of database queries when an engine is instrumented
+with count_queries(). Upstream HTTP calls made through timed_adapter()
+record connect time (0 on a reused connection), time to first byte and
+total time. The SpeechToText app uses this same module through a symlink.
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+# Sent as `Authorization: Bearer <key>` or ?key=; /metrics is open when unset
+METRICS_KEY = os.getenv('METRICS_KEY')
+# Requests carrying `X-Profile: <PROFILE_KEY>` are profiled; disabled when unset
+PROFILE_KEY = os.getenv('PROFILE_KEY')
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'profiles'))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+log = logging.getLogger(__name__)
+
+
+class Counter:
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._sources = []
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def source(self, func):
+        """Also report the counts returned by `func()` as [(labels, value), ...]; usable as a decorator."""
+        self._sources.append(func)
+        return func
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _snapshot(self):
+        with self.registry.lock:
+            values = dict(self._values)
+        for func in self._sources:
+            try:
+                for labels, value in func():
+                    key = self._key(labels)
+                    values[key] = values.get(key, 0) + value
+            except Exception as e:
+                log.warning('Metric source for %s failed: %s', self.name, e)
+        return values
+
+    def _reset(self):
+        self._values = {}
+
+    @staticmethod
+    def _merge(total, value):
+        return (total or 0) + value
+
+    def _render(self, values):
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labels, key)} {_number(value)}'
+
+
+class Histogram(Counter):
+    def __init__(self, registry, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            # Per-bucket counts, then the sum and the count
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _snapshot(self):
+        with self.registry.lock:
+            return {key: list(counts) for key, counts in self._values.items()}
+
+    @staticmethod
+    def _merge(total, counts):
+        if total is None:
+            return list(counts)
+        return [a + b for a, b in zip(total, counts)]
+
+    def _render(self, values):
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(self.labels + ("le",), key + (_number(bound),))} {cumulative}'
+            yield f'{self.name}_bucket{_labels(self.labels + ("le",), key + ("+Inf",))} {counts[-1]}'
+            yield f'{self.name}_sum{_labels(self.labels, key)} {_number(counts[-2])}'
+            yield f'{self.name}_count{_labels(self.labels, key)} {counts[-1]}'
+
+
+class Metrics:
+    """This process's metrics, and the file their snapshots are shared through."""
+
+    def __init__(self, path=None, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.counts_queries = False
+        self.lock = threading.Lock()
+        self._metrics = {}
+        self._process = None
+        self._started_pid = None
+        self._local = threading.local()
+
+    def configure(self, path):
+        """Share snapshots through the SQLite file at `path`."""
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS snapshot ('
+            ' process TEXT PRIMARY KEY,'
+            ' pid INTEGER NOT NULL,'
+            ' updated REAL NOT NULL,'
+            ' data TEXT NOT NULL)'
+        )
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, help, labels, buckets))
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def reset(self):
+        """Forget this process's values; run in forked children so the master's aren't counted twice."""
+        # A fresh lock: another thread of the parent may have held this one while forking
+        self.lock = threading.Lock()
+        for metric in self._metrics.values():
+            metric._reset()
+        self._process = None
+        self._started_pid = None
+        self._local = threading.local()
+
+    def snapshot(self):
+        return {
+            name: {json.dumps(key): value for key, value in metric._snapshot().items()}
+            for name, metric in self._metrics.items()
+        }
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # Never reuse a connection inherited from a preloading gunicorn master
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def flush(self):
+        """Write this process's snapshot to the shared file."""
+        if not self.path:
+            return
+        if self._process is None:
+            self._process = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._connect().execute(
+            'INSERT OR REPLACE INTO snapshot (process, pid, updated, data) VALUES (?, ?, ?, ?)',
+            (self._process, os.getpid(), time.time(), json.dumps(self.snapshot())),
+        )
+
+    def collect(self):
+        """Every process's values added up: {name: {label values: value}}."""
+        if not self.path:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = self._fold_exited()
+        merged = {}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                totals = merged.setdefault(name, {})
+                for key, value in values.items():
+                    key = tuple(json.loads(key))
+                    totals[key] = metric._merge(totals.get(key), value)
+        return merged
+
+    def _fold_exited(self):
+        # Workers that are gone (or silent far longer than they flush) are
+        # added into the 'exited' row, keeping their counts in the totals
+        stale = time.time() - max(60, 12 * self.flush_interval)
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('SELECT process, pid, updated, data FROM snapshot').fetchall()
+            exited = [row for row in rows if row[0] != 'exited' and (row[2] < stale or not _alive(row[1]))]
+            if exited:
+                archive = next((json.loads(row[3]) for row in rows if row[0] == 'exited'), {})
+                for row in exited:
+                    for name, values in json.loads(row[3]).items():
+                        metric = self._metrics.get(name)
+                        if metric is None:
+                            continue
+                        totals = archive.setdefault(name, {})
+                        for key, value in values.items():
+                            totals[key] = metric._merge(totals.get(key), value)
+                conn.executemany('DELETE FROM snapshot WHERE process = ?', [(row[0],) for row in exited])
+                conn.execute(
+                    'INSERT OR REPLACE INTO snapshot (process, pid, updated, data) VALUES (?, 0, ?, ?)',
+                    ('exited', time.time(), json.dumps(archive)),
+                )
+                rows = conn.execute('SELECT process, pid, updated, data FROM snapshot').fetchall()
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return [json.loads(row[3]) for row in rows]
+
+    def render(self):
+        """All processes' metrics in the Prometheus text format."""
+        merged = self.collect()
+        lines = []
+        for name, metric in self._metrics.items():
+            kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(metric._render(merged.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+    def start(self):
+        """Flush in the background every flush_interval seconds; once per process."""
+        if not self.path or self._started_pid == os.getpid():
+            return
+        with self.lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+        threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True).start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning('Metrics flush failed: %s', e)
+
+
+def _number(value):
+    """Exact text for a sample value or bucket bound: no exponent for whole numbers, no rounding."""
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f'{{{pairs}}}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+metrics = Metrics()
+os.register_at_fork(after_in_child=metrics.reset)
+
+HTTP_REQUESTS = metrics.counter('http_requests_total', 'Requests served.', ('endpoint', 'method', 'status'))
+HTTP_LATENCY = metrics.histogram(
+    'http_request_duration_seconds', 'Time to serve a request, including streamed bodies.', ('endpoint', 'method'))
+REQUEST_BYTES = metrics.histogram('http_request_size_bytes', 'Request body size.', ('endpoint',), SIZE_BUCKETS)
+RESPONSE_BYTES = metrics.histogram(
+    'http_response_size_bytes', 'Response body size, when known up front.', ('endpoint',), SIZE_BUCKETS)
+DB_QUERIES = metrics.histogram(
+    'http_request_db_queries', 'Database queries run while serving a request.', ('endpoint',), COUNT_BUCKETS)
+UPSTREAM_LATENCY = metrics.histogram(
+    'upstream_request_duration_seconds',
+    'Upstream API calls: connect (0 on a reused connection), ttfb (to response headers) and total.',
+    ('upstream', 'phase'))
+UPSTREAM_REQUESTS = metrics.counter('upstream_requests_total', 'Upstream API calls by status.', ('upstream', 'status'))
+UPSTREAM_BYTES = metrics.histogram(
+    'upstream_payload_bytes', 'Bytes sent to and received from upstream APIs.', ('upstream', 'direction'), SIZE_BUCKETS)
+CACHE_LOOKUPS = metrics.counter('cache_lookups_total', 'Cache lookups by result.', ('cache', 'result'))
+
+
+def count_queries(engine):
+    """Count the queries `engine` runs during each request into http_request_db_queries."""
+    from flask import g, has_request_context
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g._telemetry_queries = g.get('_telemetry_queries', 0) + 1
+
+    metrics.counts_queries = True
+
+
+# Connect time of the connection (if any) opened by the current request in this thread
+_connect_time = threading.local()
+
+
+def timed_adapter(upstream, **kwargs):
+    """A requests HTTPAdapter (built with `kwargs`) that records upstream_* metrics as `upstream`."""
+    import requests
+    import urllib3
+
+    def timed(connection_class):
+        class TimedConnection(connection_class):
+            def connect(self):
+                start = time.perf_counter()
+                try:
+                    super().connect()
+                finally:
+                    _connect_time.seconds = getattr(_connect_time, 'seconds', 0) + time.perf_counter() - start
+        return TimedConnection
+
+    class TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+        ConnectionCls = timed(urllib3.connection.HTTPConnection)
+
+    class TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+        ConnectionCls = timed(urllib3.connection.HTTPSConnection)
+
+    class TimedAdapter(requests.adapters.HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+        def send(self, request, stream=False, **kwargs):
+            _connect_time.seconds = 0
+            start = time.perf_counter()
+            try:
+                response = super().send(request, stream=stream, **kwargs)
+            except requests.RequestException:
+                UPSTREAM_REQUESTS.inc(upstream=upstream, status='error')
+                raise
+            UPSTREAM_LATENCY.observe(_connect_time.seconds, upstream=upstream, phase='connect')
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start, upstream=upstream, phase='ttfb')
+            UPSTREAM_REQUESTS.inc(upstream=upstream, status=response.status_code)
+            body = request.body or b''
+            UPSTREAM_BYTES.observe(len(body) if isinstance(body, (bytes, str)) else 0, upstream=upstream, direction='sent')
+
+            def done():
+                UPSTREAM_LATENCY.observe(time.perf_counter() - start, upstream=upstream, phase='total')
+                UPSTREAM_BYTES.observe(response.raw.tell() if response.raw else 0, upstream=upstream, direction='received')
+
+            if not stream:
+                response.content
+                done()
+            else:
+                # Streamed bodies are done when the caller closes the response
+                close = response.close
+
+                def close_and_record():
+                    if not getattr(response, '_telemetry_closed', False):
+                        response._telemetry_closed = True
+                        done()
+                    close()
+                response.close = close_and_record
+            return response
+
+    return TimedAdapter(**kwargs)
+
+
+class SamplingProfiler:
+    """Samples one thread's stack every `interval` seconds and counts identical stacks.
+
+    profile() returns them in the folded format flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.profile()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def profile(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]))
+
+
+def init_app(app, path):
+    """Record request metrics for `app`, serve /metrics and profiles, and share snapshots through `path`."""
+    from flask import Response, abort, g, request, send_file
+
+    metrics.configure(path)
+
+    @app.before_request
+    def start_request():
+        g._telemetry_start = time.perf_counter()
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+        metrics.start()
+        if PROFILE_KEY and request.headers.get('X-Profile') == PROFILE_KEY:
+            g._telemetry_profiler = SamplingProfiler(threading.get_ident()).start()
+
+    @app.after_request
+    def tag_response(response):
+        if '_telemetry_start' not in g:
+            return response
+        g._telemetry_response = response
+        response.headers['X-Request-ID'] = g.request_id
+        if '_telemetry_profiler' in g:
+            g._telemetry_profile_name = f'{int(time.time())}-{request.endpoint or "unmatched"}-{g.request_id}.folded'
+            response.headers['X-Profile-Id'] = g._telemetry_profile_name
+        return response
+
+    # Teardown runs even when a view raises and after_request is skipped, so
+    # crashed requests are counted as 500s and their profilers stopped
+    @app.teardown_request
+    def record_request(exc):
+        start = g.pop('_telemetry_start', None)
+        if start is None:
+            return
+        endpoint = request.endpoint or 'unmatched'
+        method = request.method
+        queries = g.pop('_telemetry_queries', 0)
+        response = g.pop('_telemetry_response', None)
+        profiler = g.pop('_telemetry_profiler', None)
+        profile_name = g.pop('_telemetry_profile_name', None)
+        if profiler is not None and profile_name is None:
+            profile_name = f'{int(time.time())}-{endpoint}-{g.request_id}.folded'
+
+        def finished():
+            HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, method=method)
+            if profiler is not None:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                with open(os.path.join(PROFILE_DIR, profile_name), 'w') as f:
+                    f.write(profiler.stop())
+
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=method, status=500 if response is None else response.status_code)
+        if request.content_length is not None:
+            REQUEST_BYTES.observe(request.content_length, endpoint=endpoint)
+        if response is not None and response.content_length is not None:
+            RESPONSE_BYTES.observe(response.content_length, endpoint=endpoint)
+        if metrics.counts_queries:
+            DB_QUERIES.observe(queries, endpoint=endpoint)
+        if response is None:
+            finished()
+        else:
+            # Runs once a streamed body has been sent, not when it starts
+            response.call_on_close(finished)
+
+    def authorized():
+        if not METRICS_KEY:
+            return True
+        supplied = request.args.get('key') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+        return supplied == METRICS_KEY
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        if not authorized():
+            abort(401)
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics/profiles/<name>')
+    def request_profile(name):
+        if not PROFILE_KEY or request.args.get('key', request.headers.get('X-Profile')) != PROFILE_KEY:
+            abort(404)
+        path = os.path.join(PROFILE_DIR, os.path.basename(name))
+        if not os.path.exists(path):
+            abort(404)
+        return send_file(path, mimetype='text/plain')
+
+    configure_logging(app)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any `extra` fields and the request id."""
+
+    _standard = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self._standard})
+        if record.exc_info:
+            entry['exception'] = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+        return json.dumps(entry, default=str)
+
+
+class RequestFilter(logging.Filter):
+    def filter(self, record):
+        from flask import g, has_request_context, request
+        if has_request_context() and not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id')
+            record.endpoint = request.endpoint
+        return True
+
+
+def configure_logging(app=None):
+    """Route all logging through one handler: LOG_FORMAT=json|text, at LOG_LEVEL (default INFO)."""
+    handler = logging.StreamHandler()
+    if os.getenv('LOG_FORMAT', 'text') == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    handler.addFilter(RequestFilter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    if app is not None:
+        from flask.logging import default_handler
+        app.logger.removeHandler(default_handler)
@@ -0,0 +1,54 @@
+import gzip
+
+import pytest
+from flask import Flask, url_for
+
+import assets
+
+
+@pytest.fixture
+def app(tmp_path):
+    static = tmp_path / 'static'
+    static.mkdir()
+    (static / 'app.js').write_text('console.log("hello");\n' * 50)
+    (static / 'tiny.css').write_text('p{}')
+    (tmp_path / 'templates').mkdir()
+    (tmp_path / 'templates' / 'page.html').write_text('<script src="{{ url_for(\'static\', filename=\'app.js\') }}"></script>')
+    assets.build(str(static))
+
+    app = Flask(__name__, static_folder=str(static), template_folder=str(tmp_path / 'templates'))
+    assets.init_app(app)
+    return app
+
+
+def test_build_fingerprints_and_compresses(app):
+    manifest = assets.load_manifest(app.static_folder)
+    assert set(manifest) == {'app.js', 'tiny.css'}
+    with app.test_request_context():
+        assert url_for('static', filename='app.js') == f"/static/{manifest['app.js']}"
+
+    client = app.test_client()
+    response = client.get(f"/static/{manifest['app.js']}", headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == assets.IMMUTABLE
+    assert gzip.decompress(response.data).startswith(b'console.log')
+
+    # Too small to compress, still fingerprinted
+    response = client.get(f"/static/{manifest['tiny.css']}", headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers and response.data == b'p{}'
+
+
+def test_changed_source_is_served_unhashed(app, tmp_path):
+    (tmp_path / 'static' / 'app.js').write_text('changed')
+    assert 'app.js' not in assets.load_manifest(app.static_folder)
+
+
+def test_cached_page(app):
+    page = assets.CachedPage('page.html')
+    app.add_url_rule('/', 'index', page.response)
+    client = app.test_client()
+
+    response = client.get('/')
+    assert b'/static/dist/app.' in response.data
+    assert client.get('/', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/', headers={'Accept-Encoding': 'gzip'}).headers['Content-Encoding'] == 'gzip'
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+import jobqueue
+from jobqueue import CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobFailed, JobQueue, Worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / 'jobs.db'))
+
+
+def test_claims_by_priority_then_age(queue):
+    queue.register('low', lambda job: None, priority=-1, concurrency=10)
+    queue.register('high', lambda job: None, priority=5, concurrency=10)
+    first_low = queue.enqueue('low')
+    high = queue.enqueue('high')
+    second_low = queue.enqueue('low')
+
+    claimed = [queue.claim('w').id for _ in range(3)]
+    assert claimed == [high, first_low, second_low]
+    assert queue.claim('w') is None
+
+
+def test_concurrency_limit_per_type(queue):
+    queue.register('slow', lambda job: None, concurrency=1)
+    queue.register('other', lambda job: None, concurrency=1)
+    queue.enqueue('slow')
+    queue.enqueue('slow')
+    other = queue.enqueue('other')
+
+    running = queue.claim('a')
+    assert running.type == 'slow'
+    assert queue.claim('b').id == other
+    assert queue.claim('c') is None
+
+    queue.complete(running, {'ok': True})
+    assert queue.claim('c').type == 'slow'
+
+
+def test_retries_with_backoff_then_fails(queue):
+    def flaky(job):
+        raise RuntimeError(f'attempt {job.attempts}')
+
+    queue.register('flaky', flaky, max_attempts=2, backoff=0.05)
+    id = queue.enqueue('flaky')
+
+    queue.run(queue.claim('w'))
+    job = queue.get(id)
+    assert job['status'] == QUEUED and job['error'] == 'attempt 1'
+    assert job['run_after'] > time.time()
+    assert queue.claim('w') is None
+
+    time.sleep(0.1)
+    queue.run(queue.claim('w'))
+    job = queue.get(id)
+    assert job['status'] == FAILED and job['error'] == 'attempt 2' and job['attempts'] == 2
+
+
+def test_job_failed_and_retry_after(queue):
+    class Busy(Exception):
+        retry_after = 30
+
+    def handler(job):
+        if job.payload == 'bad':
+            raise JobFailed('bad input')
+        raise Busy()
+
+    queue.register('upstream', handler, concurrency=2)
+    bad = queue.enqueue('upstream', 'bad')
+    busy = queue.enqueue('upstream', 'busy')
+    queue.run(queue.claim('w'))
+    queue.run(queue.claim('w'))
+
+    assert queue.get(bad)['status'] == FAILED
+    assert queue.get(busy)['status'] == QUEUED
+    assert queue.get(busy)['run_after'] - time.time() > 25
+
+
+def test_cancel_queued_and_running(queue):
+    started = threading.Event()
+
+    def long_running(job):
+        started.set()
+        while True:
+            job.progress(step=1)
+            time.sleep(0.01)
+
+    queue.register('long', long_running, concurrency=2)
+    waiting = queue.enqueue('long', data=b'input')
+    assert queue.cancel(waiting) == CANCELLED
+
+    running = queue.enqueue('long')
+    job = queue.claim('w')
+    thread = threading.Thread(target=queue.run, args=(job,))
+    thread.start()
+    started.wait(1)
+    assert queue.cancel(running) == RUNNING
+    thread.join(1)
+
+    assert queue.get(running)['status'] == CANCELLED
+    assert queue.get(running)['progress'] == {'step': 1}
+    assert queue.cancel('missing') is None
+
+
+def test_stale_running_job_is_requeued(queue, monkeypatch):
+    queue.register('work', lambda job: None)
+    id = queue.enqueue('work', data=b'input')
+    stale = queue.claim('dead-worker')
+
+    monkeypatch.setattr(jobqueue, 'STALE_AFTER', -1)
+    job = queue.claim('w')
+    assert job.id == id and job.attempts == 2
+
+    # The stale attempt finishing late must not touch the new attempt's files
+    queue.complete(stale, {})
+    assert queue.get(id)['status'] == RUNNING
+    with open(job.input_path, 'rb') as f:
+        assert f.read() == b'input'
+
+
+def test_worker_runs_jobs_and_keeps_output(queue):
+    def shout(job):
+        with open(job.input_path, 'rb') as f, open(job.output_path, 'wb') as out:
+            out.write(f.read().upper())
+        return {'length': job.payload['length']}
+
+    queue.register('shout', shout)
+    id = queue.enqueue('shout', {'length': 5}, data=b'hello')
+    worker = Worker(queue, threads=2, poll_interval=0.01).start()
+    try:
+        deadline = time.time() + 5
+        while queue.get(id)['status'] != DONE and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        worker.stop()
+
+    job = queue.get(id)
+    assert job['result'] == {'length': 5} and job['has_output']
+    with open(queue.output_path(id), 'rb') as f:
+        assert f.read() == b'HELLO'
+
+    assert queue.purge(older_than=-1) == 1
+    assert queue.get(id) is None
@@ -0,0 +1,58 @@
+import pytest
+
+from ratelimit import Limit, RateLimited, RateLimiter
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    return RateLimiter(str(tmp_path / 'ratelimit.db'))
+
+
+def test_parse_limits():
+    assert Limit.parse('10/minute').rate == pytest.approx(10 / 60)
+    assert Limit.parse('5/30s').period == 30
+    assert Limit.parse('500/days').period == 86400
+    assert Limit.parse('') is None and Limit.parse('off') is None
+    with pytest.raises(ValueError):
+        Limit.parse('ten per minute')
+
+
+def test_bucket_allows_burst_then_refills(limiter, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('ratelimit.time.time', lambda: now[0])
+    limiter.configure('upload', '3/minute')
+
+    assert [limiter.hit('upload', 'a') for _ in range(3)] == [0, 0, 0]
+    assert limiter.hit('upload', 'a') == pytest.approx(20)
+    # Buckets are per client
+    assert limiter.hit('upload', 'b') == 0
+
+    now[0] += 20
+    assert limiter.peek('upload', 'a') == 0
+    assert limiter.hit('upload', 'a') == 0
+    assert limiter.hit('upload', 'a') > 0
+
+
+def test_upstream_check_and_usage(limiter):
+    limiter.configure('api', '2/hour', upstream=True)
+    limiter.configure('analysis', '10/minute')
+    limiter.check('api')
+    limiter.check('api')
+    with pytest.raises(RateLimited) as error:
+        limiter.check('api')
+    assert error.value.retry_after == pytest.approx(1800, rel=0.01)
+
+    limiter.hit('analysis', 'alice')
+    limiter.hit('analysis', 'alice')
+    limiter.hit('analysis', 'bob')
+    # Unlimited scopes are counted too
+    limiter.hit('qr', 'bob')
+
+    report = limiter.usage()
+    assert report['scopes']['api'] == {'limit': '2/3600s', 'allowed': 2, 'rejected': 1, 'tokens_left': 0.0}
+    assert report['clients']['alice'] == {'analysis': {'allowed': 2, 'rejected': 0}}
+    assert set(report['clients']['bob']) == {'analysis', 'qr'}
+
+    mine = limiter.usage(client='alice')
+    assert list(mine['clients']) == ['alice']
+    assert mine['scopes']['analysis']['tokens_left'] == pytest.approx(8, abs=0.1)
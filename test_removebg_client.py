@@ -0,0 +1,59 @@
+import pytest
+
+from removebg_client import CircuitBreaker, CircuitOpenError, RemoveBgClient, RemoveBgError
+from removebg_stub import RemoveBgStub
+
+
+@pytest.fixture
+def stub():
+    server = RemoveBgStub().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(stub, **kwargs):
+    kwargs.setdefault('backoff_base', 0.01)
+    return RemoveBgClient('test-key', url=stub.url, **kwargs)
+
+
+def test_returns_png_bytes(stub):
+    client = make_client(stub)
+    assert client.remove_background(b'image').startswith(b'\x89PNG')
+    assert client.stats()['calls'] == 1
+
+
+def test_retries_on_429_and_5xx(stub):
+    stub.statuses = [429, 502]
+    client = make_client(stub)
+    assert client.remove_background(b'image').startswith(b'\x89PNG')
+    assert stub.requests == 3
+    assert client.stats()['retries'] == 2
+
+
+def test_does_not_retry_client_errors(stub):
+    stub.statuses = [400]
+    client = make_client(stub)
+    with pytest.raises(RemoveBgError) as excinfo:
+        client.remove_background(b'image')
+    assert excinfo.value.status_code == 400
+    assert stub.requests == 1
+
+
+def test_circuit_opens_after_repeated_failures(stub):
+    stub.error_rate = 1.0
+    client = make_client(stub, max_retries=1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    with pytest.raises(RemoveBgError):
+        client.remove_background(b'image')
+    with pytest.raises(CircuitOpenError):
+        client.remove_background(b'image')
+    assert stub.requests == 2
+
+
+def test_retries_stop_at_the_deadline(stub):
+    stub.latency = 0.3
+    stub.error_rate = 1.0
+    client = make_client(stub, max_retries=10, deadline=1.5)
+    with pytest.raises(RemoveBgError):
+        client.remove_background(b'image')
+    assert stub.requests < 5
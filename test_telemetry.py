@@ -0,0 +1,118 @@
+import sqlite3
+
+import pytest
+import requests
+from flask import Flask, Response
+
+import telemetry
+from removebg_stub import RemoveBgStub
+from telemetry import Metrics
+
+
+def test_render_counters_and_histograms():
+    registry = Metrics()
+    requests = registry.counter('jobs_total', 'Jobs.', ('type',))
+    latency = registry.histogram('job_seconds', 'Job time.', buckets=(0.1, 1))
+    requests.inc(type='a')
+    requests.inc(2, type='a')
+    requests.source(lambda: [({'type': 'b'}, 5)])
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(3)
+
+    text = registry.render()
+    assert '# TYPE jobs_total counter' in text
+    assert 'jobs_total{type="a"} 3' in text
+    assert 'jobs_total{type="b"} 5' in text
+    assert 'job_seconds_bucket{le="0.1"} 1' in text
+    assert 'job_seconds_bucket{le="1"} 2' in text
+    assert 'job_seconds_bucket{le="+Inf"} 3' in text
+    assert 'job_seconds_count 3' in text
+    assert 'job_seconds_sum 3.55' in text
+
+
+def test_large_values_and_bounds_are_exact():
+    registry = Metrics()
+    registry.counter('bytes_total', 'Bytes.').inc(1234567)
+    registry.histogram('size_bytes', 'Sizes.', buckets=(4194304,)).observe(123456789)
+
+    text = registry.render()
+    assert 'bytes_total 1234567' in text
+    assert 'size_bytes_bucket{le="4194304"} 0' in text
+    assert 'size_bytes_sum 123456789' in text
+
+
+def test_processes_are_added_up_and_exited_ones_kept(tmp_path):
+    path = str(tmp_path / 'metrics.db')
+    workers = [Metrics(), Metrics()]
+    for worker in workers:
+        worker.configure(path)
+        worker.counter('hits_total', 'Hits.').inc(2)
+        worker.flush()
+
+    assert workers[0].collect()['hits_total'][()] == 4
+
+    # A worker that has exited: its row is folded into 'exited' and still counted
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE snapshot SET pid = 999999999 WHERE process = ?", (workers[1]._process,))
+    conn.commit()
+    assert workers[0].collect()['hits_total'][()] == 4
+    processes = {row[0] for row in conn.execute('SELECT process FROM snapshot')}
+    assert processes == {workers[0]._process, 'exited'}
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = Flask(__name__)
+    telemetry.init_app(app, str(tmp_path / 'metrics.db'))
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        return Response(b'x' * 1000)
+
+    return app.test_client()
+
+
+def test_metrics_endpoint_and_upstream_timings(client):
+    response = client.post('/echo', data=b'hello')
+    assert response.headers['X-Request-ID']
+    response.close()
+
+    stub = RemoveBgStub().start()
+    try:
+        session = requests.Session()
+        session.mount('http://', telemetry.timed_adapter('stub'))
+        assert session.post(stub.url, data=b'image', headers={'X-Api-Key': 'key'}).status_code == 200
+    finally:
+        stub.shutdown()
+        stub.server_close()
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'http_requests_total{endpoint="echo",method="POST",status="200"}' in text
+    assert 'http_request_duration_seconds_count{endpoint="echo",method="POST"}' in text
+    assert 'http_response_size_bytes_sum{endpoint="echo"} 1000' in text
+    assert 'upstream_requests_total{upstream="stub",status="200"}' in text
+    for phase in ('connect', 'ttfb', 'total'):
+        assert f'upstream_request_duration_seconds_count{{upstream="stub",phase="{phase}"}}' in text
+
+
+def test_crashed_requests_are_counted_and_profiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, 'PROFILE_KEY', 'secret')
+    monkeypatch.setattr(telemetry, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    app = Flask(__name__)
+    app.testing = True
+    telemetry.init_app(app, str(tmp_path / 'metrics.db'))
+
+    @app.route('/crash')
+    def crash():
+        raise RuntimeError('boom')
+
+    client = app.test_client()
+    with pytest.raises(RuntimeError):
+        client.get('/crash', headers={'X-Profile': 'secret'})
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'http_requests_total{endpoint="crash",method="GET",status="500"}' in text
+    assert 'http_request_duration_seconds_count{endpoint="crash",method="GET"} 1' in text
+    profiles = list((tmp_path / 'profiles').iterdir())
+    assert len(profiles) == 1 and '-crash-' in profiles[0].name